@@ -0,0 +1,199 @@
+import os
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SAMPLE_ROWS = 3
+# Most frequent values kept per column and buckets per numeric histogram
+CATALOG_TOP_VALUES = int(os.getenv("CATALOG_TOP_VALUES", "10"))
+CATALOG_HISTOGRAM_BINS = int(os.getenv("CATALOG_HISTOGRAM_BINS", "20"))
+# Text columns with at most this many distinct values, repeated across rows, count as categories
+CATEGORICAL_MAX_DISTINCT = int(os.getenv("CATEGORICAL_MAX_DISTINCT", "50"))
+
+
+def tabular_tables(conn):
+    """Tables created from Excel sheets, with the workbook and sheet they came from"""
+    return conn.execute("SELECT workbook, sheet, table_name FROM tabular_data").fetchall()
+
+
+def _scalar(value):
+    """Convert a pandas/NumPy value to a plain Python value SQLite and JSON can store"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+
+def date_values(series, column_type):
+    """The column as datetimes if it holds dates (timestamps or yyyymmdd integers), else None"""
+    if series.dtype.kind == 'M':
+        return series.dropna()
+    if column_type in ('DATE', 'DATETIME', 'TIMESTAMP'):
+        parsed = pd.to_datetime(series.dropna(), errors='coerce')
+        return parsed.dropna() if parsed.notna().any() else None
+    if series.dtype.kind in 'iuf':
+        values = series.dropna()
+        if len(values) and values.between(19000101, 29991231).all() and (values % 1 == 0).all():
+            parsed = pd.to_datetime(values.astype('int64').astype(str), format='%Y%m%d', errors='coerce')
+            return parsed if parsed.notna().all() else None
+    return None
+
+
+def histogram(values, dates):
+    """Monthly row counts for date columns, equal-width buckets for other numeric columns"""
+    if dates is not None:
+        counts = dates.dt.strftime('%Y-%m').value_counts().sort_index()
+        return {'kind': 'month', 'buckets': counts.index.tolist(), 'counts': counts.tolist()}
+    counts, edges = np.histogram(values.to_numpy(dtype=float), bins=CATALOG_HISTOGRAM_BINS)
+    return {'kind': 'numeric', 'edges': edges.tolist(), 'counts': counts.tolist()}
+
+
+def column_statistics(series, column_type=''):
+    """
+    Null and distinct counts, min/max, the most frequent values and, for numeric and date
+    columns, a histogram, computed with vectorized pandas operations
+    """
+    if column_type == 'INTEGER' and series.dtype.kind == 'f':
+        # Integer columns with nulls are read as floats; keep their values integral
+        series = series.astype('Int64')
+    values = series.dropna()
+    stats = {
+        'null_count': int(len(series) - len(values)),
+        'distinct_count': int(values.nunique()),
+        'min_value': None,
+        'max_value': None,
+        'top_values': [],
+        'histogram': None,
+        'is_date': False,
+    }
+    if not len(values):
+        return stats
+    numeric = series.dtype.kind in 'biufM' or str(series.dtype) == 'Int64'
+    if numeric:
+        stats['min_value'], stats['max_value'] = _scalar(values.min()), _scalar(values.max())
+    else:
+        # Mixed object columns are compared as text
+        text = values.astype(str)
+        stats['min_value'], stats['max_value'] = text.min(), text.max()
+    top = values.value_counts().head(CATALOG_TOP_VALUES)
+    stats['top_values'] = [[_scalar(value), int(count)] for value, count in top.items()]
+    dates = date_values(values, column_type)
+    if dates is not None or (numeric and series.dtype.kind != 'M'):
+        stats['is_date'] = dates is not None
+        stats['histogram'] = histogram(values, dates)
+    return stats
+
+
+def is_categorical(stats):
+    """Whether column statistics describe a text column with a small set of repeated values"""
+    return (stats.get('histogram') is None and bool(stats.get('top_values'))
+            and stats['distinct_count'] <= CATEGORICAL_MAX_DISTINCT and stats['distinct_count'] < stats['row_count'])
+
+
+def describe_tables(conn):
+    """
+    Schema document for every tabular table: columns with their statistics, row count, a few
+    sample rows and the workbook and sheet the table came from. Internal tables are left out.
+    """
+    document = {}
+    for workbook, sheet, table_name in tabular_tables(conn):
+        columns = conn.execute(f'PRAGMA table_info("{table_name}")').fetchall()
+        if not columns:
+            continue
+        frame = pd.read_sql_query(f'SELECT * FROM "{table_name}"', conn)
+        table_columns = []
+        for position, (_, name, col_type, _, _, pk) in enumerate(columns):
+            stats = dict(column_statistics(frame.iloc[:, position], col_type.upper()), row_count=len(frame))
+            table_columns.append({'name': name, 'type': col_type, 'pk': pk == 1, 'stats': stats})
+        # Samples are read as stored, so integers stay integers where pandas would widen them
+        sample = conn.execute(f'SELECT * FROM "{table_name}" LIMIT {SAMPLE_ROWS}').fetchall()
+        document[table_name] = {
+            'columns': table_columns,
+            'sample_data': [{col[1]: value for col, value in zip(columns, row)} for row in sample],
+            'row_count': len(frame),
+            'source': {'workbook': workbook, 'sheet': sheet},
+        }
+    return document
+
+
+def build_catalog(conn):
+    """
+    Compute per-column statistics for every tabular table and store them, together with the
+    schema document served by /api/schema, in the catalogue tables. Run at the end of ingestion.
+    """
+    document = describe_tables(conn)
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS column_stats")
+    cursor.execute("""
+    CREATE TABLE column_stats (
+        table_name TEXT,
+        column_name TEXT,
+        position INTEGER,
+        type TEXT,
+        row_count INTEGER,
+        null_count INTEGER,
+        distinct_count INTEGER,
+        min_value,
+        max_value,
+        top_values TEXT,
+        histogram TEXT,
+        is_date INTEGER,
+        PRIMARY KEY (table_name, column_name)
+    )
+    """)
+    cursor.execute("DROP TABLE IF EXISTS table_stats")
+    cursor.execute("""
+    CREATE TABLE table_stats (
+        table_name TEXT PRIMARY KEY,
+        workbook TEXT,
+        sheet TEXT,
+        row_count INTEGER
+    )
+    """)
+    for table_name, table in document.items():
+        cursor.execute("INSERT INTO table_stats VALUES (?, ?, ?, ?)",
+                       (table_name, table['source']['workbook'], table['source']['sheet'], table['row_count']))
+        for position, column in enumerate(table['columns']):
+            stats = column['stats']
+            cursor.execute(
+                "INSERT INTO column_stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (table_name, column['name'], position, column['type'], stats['row_count'], stats['null_count'],
+                 stats['distinct_count'], stats['min_value'], stats['max_value'],
+                 json.dumps(stats['top_values'], default=str), json.dumps(stats['histogram']), int(stats['is_date']))
+            )
+
+    cursor.execute("DROP TABLE IF EXISTS schema_document")
+    cursor.execute("CREATE TABLE schema_document (name TEXT PRIMARY KEY, document TEXT)")
+    cursor.execute("INSERT INTO schema_document VALUES ('api_schema', ?)", (json.dumps(document, default=str),))
+    conn.commit()
+    # SQLite's own statistics (sqlite_stat1) for the query planner's index and join choices
+    cursor.execute("ANALYZE")
+    conn.commit()
+    print(f"Catalogued {sum(len(table['columns']) for table in document.values())} columns in {len(document)} tables")
+    return document
+
+
+def read_schema_document(conn):
+    """Schema document precomputed at ingest; databases ingested before the catalogue existed get it computed live"""
+    try:
+        row = conn.execute("SELECT document FROM schema_document WHERE name = 'api_schema'").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    if row:
+        return json.loads(row[0])
+    return describe_tables(conn)
+
+
+def table_row_counts(conn):
+    """Row counts of the tabular tables from the catalogue; empty when the database has no catalogue"""
+    try:
+        return dict(conn.execute("SELECT table_name, row_count FROM table_stats").fetchall())
+    except sqlite3.OperationalError:
+        return {}
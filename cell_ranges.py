@@ -0,0 +1,160 @@
+import os
+import re
+import sqlite3
+from dotenv import load_dotenv
+from openpyxl.utils import column_index_from_string, get_column_letter
+from sql_guard import execution_limits, SQL_TIME_BUDGET_SECONDS
+
+load_dotenv()
+
+# Largest block, in cells, one range may cover; the dense array is built in memory
+RANGE_MAX_CELLS = int(os.getenv("RANGE_MAX_CELLS", "1000000"))
+RANGE_MAX_RANGES = int(os.getenv("RANGE_MAX_RANGES", "100"))
+
+# 'Sheet name'!B5:H40, Sheet!B5, B5:H40, B:D or 5:10
+RANGE_PATTERN = re.compile(
+    r"^(?:(?:'(?P<quoted>(?:[^']|'')+)'|(?P<sheet>[^!']+))!)?"
+    r"(?P<start>\$?[A-Za-z]{0,3}\$?\d*)(?::(?P<end>\$?[A-Za-z]{0,3}\$?\d*))?$")
+CELL_PATTERN = re.compile(r"^\$?([A-Za-z]{0,3})\$?(\d*)$")
+
+
+def split_range(reference):
+    """Split 'Sheet'!A1:B2 into the sheet name (or None) and the A1 range"""
+    match = RANGE_PATTERN.match(reference.strip())
+    if not match or not match.group('start'):
+        raise ValueError(f"Invalid range: {reference}")
+    sheet = match.group('quoted').replace("''", "'") if match.group('quoted') else match.group('sheet')
+    cells = match.group('start') + (f":{match.group('end')}" if match.group('end') else "")
+    return sheet, cells
+
+
+def parse_a1_range(cells, max_row, max_column):
+    """
+    Bounds (min_row, min_col, max_row, max_col) of an A1 range; whole columns (B:D) and whole rows
+    (5:10) extend to the used area of the sheet
+    """
+    start, _, end = cells.partition(":")
+    end = end or start
+    bounds = []
+    for part, default_row, default_col in ((start, 1, 1), (end, max_row, max_column)):
+        letters, digits = CELL_PATTERN.match(part).groups()
+        if not letters and not digits:
+            raise ValueError(f"Invalid range: {cells}")
+        bounds.append((int(digits) if digits else default_row,
+                       column_index_from_string(letters.upper()) if letters else default_col))
+    (first_row, first_col), (last_row, last_col) = bounds
+    # B5:A1 names the same block as A1:B5
+    return min(first_row, last_row), min(first_col, last_col), max(first_row, last_row), max(first_col, last_col)
+
+
+def typed_value(value, data_type, cached_value):
+    """Cell value as its Excel type: numbers, booleans, ISO dates, text, or a formula's last calculated value"""
+    if data_type == 'f':
+        return cached_value
+    if value is None:
+        return None
+    if data_type == 'n':
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+    if data_type == 'b':
+        return value == 'True'
+    if data_type == 'd':
+        return value.replace(' ', 'T')
+    return value
+
+
+def find_sheet(conn, workbook, sheet):
+    """Sheet id, used size and workbook file name; workbook may omit the directory and extension"""
+    rows = conn.execute("""
+        SELECT s.id, s.max_row, s.max_column, w.filename
+        FROM sheets s JOIN workbooks w ON w.id = s.workbook_id
+        WHERE s.sheet_name = ?
+    """, (sheet,)).fetchall()
+    for row in rows:
+        filename = os.path.basename(row[3].replace("\\", "/"))
+        if workbook in (row[3], filename, os.path.splitext(filename)[0]):
+            return row
+    raise LookupError(f"Sheet '{sheet}' not found in workbook '{workbook}'")
+
+
+def read_range(conn, workbook, sheet, cells, formulas=False, time_budget=SQL_TIME_BUDGET_SECONDS):
+    """
+    Read a block of a stored sheet as a dense 2-D list of typed values (None for empty cells),
+    with the formulas of the block in a second array when formulas is true. sheet may be None when
+    cells names it, as in 'Part I'!B5:H40.
+    """
+    range_sheet, cells = split_range(cells)
+    sheet = sheet or range_sheet
+    if not sheet:
+        raise ValueError("A sheet is required, either as sheet or in the range ('Sheet'!A1:B2)")
+    sheet_id, max_row, max_column, filename = find_sheet(conn, workbook, sheet)
+    min_row, min_col, last_row, last_col = parse_a1_range(cells, max_row or 1, max_column or 1)
+    height, width = last_row - min_row + 1, last_col - min_col + 1
+    if height * width > RANGE_MAX_CELLS:
+        raise ValueError(f"Range {cells} covers {height * width:,} cells (limit {RANGE_MAX_CELLS:,})")
+
+    # Indexed scan of the block's rows on (sheet_id, row_num, col_num)
+    try:
+        with execution_limits(conn, {'total': time_budget, 'remaining': time_budget}):
+            rows = conn.execute("""
+                SELECT row_num, col_num, value, data_type, cached_value, is_formula
+                FROM cells
+                WHERE sheet_id = ? AND row_num BETWEEN ? AND ? AND col_num BETWEEN ? AND ?
+            """, (sheet_id, min_row, last_row, min_col, last_col)).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such column' in str(e):
+            raise LookupError("Cell positions were not recorded for this database; run the ingestion again")
+        raise
+
+    values = [[None] * width for _ in range(height)]
+    formula_grid = [[None] * width for _ in range(height)] if formulas else None
+    for row_num, col_num, value, data_type, cached_value, is_formula in rows:
+        values[row_num - min_row][col_num - min_col] = typed_value(value, data_type, cached_value)
+        if formulas and is_formula:
+            formula_grid[row_num - min_row][col_num - min_col] = value
+    block = {
+        'workbook': filename,
+        'sheet': sheet,
+        'range': f"{get_column_letter(min_col)}{min_row}:{get_column_letter(last_col)}{last_row}",
+        'values': values,
+    }
+    if formulas:
+        block['formulas'] = formula_grid
+    return block
+
+
+def parse_reference(reference):
+    """Split 'Workbook/Sheet!A1:B2' into a range request; sheet names cannot contain '/'"""
+    location, _, cells = reference.rpartition('!')
+    workbook, _, sheet = location.rpartition('/')
+    if not workbook or not sheet:
+        raise ValueError(f"Invalid reference, expected Workbook/Sheet!A1:B2: {reference}")
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return {'workbook': workbook, 'sheet': sheet, 'range': cells}
+
+
+def read_ranges(conn, requests, formulas=False):
+    """
+    Read many ranges in one call. Each request is a dict with workbook, sheet (optional when the
+    range names it) and range, or a 'Workbook/Sheet!A1:B2' string; a request that fails gets
+    success False and an error in its place.
+    """
+    if len(requests) > RANGE_MAX_RANGES:
+        raise ValueError(f"At most {RANGE_MAX_RANGES} ranges per call")
+    blocks = []
+    for item in requests:
+        try:
+            if isinstance(item, str):
+                item = dict(parse_reference(item), reference=item)
+            block = read_range(conn, item.get('workbook', ''), item.get('sheet'), item.get('range', ''),
+                               item.get('formulas', formulas))
+            blocks.append(dict(block, success=True))
+        except (ValueError, LookupError) as e:
+            if isinstance(item, str):
+                item = {'reference': item}
+            blocks.append({'success': False, 'error': str(e), 'workbook': item.get('workbook'),
+                           'sheet': item.get('sheet'), 'range': item.get('range', item.get('reference'))})
+    return blocks
@@ -0,0 +1,122 @@
+import os
+import re
+import sqlite3
+from dotenv import load_dotenv
+from sql_guard import SQLGuardError, execution_limits, SQL_TIME_BUDGET_SECONDS
+
+load_dotenv()
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "50"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "500"))
+# Words of context around the match in each snippet, and the markers placed around matched words
+SNIPPET_TOKENS = 12
+SNIPPET_START = "<mark>"
+SNIPPET_END = "</mark>"
+
+SEARCH_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def create_search_index(conn):
+    """
+    Create the full-text index over cell values and the triggers that keep it in step with every
+    insert, replace, update and delete on cells. An index added to an existing database is filled
+    from the cells already stored.
+    """
+    cursor = conn.cursor()
+    exists = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'cells_fts'").fetchone()
+    cursor.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS cells_fts USING fts5(
+        value,
+        content='cells',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS cells_fts_insert AFTER INSERT ON cells BEGIN
+        INSERT INTO cells_fts (rowid, value) VALUES (new.id, new.value);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS cells_fts_delete AFTER DELETE ON cells BEGIN
+        INSERT INTO cells_fts (cells_fts, rowid, value) VALUES ('delete', old.id, old.value);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS cells_fts_update AFTER UPDATE OF value ON cells BEGIN
+        INSERT INTO cells_fts (cells_fts, rowid, value) VALUES ('delete', old.id, old.value);
+        INSERT INTO cells_fts (rowid, value) VALUES (new.id, new.value);
+    END
+    """)
+    # INSERT OR REPLACE removes the old row without firing delete triggers unless this is on
+    cursor.execute("PRAGMA recursive_triggers = ON")
+    if not exists:
+        cursor.execute("INSERT INTO cells_fts (cells_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def fts_query(text):
+    """
+    MATCH expression for free text: every word must occur; a trailing * makes the last word a
+    prefix. Returns None when the text has no searchable words.
+    """
+    terms = SEARCH_TERM_PATTERN.findall(text)
+    if not terms:
+        return None
+    # Terms are quoted so FTS5 operators and column filters in the input are taken literally
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    # Whole words stream from the index in rowid order; prefixes merge every matching term first
+    if text.rstrip().endswith("*"):
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_cells(conn, text, offset=0, limit=SEARCH_PAGE_SIZE, workbook=None, sheet=None, after=None,
+                 time_budget=SQL_TIME_BUDGET_SECONDS):
+    """
+    Find cells whose value contains the words of text, in workbook and sheet order. Returns
+    (hits, has_more, next_cursor) where each hit has the workbook, sheet, coordinate, value, whether
+    it is a formula and a snippet with the matched words marked. workbook and sheet restrict the
+    search. Pages continue by offset or, in constant time, after the cursor of the previous page.
+    """
+    match = fts_query(text)
+    if match is None:
+        return [], False, None
+    limit = max(1, min(int(limit), SEARCH_MAX_PAGE_SIZE))
+    conditions = ["cells_fts MATCH ?"]
+    params = [match]
+    if workbook:
+        conditions.append("w.filename = ?")
+        params.append(workbook)
+    if sheet:
+        conditions.append("s.sheet_name = ?")
+        params.append(sheet)
+    if after is not None:
+        conditions.append("cells_fts.rowid > ?")
+        params.append(int(after))
+        offset = 0
+    sql = f"""
+        SELECT c.id, w.filename, s.sheet_name, c.coordinate, c.value, c.is_formula,
+               snippet(cells_fts, 0, ?, ?, '...', {SNIPPET_TOKENS})
+        FROM cells_fts
+        JOIN cells c ON c.id = cells_fts.rowid
+        JOIN sheets s ON s.id = c.sheet_id
+        JOIN workbooks w ON w.id = s.workbook_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY cells_fts.rowid
+        LIMIT ? OFFSET ?
+    """
+    params = [SNIPPET_START, SNIPPET_END] + params + [limit + 1, int(offset)]
+    try:
+        with execution_limits(conn, {'total': time_budget, 'remaining': time_budget}):
+            rows = conn.execute(sql, params).fetchall()
+    except sqlite3.OperationalError as e:
+        if 'no such table' in str(e):
+            raise SQLGuardError('no_search_index', "The search index has not been built; run the ingestion again")
+        raise
+    hits = [{'workbook': workbook, 'sheet': sheet, 'coordinate': coordinate, 'value': value,
+             'isFormula': bool(is_formula), 'snippet': snippet}
+            for _, workbook, sheet, coordinate, value, is_formula, snippet in rows[:limit]]
+    has_more = len(rows) > limit
+    return hits, has_more, rows[limit - 1][0] if has_more else None
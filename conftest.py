@@ -0,0 +1 @@
+# Lets pytest import the application modules, which live at the repository root
@@ -0,0 +1,114 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Idle read-only connections kept per database
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "8"))
+# Bytes of the database file memory-mapped by each connection
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+# Page cache per connection in KiB
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+
+def database_version(db_path):
+    """Version stamp of the database file; ingestion replaces the file, which changes it"""
+    stat = os.stat(db_path)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def open_read_only(db_path):
+    """Open a read-only connection tuned for repeated reads of the query database"""
+    uri = "file:" + os.path.abspath(db_path).replace("\\", "/").replace("?", "%3f").replace("#", "%23") + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+class ConnectionPool:
+    """
+    Reusable read-only connections to one database file. Connections are handed to one thread at a
+    time and returned after use; all of them are replaced when the file changes after an ingest.
+    """
+    def __init__(self, db_path, max_idle=SQLITE_POOL_SIZE):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self._idle = []
+        self._version = None
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'reused': 0, 'closed': 0}
+
+    def _close(self, conn):
+        conn.close()
+        self.stats['closed'] += 1
+
+    def acquire(self):
+        """Take an idle connection, or open a new one if none is free"""
+        version = database_version(self.db_path)
+        with self._lock:
+            if version != self._version:
+                for conn in self._idle:
+                    self._close(conn)
+                self._idle = []
+                self._version = version
+            if self._idle:
+                self.stats['reused'] += 1
+                return self._idle.pop(), version
+            self.stats['opened'] += 1
+        return open_read_only(self.db_path), version
+
+    def release(self, conn, version):
+        """Return a connection to the pool, closing it if the pool is full or the file has changed"""
+        with self._lock:
+            if version == self._version and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+            self._close(conn)
+
+    def close_all(self):
+        """Close every idle connection"""
+        with self._lock:
+            for conn in self._idle:
+                self._close(conn)
+            self._idle = []
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_path):
+    """Return the connection pool for a database path"""
+    key = os.path.abspath(db_path)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(db_path)
+        return _pools[key]
+
+
+@contextmanager
+def read_connection(db_path):
+    """Borrow a pooled read-only connection for the duration of a with block"""
+    pool = get_pool(db_path)
+    conn, version = pool.acquire()
+    try:
+        yield conn
+    except BaseException:
+        # A connection left inside a transaction by an error is rolled back before it is reused
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        pool.release(conn, version)
+
+
+def get_pool_stats():
+    """Connection counts per pooled database"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {pool.db_path: dict(pool.stats, idle=len(pool._idle)) for pool in pools}
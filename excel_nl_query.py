@@ -1,13 +1,15 @@
+import time
+# Started before the other imports so import_seconds covers pandas and the local modules too
+_import_started = time.perf_counter()
 import os
-import sqlite3
+import threading
+import hashlib
 import pandas as pd
 import json
 from dotenv import load_dotenv
-from groq import Groq
-from sentence_transformers import SentenceTransformer
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_text_splitters import CharacterTextSplitter
+from sql_guard import SQLGuardError
+from db_pool import read_connection, database_version
+from rollups import route_to_rollup
 
 # Load environment variables
 load_dotenv()
@@ -15,81 +17,158 @@ load_dotenv()
 # Constants from .env
 DB_FILENAME = os.getenv("DATABASE_PATH", "excel_data.db")
 CHROMADB_DIR = os.getenv("VECTOR_STORE_PATH", "vectorstore")
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_PATH", "vectorindex")
+# "numpy" for the in-process index, "chroma" for the Chroma persistent store
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE_BACKEND", "numpy").lower()
+# Per-table/per-column schema index used to build the prompt, and its size limit
+SCHEMA_INDEX_DIR = os.path.join(VECTOR_INDEX_DIR, "schema")
+SCHEMA_TOKEN_BUDGET = int(os.getenv("SCHEMA_TOKEN_BUDGET", "1500"))
+# Most frequent values of categorical columns shown in the schema
+SCHEMA_TOP_VALUES = int(os.getenv("SCHEMA_TOP_VALUES", "5"))
+# Persistent NL-to-SQL translation cache
+TRANSLATION_CACHE_ENABLED = os.getenv("TRANSLATION_CACHE", "True").lower() == "true"
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH", "translation_cache.db")
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "1000"))
+TRANSLATION_CACHE_TTL = int(os.getenv("TRANSLATION_CACHE_TTL", str(7 * 24 * 3600)))
+# Paraphrase matching in front of the LLM; cosine similarity needed to reuse a stored question's SQL
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "True").lower() == "true"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+# Questions the local planner answers with at least this confidence skip the LLM
+PLANNER_CONFIDENCE_THRESHOLD = float(os.getenv("PLANNER_CONFIDENCE_THRESHOLD", "0.75"))
+# Questions translated in parallel by a batch request
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
 EXCEL_FILES = ["Deposits Data Lite.xlsx", "Form X Report  Main Lite.xlsx", "Loans Data Lite.xlsx"]
 
-# Initialize Groq client if API key is available
+# Groq and Ollama clients share one pooled HTTP client and are created on first use (see llm_clients)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-groq_client = None
-if GROQ_API_KEY:
-    os.environ["GROQ_API_KEY"] = GROQ_API_KEY
-    groq_client = Groq(api_key=GROQ_API_KEY)
 
-# Initialize sentence transformer embeddings (open source)
+# Sentence transformer embeddings (open source), loaded on first use
 model_name = "all-MiniLM-L6-v2"  # Smaller, efficient model
-embeddings = HuggingFaceEmbeddings(model_name=model_name)
+# "torch" runs the model through sentence-transformers, "onnx" runs its int8 ONNX export (see onnx_embeddings)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+embeddings = None
+_model_lock = threading.Lock()
 
-def get_db_schema(db_path=DB_FILENAME):
-    """Extract schema from all tabular data tables in the database"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Get all tables created from Excel sheets
-    cursor.execute("""
-        SELECT workbook, sheet, table_name 
-        FROM tabular_data
-    """)
-    table_mappings = cursor.fetchall()
+def get_groq_client():
+    """Return the shared Groq client, creating it on first use"""
+    from llm_clients import get_groq_client as get_shared_groq_client
+    return get_shared_groq_client()
+
+def get_ollama_client():
+    """Return the shared Ollama client, creating it on first use"""
+    from llm_clients import get_ollama_client as get_shared_ollama_client
+    return get_shared_ollama_client()
+
+def get_embeddings():
+    """Return the shared embedding model, loading it on first use"""
+    global embeddings
+    if embeddings is None:
+        with _model_lock:
+            if embeddings is None:
+                started = time.perf_counter()
+                if EMBEDDING_BACKEND == "onnx":
+                    from onnx_embeddings import OnnxEmbeddings
+                    embeddings = OnnxEmbeddings(model_name)
+                else:
+                    from langchain_community.embeddings import HuggingFaceEmbeddings
+                    embeddings = HuggingFaceEmbeddings(model_name=model_name)
+                print(f"Loaded {EMBEDDING_BACKEND} embedding model {model_name} in {time.perf_counter() - started:.2f}s")
+    return embeddings
+
+def warm_up(db_path=DB_FILENAME):
+    """Load models, clients, the schema snapshot and the vector store ahead of the first request"""
+    started = time.perf_counter()
+    get_embeddings()
+    get_groq_client()
+    if os.path.exists(db_path):
+        get_schema_snapshot(db_path)
+    vector_store = load_or_create_vector_store(db_path)
+    print(f"Warm-up completed in {time.perf_counter() - started:.2f}s")
+    return vector_store
+
+# Schema snapshots keyed by database path, refreshed when the file version changes
+_schema_cache = {}
+_schema_lock = threading.Lock()
+
+def get_db_version(db_path=DB_FILENAME):
+    """Return a version stamp for the database file that changes whenever ingestion rewrites it"""
+    return database_version(db_path)
+
+def build_schema_snapshot(db_path=DB_FILENAME):
+    """Build the schema text and table descriptions from the catalogue written at ingest"""
+    from catalog import read_schema_document, is_categorical
+    with read_connection(db_path) as conn:
+        tables = read_schema_document(conn)
     
     schema = []
-    for workbook, sheet, table_name in table_mappings:
-        # Get column information for each table
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
-        col_info = [f"{col[1]} ({col[2]})" for col in columns]
+    for table_name, table in tables.items():
+        workbook, sheet = table['source']['workbook'], table['source']['sheet']
+        col_info = [f"{col['name']} ({col['type']})" for col in table['columns']]
         
         # Add to schema
         schema.append(f"Table: {table_name} (from {workbook}, sheet {sheet})")
+        schema.append(f"Rows: {table['row_count']}")
         schema.append(f"Columns: {', '.join(col_info)}")
         
-        # Add sample data
-        try:
-            cursor.execute(f"SELECT * FROM {table_name} LIMIT 3")
-            sample_data = cursor.fetchall()
-            if sample_data:
-                column_names = [col[1] for col in columns]
-                sample_rows = []
-                for row in sample_data:
-                    sample_row = {column_names[i]: row[i] for i in range(len(column_names))}
-                    sample_rows.append(sample_row)
-                schema.append(f"Sample data: {json.dumps(sample_rows, default=str)}")
-        except Exception as e:
-            schema.append(f"Error getting sample data: {str(e)}")
+        # Add sample data and the value ranges and common values recorded in the catalogue
+        if table['sample_data']:
+            schema.append(f"Sample data: {json.dumps(table['sample_data'], default=str)}")
+        ranges = {col['name']: [col['stats']['min_value'], col['stats']['max_value']]
+                  for col in table['columns'] if col['stats'].get('histogram') is not None}
+        if ranges:
+            schema.append(f"Value ranges: {json.dumps(ranges, default=str)}")
+        common = {col['name']: [value for value, _ in col['stats']['top_values'][:SCHEMA_TOP_VALUES]]
+                  for col in table['columns'] if is_categorical(col['stats'])}
+        if common:
+            schema.append(f"Common values: {json.dumps(common, default=str)}")
         
         schema.append("\n")
     
-    conn.close()
-    return "\n".join(schema)
+    schema_text = "\n".join(schema)
+    return {
+        'text': schema_text,
+        'fingerprint': hashlib.sha256(schema_text.encode('utf-8')).hexdigest(),
+        'tables': tables,
+        'tabular_tables': list(tables),
+        'tabular_sources': {name: (table['source']['workbook'], table['source']['sheet']) for name, table in tables.items()},
+        'columns_with_spaces': sorted({col['name'] for table in tables.values()
+                                       for col in table['columns'] if ' ' in col['name']})
+    }
+
+def get_schema_snapshot(db_path=DB_FILENAME):
+    """Return the cached schema snapshot, rebuilding it only when the database has changed"""
+    version = get_db_version(db_path)
+    key = os.path.abspath(db_path)
+    with _schema_lock:
+        snapshot = _schema_cache.get(key)
+        if snapshot is None or snapshot['version'] != version:
+            snapshot = build_schema_snapshot(db_path)
+            snapshot['version'] = version
+            _schema_cache[key] = snapshot
+    return snapshot
+
+def get_db_schema(db_path=DB_FILENAME):
+    """Extract schema from all tabular data tables in the database"""
+    return get_schema_snapshot(db_path)['text']
+
+def get_schema_fingerprint(db_path=DB_FILENAME):
+    """Return a hash of the current schema text, used to stamp the vector index"""
+    return get_schema_snapshot(db_path)['fingerprint']
 
 def create_example_queries_from_tables(db_path=DB_FILENAME):
     """Generate example SQL queries based on the available tables"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT table_name FROM tabular_data")
-    tables = cursor.fetchall()
+    snapshot = get_schema_snapshot(db_path)
     
     example_queries = []
     
-    for table in tables:
-        table_name = table[0]
-        # Get table info
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
+    for table_name in snapshot['tabular_tables']:
+        # Columns come from the catalogue rather than the tables themselves
+        columns = snapshot['tables'][table_name]['columns']
         
         if not columns:
             continue
             
-        column_names = [col[1] for col in columns]
+        column_names = [col['name'] for col in columns]
         
         # Find date columns
         date_columns = [col for col in column_names if 'date' in col.lower()]
@@ -136,19 +215,15 @@ def create_example_queries_from_tables(db_path=DB_FILENAME):
                 f"SQL: SELECT {name_col}, SUM({amount_col}) as total FROM {table_name} GROUP BY {name_col} ORDER BY total DESC;"
             )
     
-    conn.close()
     return example_queries
 
-def create_vector_store(db_path=DB_FILENAME):
-    """Create vector store from database schema and example queries"""
-    # Get schema information
-    schema = get_db_schema(db_path)
-    
-    # Generate example queries
+def build_vector_documents(db_path=DB_FILENAME):
+    """Build the text chunks indexed for retrieval: generated and financial examples"""
+    # Schema is indexed per table and column in the schema index, see build_schema_documents
     example_queries = create_example_queries_from_tables(db_path)
     
     # Combine all documents
-    documents = [schema] + example_queries
+    documents = list(example_queries)
     
     # Add financial-specific examples
     financial_examples = [
@@ -162,87 +237,561 @@ def create_vector_store(db_path=DB_FILENAME):
     
     documents.extend(financial_examples)
     
-    # Create vector store
+    # Split documents into chunks
+    from langchain_text_splitters import CharacterTextSplitter
     text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
     texts = []
     for doc in documents:
         texts.extend(text_splitter.split_text(doc))
+    return texts
+
+def create_vector_store(db_path=DB_FILENAME, backend=None):
+    """Create vector store from database schema and example queries"""
+    backend = backend or VECTOR_STORE_BACKEND
+    texts = build_vector_documents(db_path)
+    fingerprint = get_schema_fingerprint(db_path)
     
     # Save to disk for reuse
-    vector_store = Chroma.from_texts(texts, embeddings, persist_directory=CHROMADB_DIR)
-    vector_store.persist()
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma
+        from vector_index import content_hash
+        unique_texts = list(dict.fromkeys(texts))
+        vector_store = Chroma.from_texts(unique_texts, get_embeddings(), persist_directory=CHROMADB_DIR,
+                                         ids=[content_hash(text) for text in unique_texts],
+                                         metadatas=[{"hash": content_hash(text)} for text in unique_texts])
+        vector_store.persist()
+        write_chroma_fingerprint(fingerprint)
+    else:
+        from vector_index import NumpyVectorStore
+        vector_store = NumpyVectorStore.from_texts(texts, get_embeddings(), persist_directory=VECTOR_INDEX_DIR,
+                                                   fingerprint=fingerprint)
     
     return vector_store
 
-def load_or_create_vector_store(db_path=DB_FILENAME):
+def write_chroma_fingerprint(fingerprint):
+    """Stamp the Chroma persist directory with the schema fingerprint it was built from"""
+    with open(os.path.join(CHROMADB_DIR, "fingerprint.txt"), 'w') as f:
+        f.write(fingerprint)
+
+def read_chroma_fingerprint():
+    """Read the schema fingerprint stamped on the Chroma persist directory"""
+    try:
+        with open(os.path.join(CHROMADB_DIR, "fingerprint.txt"), 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def refresh_vector_store(vector_store, db_path=DB_FILENAME):
+    """
+    Re-index only the chunks that changed since the vector store was built: new chunks are
+    embedded, chunks that no longer exist are dropped and unchanged chunks are kept.
+    """
+    texts = build_vector_documents(db_path)
+    fingerprint = get_schema_fingerprint(db_path)
+    
+    if hasattr(vector_store, 'sync_texts'):
+        added, removed = vector_store.sync_texts(texts, fingerprint)
+        if added or removed:
+            vector_store.persist()
+    else:
+        from vector_index import content_hash
+        wanted = {content_hash(text): text for text in texts}
+        existing = set(vector_store.get()['ids'])
+        stale = [chunk_id for chunk_id in existing if chunk_id not in wanted]
+        new_ids = [chunk_id for chunk_id in wanted if chunk_id not in existing]
+        if stale:
+            vector_store.delete(ids=stale)
+        if new_ids:
+            vector_store.add_texts([wanted[chunk_id] for chunk_id in new_ids], ids=new_ids,
+                                   metadatas=[{"hash": chunk_id} for chunk_id in new_ids])
+        write_chroma_fingerprint(fingerprint)
+        added, removed = len(new_ids), len(stale)
+    
+    if added or removed:
+        print(f"Vector store refreshed: {added} chunks embedded, {removed} stale chunks dropped")
+    return vector_store
+
+def ensure_vector_store_fresh(vector_store, db_path=DB_FILENAME):
+    """Refresh the vector store if the schema changed since it was last indexed"""
+    if not os.path.exists(db_path):
+        return vector_store
+    fingerprint = get_schema_fingerprint(db_path)
+    current = getattr(vector_store, 'fingerprint', None)
+    if current is None and not hasattr(vector_store, 'sync_texts'):
+        current = read_chroma_fingerprint()
+    if current != fingerprint:
+        print("Schema changed since the vector store was indexed, refreshing...")
+        refresh_vector_store(vector_store, db_path)
+    return vector_store
+
+def load_or_create_vector_store(db_path=DB_FILENAME, backend=None):
     """Load existing vector store or create a new one"""
-    if os.path.exists(CHROMADB_DIR) and os.listdir(CHROMADB_DIR):
-        print("Loading existing vector store...")
-        return Chroma(persist_directory=CHROMADB_DIR, embedding_function=embeddings)
+    backend = backend or VECTOR_STORE_BACKEND
+    if backend == "chroma":
+        if os.path.exists(CHROMADB_DIR) and os.listdir(CHROMADB_DIR):
+            print("Loading existing vector store...")
+            from langchain_community.vectorstores import Chroma
+            vector_store = Chroma(persist_directory=CHROMADB_DIR, embedding_function=get_embeddings())
+            return ensure_vector_store_fresh(vector_store, db_path)
     else:
-        print("Creating new vector store...")
-        return create_vector_store(db_path)
+        from vector_index import NumpyVectorStore
+        if NumpyVectorStore.exists(VECTOR_INDEX_DIR):
+            print("Loading existing vector index...")
+            vector_store = NumpyVectorStore.load(VECTOR_INDEX_DIR, get_embeddings())
+            return ensure_vector_store_fresh(vector_store, db_path)
+    
+    print("Creating new vector store...")
+    return create_vector_store(db_path, backend)
 
 
-def rule_based_sql_generation(query, db_schema):
-    """Simple rule-based SQL generation as fallback when no LLM is available"""
-    # Extract table names from schema
-    import re
-    table_match = re.findall(r"Table: (\w+)", db_schema)
-    tables = table_match if table_match else ["table_unknown"]
-    
-    # Extract column names
-    column_match = re.findall(r"Columns: (.*)", db_schema)
-    column_text = column_match[0] if column_match else ""
-    columns = [col.split(" ")[0] for col in column_text.split(", ")]
+def estimate_tokens(text):
+    """Rough token count used for prompt budgeting (about four characters per token)"""
+    return (len(text) + 3) // 4
+
+def column_sample_values(table_info, column_name, limit=3):
+    """Most frequent values of a categorical column from the catalogue, else distinct values from the sample rows"""
+    from catalog import is_categorical
+    stats = next((col.get('stats') for col in table_info['columns'] if col['name'] == column_name), None)
+    if stats and is_categorical(stats):
+        return [value for value, _ in stats['top_values'][:limit]]
+    values = []
+    for row in table_info['sample_data']:
+        value = row.get(column_name)
+        if value is not None and value not in values:
+            values.append(value)
+    return values[:limit]
+
+def build_schema_documents(db_path=DB_FILENAME):
+    """Build one retrieval document per tabular table and per column, with descriptions and value samples"""
+    snapshot = get_schema_snapshot(db_path)
+    texts = []
+    metadatas = []
+    for table_name in snapshot['tabular_tables']:
+        table_info = snapshot['tables'].get(table_name)
+        if not table_info:
+            continue
+        workbook, sheet = snapshot['tabular_sources'][table_name]
+        column_names = [col['name'] for col in table_info['columns']]
+        
+        texts.append(f"Table {table_name} from workbook {workbook}, sheet {sheet}. Columns: {', '.join(column_names)}")
+        metadatas.append({'table': table_name})
+        
+        for col in table_info['columns']:
+            samples = column_sample_values(table_info, col['name'])
+            sample_text = ", ".join(str(value) for value in samples) or "none"
+            texts.append(f"Column {col['name']} ({col['type']}) in table {table_name} "
+                         f"from sheet {sheet}. Example values: {sample_text}")
+            metadatas.append({'table': table_name, 'column': col['name']})
+    return texts, metadatas
+
+_schema_index = None
+_schema_index_lock = threading.Lock()
+
+def get_schema_index(db_path=DB_FILENAME):
+    """Return the per-table/per-column schema index, re-indexing changed entries when the schema changes"""
+    global _schema_index
+    from vector_index import NumpyVectorStore
+    fingerprint = get_schema_fingerprint(db_path)
+    with _schema_index_lock:
+        if _schema_index is None:
+            if NumpyVectorStore.exists(SCHEMA_INDEX_DIR):
+                _schema_index = NumpyVectorStore.load(SCHEMA_INDEX_DIR, get_embeddings())
+            else:
+                _schema_index = NumpyVectorStore.from_texts([], get_embeddings())
+                _schema_index.persist_directory = SCHEMA_INDEX_DIR
+        if _schema_index.fingerprint != fingerprint:
+            texts, metadatas = build_schema_documents(db_path)
+            added, removed = _schema_index.sync_texts(texts, fingerprint, metadatas)
+            _schema_index.persist()
+            print(f"Schema index updated: {added} entries embedded, {removed} dropped")
+    return _schema_index
+
+def format_table_schema(table_name, snapshot, relevant_columns, include_other_columns=True):
+    """Render a table for the prompt: relevant columns first with sample values, then the remaining column names"""
+    table_info = snapshot['tables'][table_name]
+    workbook, sheet = snapshot['tabular_sources'][table_name]
+    types = {col['name']: col['type'] for col in table_info['columns']}
+    
+    lines = [f"Table: {table_name} (from {workbook}, sheet {sheet}), {table_info['row_count']} rows"]
+    columns = [f"{col} ({types[col]})" for col in relevant_columns]
+    if include_other_columns:
+        columns += [f"{col} ({col_type})" for col, col_type in types.items() if col not in relevant_columns]
+    lines.append(f"Columns: {', '.join(columns)}")
+    
+    samples = []
+    for col in relevant_columns:
+        values = column_sample_values(table_info, col)
+        if values:
+            samples.append(f"{col}: {', '.join(json.dumps(value, default=str) for value in values)}")
+    if samples:
+        lines.append(f"Sample values: {'; '.join(samples)}")
+    
+    stats = {col['name']: col.get('stats') or {} for col in table_info['columns']}
+    ranges = [f"{col}: {json.dumps(stats[col]['min_value'], default=str)} to {json.dumps(stats[col]['max_value'], default=str)}"
+              for col in relevant_columns if stats[col].get('histogram') is not None]
+    if ranges:
+        lines.append(f"Value ranges: {'; '.join(ranges)}")
+    return "\n".join(lines)
+
+def select_relevant_schema(query, db_path=DB_FILENAME, token_budget=None, query_vector=None, schema_hits=None,
+                           value_hints=()):
+    """
+    Pick the tables and columns relevant to the question from the schema index and render them
+    within the token budget. Returns the schema text and the list of included tables.
+    schema_hits are schema index search results already computed by the caller; columns holding
+    values named in the question (value_hints) are always included.
+    """
+    token_budget = token_budget or SCHEMA_TOKEN_BUDGET
+    snapshot = get_schema_snapshot(db_path)
+    schema_index = get_schema_index(db_path)
+    
+    table_scores = {}
+    column_scores = {}
+    k = min(20, len(schema_index.texts))
+    if schema_hits is not None:
+        hits = schema_hits
+    elif query_vector is not None:
+        hits = schema_index.similarity_search_by_vector_with_score(query_vector, k)
+    else:
+        hits = schema_index.similarity_search_with_score(query, k)
+    for doc, score in hits:
+        table = doc.metadata.get('table')
+        column = doc.metadata.get('column')
+        if table not in snapshot['tables']:
+            continue
+        table_scores[table] = max(table_scores.get(table, -1.0), score)
+        if column:
+            column_scores[(table, column)] = score
     
-    # Determine operation from query
+    # Tables and columns named verbatim in the question are always relevant
     query_lower = query.lower()
-    
-    if any(x in query_lower for x in ["average", "avg", "mean"]):
-        for col in columns:
-            if col.lower() in query_lower or "amount" in col.lower():
-                return f"SELECT AVG({col}) FROM {tables[0]};"
-    
-    if any(x in query_lower for x in ["sum", "total"]):
-        for col in columns:
-            if col.lower() in query_lower or "amount" in col.lower():
-                return f"SELECT SUM({col}) FROM {tables[0]};"
-    
-    if any(x in query_lower for x in ["maximum", "max", "highest"]):
-        for col in columns:
-            if col.lower() in query_lower or "amount" in col.lower():
-                return f"SELECT MAX({col}) FROM {tables[0]};"
-                
-    if "count" in query_lower:
-        return f"SELECT COUNT(*) FROM {tables[0]};"
-    
-    # Default to SELECT *
-    return f"SELECT * FROM {tables[0]} LIMIT 10;"
+    for table in snapshot['tabular_tables']:
+        if table not in snapshot['tables']:
+            continue
+        if table.lower() in query_lower:
+            table_scores[table] = 1.0
+        for col in snapshot['tables'][table]['columns']:
+            if col['name'].lower() in query_lower:
+                column_scores[(table, col['name'])] = 1.0
+                table_scores[table] = max(table_scores.get(table, -1.0), 1.0)
+    for hint in value_hints:
+        if hint['table'] in snapshot['tables']:
+            column_scores[(hint['table'], hint['column'])] = 1.0
+            table_scores[hint['table']] = max(table_scores.get(hint['table'], -1.0), 1.0)
+    
+    blocks = []
+    included = []
+    used = 0
+    for table in sorted(table_scores, key=table_scores.get, reverse=True):
+        relevant = sorted((col for (t, col) in column_scores if t == table),
+                          key=lambda col: column_scores[(table, col)], reverse=True)
+        block = format_table_schema(table, snapshot, relevant)
+        if blocks and used + estimate_tokens(block) > token_budget:
+            block = format_table_schema(table, snapshot, relevant, include_other_columns=False)
+            if not relevant or used + estimate_tokens(block) > token_budget:
+                continue
+        blocks.append(block)
+        included.append(table)
+        used += estimate_tokens(block)
+    
+    return "\n\n".join(blocks), included
 
-def query_excel_data(nl_query, db_path=DB_FILENAME, vector_store=None, use_ollama=False):
-    """Execute natural language query against SQLite database with RAG"""
-    # Connect to database
-    conn = sqlite3.connect(db_path)
-    
-    # Get schema for context
+# Prompt size counters so the effect of schema selection on LLM latency can be tracked
+prompt_stats = {'calls': 0, 'estimated_tokens': 0, 'reported_tokens': 0, 'last': None}
+_prompt_stats_lock = threading.Lock()
+
+def record_prompt_tokens(schema_tokens, context_tokens, total_tokens, reported_tokens=None):
+    """Accumulate prompt token counts and log the size of the current prompt"""
+    with _prompt_stats_lock:
+        prompt_stats['calls'] += 1
+        prompt_stats['estimated_tokens'] += total_tokens
+        prompt_stats['reported_tokens'] += reported_tokens or 0
+        prompt_stats['last'] = {'schema': schema_tokens, 'context': context_tokens,
+                                'total': total_tokens, 'reported': reported_tokens}
+    print(f"Prompt tokens (estimated): schema {schema_tokens}, context {context_tokens}, total {total_tokens}"
+          + (f", reported by LLM {reported_tokens}" if reported_tokens else ""))
+
+def get_prompt_stats():
+    """Return a copy of the prompt token counters"""
+    with _prompt_stats_lock:
+        stats = dict(prompt_stats)
+    stats['average_tokens'] = stats['estimated_tokens'] / stats['calls'] if stats['calls'] else 0
+    return stats
+
+def plan_query_locally(query, db_schema, value_hints=()):
+    """Plan SQL with the local rule-based planner; returns the plan with its confidence score"""
+    from rule_planner import plan_query
+    return plan_query(query, db_schema, value_hints)
+
+def rule_based_sql_generation(query, db_schema, value_hints=()):
+    """Rule-based SQL generation as fallback when no LLM is available"""
+    return plan_query_locally(query, db_schema, value_hints)['sql']
+
+def find_value_hints(query, db_path=DB_FILENAME):
+    """Values named in the question with the table and column holding each, from the ingest value index"""
+    from value_index import find_value_mentions
+    try:
+        return find_value_mentions(query, db_path)
+    except Exception as e:
+        print(f"Value index lookup failed: {e}")
+        return []
+
+def format_value_hints(value_hints):
+    """Prompt lines telling the SQL generator which column holds each value named in the question"""
+    return "\n".join(f"- '{hint['text']}' is a value of {hint['table']}.\"{hint['column']}\" (stored as '{hint['value']}')"
+                     for hint in value_hints)
+
+# Which path answered each translated question, to measure traffic served without a network call
+translation_stats = {'cache': 0, 'template': 0, 'semantic': 0, 'planner': 0, 'generated': 0}
+_translation_stats_lock = threading.Lock()
+
+def record_translation_source(source):
+    """Count the path that produced a translation"""
+    with _translation_stats_lock:
+        translation_stats[source] = translation_stats.get(source, 0) + 1
+
+def get_translation_stats():
+    """Translation counts per path and the share answered locally (caches and planner)"""
+    with _translation_stats_lock:
+        stats = dict(translation_stats)
+    total = sum(stats.values())
+    local = total - stats.get('generated', 0)
+    stats['total'] = total
+    stats['planner_share'] = stats.get('planner', 0) / total if total else 0
+    stats['local_share'] = local / total if total else 0
+    return stats
+
+_translation_cache = None
+_translation_cache_lock = threading.Lock()
+
+def get_translation_cache():
+    """Return the shared persistent translation cache, or None when caching is disabled"""
+    global _translation_cache
+    if not TRANSLATION_CACHE_ENABLED:
+        return None
+    if _translation_cache is None:
+        with _translation_cache_lock:
+            if _translation_cache is None:
+                from query_cache import TranslationCache
+                _translation_cache = TranslationCache(TRANSLATION_CACHE_PATH, TRANSLATION_CACHE_SIZE,
+                                                      TRANSLATION_CACHE_TTL)
+    return _translation_cache
+
+_semantic_cache = None
+
+def get_semantic_cache():
+    """Return the shared semantic cache, or None when it is disabled"""
+    global _semantic_cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if _semantic_cache is None:
+        with _translation_cache_lock:
+            if _semantic_cache is None:
+                from query_cache import SemanticCache
+                _semantic_cache = SemanticCache(TRANSLATION_CACHE_PATH, SEMANTIC_CACHE_THRESHOLD,
+                                                TRANSLATION_CACHE_SIZE)
+    return _semantic_cache
+
+def get_semantic_cache_stats():
+    """Return semantic cache hit rate and similarity distribution for threshold tuning"""
+    cache = get_semantic_cache()
+    return cache.stats() if cache else {'enabled': False}
+
+def get_translation_cache_stats():
+    """Return translation cache counters for monitoring"""
+    cache = get_translation_cache()
+    return cache.stats() if cache else {'enabled': False}
+
+def translate_query(nl_query, db_path=DB_FILENAME, vector_store=None, use_ollama=False, query_vector=None,
+                    retrieved=None, local_only=False, skip_local=False):
+    """
+    Translate a question to SQL, trying the exact cache, parameterized templates, the local planner
+    and the semantic cache before retrieval and the LLM. Returns a dict with the SQL, parameters to
+    bind, the path that produced it ('cache', 'template', 'planner', 'semantic' or 'generated') and
+    data needed for caching. retrieved holds retrieval results precomputed for a batch. With
+    local_only, returns None instead of embedding the question or calling the LLM; skip_local goes
+    straight to the semantic cache and the LLM for a question the local tiers already missed.
+    """
+    translation = _translate_query(nl_query, db_path, vector_store, use_ollama, query_vector, retrieved, local_only,
+                                   skip_local)
+    if translation is None:
+        return None
+    record_translation_source(translation['source'])
+    # Monthly and per-category aggregates read the rollups built at ingest instead of the source rows
+    routed = route_to_rollup(translation['sql'], db_path)
+    if routed != translation['sql']:
+        print(f"Routed to rollup: {routed}")
+        translation = dict(translation, sql=routed, source_sql=translation['sql'])
+    return translation
+
+def _translate_query(nl_query, db_path, vector_store, use_ollama, query_vector, retrieved=None, local_only=False,
+                     skip_local=False):
+    from query_cache import parameterize_sql, bind_parameters
+    fingerprint = get_schema_fingerprint(db_path)
+    translation = {'sql': None, 'params': None, 'param_map': None, 'source': None,
+                   'query_vector': query_vector, 'fingerprint': fingerprint, 'confidence': None}
+    
+    # Repeated questions are answered from the translation cache, skipping retrieval and the LLM
+    cache = get_translation_cache()
+    if cache and not skip_local:
+        sql_query = cache.get(nl_query, fingerprint)
+        if sql_query:
+            print("Translation cache hit")
+            return dict(translation, sql=sql_query, source='cache')
+        # Same question shape with different literals reuses a parameterized template
+        template = cache.get_template(nl_query, fingerprint)
+        if template:
+            print("Template cache hit")
+            return dict(translation, sql=template[0], params=template[1], source='template')
+    
+    # Simple questions the local planner is confident about never reach the network
     db_schema = get_db_schema(db_path)
-    
-    # Create or load vector store
+    value_hints = find_value_hints(nl_query, db_path)
+    plan = plan_query_locally(nl_query, db_schema, value_hints) if not skip_local else None
+    if plan is not None and plan['confidence'] >= PLANNER_CONFIDENCE_THRESHOLD:
+        print(f"Local planner answered with confidence {plan['confidence']}")
+        sql_query = escape_column_names(plan['sql'], db_path)
+        template = parameterize_sql(nl_query, sql_query)
+        if template:
+            return dict(translation, sql=template[0], params=bind_parameters(nl_query, template[1]),
+                        param_map=template[1], source='planner', confidence=plan['confidence'])
+        return dict(translation, sql=sql_query, source='planner', confidence=plan['confidence'])
+    if local_only:
+        return None
+    
+    # Paraphrases of answered questions are matched by embedding similarity
+    semantic_cache = get_semantic_cache()
+    if semantic_cache:
+        if translation['query_vector'] is None:
+            translation['query_vector'] = get_embeddings().embed_query(nl_query)
+        sql_query = semantic_cache.lookup(nl_query, translation['query_vector'], fingerprint)
+        if sql_query:
+            print("Semantic cache hit")
+            return dict(translation, sql=sql_query, source='semantic')
+    
+    # Create or load vector store, re-indexing changed chunks after a new ingest
     if vector_store is None:
         vector_store = load_or_create_vector_store(db_path)
-    
-    # Convert to SQL and execute
+    else:
+        ensure_vector_store_fresh(vector_store, db_path)
+    
+    sql_query = nl_to_sql_with_rag(nl_query, vector_store, db_schema, use_ollama, db_path,
+                                   query_vector=translation['query_vector'], retrieved=retrieved,
+                                   value_hints=value_hints)
+    
+    # Literals from the question are bound as parameters instead of being inlined
+    template = parameterize_sql(nl_query, sql_query)
+    if template:
+        return dict(translation, sql=template[0], params=bind_parameters(nl_query, template[1]),
+                    param_map=template[1], source='generated')
+    return dict(translation, sql=sql_query, source='generated')
+
+def display_sql(translation):
+    """The SQL shown to users and cached: over the source tables even when execution reads a rollup"""
+    from query_cache import render_sql
+    source_sql = translation.get('source_sql', translation['sql'])
+    return render_sql(source_sql, translation['params']) if translation['params'] else source_sql
+
+def remember_translation(nl_query, translation):
+    """Store a translation whose SQL executed successfully in the caches that did not already have it"""
+    fingerprint = translation['fingerprint']
+    # Caches keep the SQL over the source tables; rollup routing is applied again on every use
+    source_sql = translation.get('source_sql', translation['sql'])
+    shown_sql = display_sql(translation)
+    
+    cache = get_translation_cache()
+    if cache and translation['source'] in ('semantic', 'generated'):
+        cache.put(nl_query, fingerprint, shown_sql)
+        if translation['param_map'] is not None:
+            cache.put_template(nl_query, fingerprint, source_sql, translation['param_map'])
+    
+    semantic_cache = get_semantic_cache()
+    if semantic_cache and translation['source'] == 'generated' and translation['query_vector'] is not None:
+        semantic_cache.add(nl_query, translation['query_vector'], fingerprint, shown_sql)
+    return shown_sql
+
+def execute_translation(conn, nl_query, translation, db_path=DB_FILENAME):
+    """Run a translated question on conn and cache its SQL once it has executed; returns (DataFrame, display SQL)"""
+    from sql_guard import run_guarded_query
+    print(f"Generated SQL: {translation['sql']}" +
+          (f" with parameters {translation['params']}" if translation['params'] else ""))
+    # Parameters are bound by SQLite as a prepared statement; the plan is checked and execution
+    # is limited in time and rows so a runaway generated query cannot hang the request
+    result = run_guarded_query(conn, translation['sql'], translation['params'], db_path)
+    # Only SQL that executed successfully is cached
+    sql_query = remember_translation(nl_query, translation)
+    return result, sql_query
+
+def query_excel_data(nl_query, db_path=DB_FILENAME, vector_store=None, use_ollama=False):
+    """Execute natural language query against SQLite database with RAG"""
+    # Convert to SQL and execute on a pooled read-only connection
     try:
-        # Pass the database path to nl_to_sql_with_rag
-        sql_query = nl_to_sql_with_rag(nl_query, vector_store, db_schema, use_ollama, db_path)
-        print(f"Generated SQL: {sql_query}")
-        result = pd.read_sql_query(sql_query, conn)
-        return result, sql_query
+        translation = translate_query(nl_query, db_path, vector_store, use_ollama)
+        with read_connection(db_path) as conn:
+            return execute_translation(conn, nl_query, translation, db_path)
+    except SQLGuardError as e:
+        print(f"Query rejected ({e.code}): {e.message}")
+        return e, ""
     except Exception as e:
         return f"Error: {str(e)}", ""
-    finally:
-        conn.close()
+
+def retrieve_batch(query_vectors, db_path, vector_store):
+    """
+    Retrieve prompt context and schema index hits for many embedded questions at once, as one
+    matrix product per index where the store supports it. Returns one retrieval dict per question.
+    """
+    if hasattr(vector_store, 'similarity_search_by_vectors_with_score'):
+        context = [[doc for doc, _ in hits]
+                   for hits in vector_store.similarity_search_by_vectors_with_score(query_vectors, k=5)]
+    else:
+        context = [vector_store.similarity_search_by_vector(list(vector), k=5) for vector in query_vectors]
+    try:
+        schema_index = get_schema_index(db_path)
+        schema = schema_index.similarity_search_by_vectors_with_score(query_vectors, min(20, len(schema_index.texts)))
+    except Exception as e:
+        print(f"Error searching the schema index for the batch: {e}")
+        schema = [None] * len(query_vectors)
+    return [{'context': docs, 'schema': hits} for docs, hits in zip(context, schema)]
+
+def query_excel_data_batch(nl_queries, db_path=DB_FILENAME, vector_store=None, use_ollama=False,
+                           max_workers=None):
+    """
+    Answer several questions in one call: all questions are embedded together, retrieval runs as
+    one matrix product, translations run in parallel and the SQL executes on one shared connection.
+    Returns a (result, sql) pair per question in input order; a failed item holds an error string
+    or SQLGuardError and does not affect the others.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    started = time.perf_counter()
+    # Repeated questions (the same tile twice on a dashboard) are translated and executed once
+    unique_queries = list(dict.fromkeys(nl_queries))
+    try:
+        if vector_store is None:
+            vector_store = load_or_create_vector_store(db_path)
+        else:
+            ensure_vector_store_fresh(vector_store, db_path)
+        query_vectors = get_embeddings().embed_documents(unique_queries)
+        retrieved = retrieve_batch(query_vectors, db_path, vector_store)
+    except Exception as e:
+        return [(f"Error: {str(e)}", "")] * len(nl_queries)
+    
+    answers = {}
+    with read_connection(db_path) as conn:
+        with ThreadPoolExecutor(max_workers=max_workers or BATCH_CONCURRENCY) as executor:
+            futures = {executor.submit(translate_query, nl_query, db_path, vector_store, use_ollama,
+                                       query_vector, retrieval): nl_query
+                       for nl_query, query_vector, retrieval in zip(unique_queries, query_vectors, retrieved)}
+            # The borrowed connection is used from this thread only, so execution stays here
+            for future in as_completed(futures):
+                nl_query = futures[future]
+                try:
+                    answers[nl_query] = execute_translation(conn, nl_query, future.result(), db_path)
+                except SQLGuardError as e:
+                    answers[nl_query] = (e, "")
+                except Exception as e:
+                    answers[nl_query] = (f"Error: {str(e)}", "")
+    print(f"Answered {len(nl_queries)} questions ({len(unique_queries)} unique) in {time.perf_counter() - started:.2f}s")
+    return [answers[nl_query] for nl_query in nl_queries]
 
 def create_ui():
     """Create a simple command-line interface for testing"""
@@ -260,7 +809,7 @@ def create_ui():
     vector_store = load_or_create_vector_store()
     
     # Check if we're using Groq or Ollama
-    use_ollama = not groq_client
+    use_ollama = not get_groq_client()
     if use_ollama:
         print("GROQ API key not found in .env. Will use local rule-based generation.")
         print("For better results, add GROQ_API_KEY to your .env file or set up Ollama.")
@@ -284,114 +833,113 @@ def create_ui():
         else:
             print(result)
 
+# Used for quoting when the column catalogue cannot be read from the database
+FALLBACK_COLUMNS_WITH_SPACES = [
+    "Business Date",
+    "Outstanding Principal Amount",
+    "Current Balance",
+    "Loan Amount",
+    "Interest Rate",
+    "Customer Name",
+    "Due Date",
+    "Transaction Date",
+    "Account Number",
+    "Payment Date",
+    "Deposit Date",
+    "Depositor Name",
+    "Transaction Type"
+]
+
 def get_all_columns_with_spaces(db_path):
     """Extract all column names with spaces from the database schema"""
-    import sqlite3
-    
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # Get all tables
-    cursor.execute("SELECT table_name FROM tabular_data")
-    tables = cursor.fetchall()
-    
-    columns_with_spaces = []
+    return list(get_schema_snapshot(db_path)['columns_with_spaces'])
+
+def compile_column_quoting_pattern(columns_with_spaces):
+    """
+    Build a single regex that matches either an already quoted token (string literal,
+    "identifier" or [identifier]) or one of the given column names as a bare word.
+    """
+    import re
     
-    for table in tables:
-        table_name = table[0]
-        
-        # Get column information for the table
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        columns = cursor.fetchall()
-        
-        # Check each column name for spaces
-        for col in columns:
-            col_name = col[1]  # Column name is in position 1
-            if ' ' in col_name:
-                columns_with_spaces.append(col_name)
+    # Longest names first so the alternation prefers "Current Balance LCY" over "Current Balance"
+    names = sorted(set(columns_with_spaces), key=len, reverse=True)
+    quoted = r"""('(?:[^']|'')*'|"[^"]*"|\[[^\]]*\])"""
+    if not names:
+        return re.compile(quoted)
+    bare = r'(?<!\w)(' + '|'.join(re.escape(col) for col in names) + r')(?!\w)'
+    return re.compile(quoted + '|' + bare)
+
+def get_column_quoting_pattern(db_path):
+    """Return the compiled column quoting pattern for the current schema version"""
+    try:
+        snapshot = get_schema_snapshot(db_path)
+    except Exception as e:
+        print(f"Error getting column names from database: {e}")
+        return compile_column_quoting_pattern(FALLBACK_COLUMNS_WITH_SPACES)
     
-    conn.close()
-    return columns_with_spaces
+    pattern = snapshot.get('column_pattern')
+    if pattern is None:
+        pattern = compile_column_quoting_pattern(snapshot['columns_with_spaces'])
+        snapshot['column_pattern'] = pattern
+    return pattern
 
 def escape_column_names(sql_query, db_path="excel_data.db"):
     """
     Process an SQL query to properly escape column names that contain spaces
     by enclosing them in double quotes.
     """
-    import re
+    pattern = get_column_quoting_pattern(db_path)
     
-    # Get actual column names with spaces from the database
-    try:
-        columns_with_spaces = get_all_columns_with_spaces(db_path)
-    except Exception as e:
-        print(f"Error getting column names from database: {e}")
-        # Fallback to common column names
-        columns_with_spaces = [
-            "Business Date",
-            "Outstanding Principal Amount",
-            "Current Balance",
-            "Loan Amount",
-            "Interest Rate",
-            "Customer Name",
-            "Due Date",
-            "Transaction Date",
-            "Account Number",
-            "Payment Date",
-            "Deposit Date",
-            "Depositor Name",
-            "Transaction Type"
-        ]
-    
-    # Sort by length (descending) to avoid partial replacements
-    columns_with_spaces.sort(key=len, reverse=True)
-    
-    # Replace unquoted column names with quoted ones
-    processed_sql = sql_query
-    
-    for col in columns_with_spaces:
-        # Careful pattern to find column names not already quoted
-        # Look for column name not preceded by " or [ and not followed by " or ]
-        pattern = r'(?<!["\[])' + re.escape(col) + r'(?!["\]])'
-        replacement = f'"{col}"'
-        processed_sql = re.sub(pattern, replacement, processed_sql)
-    
-    # Also replace patterns where function arguments aren't quoted
-    # E.g., SUM(Current Balance) -> SUM("Current Balance")
-    function_pattern = r'(AVG|SUM|COUNT|MIN|MAX|GROUP BY|ORDER BY)\s*\(\s*([^"(][^()]*[^")])\s*\)'
-    
-    def replace_func_args(match):
-        func = match.group(1)
-        args = match.group(2)
-        
-        # Check if args contain any columns with spaces
-        for col in columns_with_spaces:
-            if col in args and f'"{col}"' not in args:
-                args = args.replace(col, f'"{col}"')
-        
-        return f"{func}({args})"
+    def quote_match(match):
+        # Already quoted tokens and string literals are left untouched
+        if match.group(1) is not None:
+            return match.group(1)
+        return f'"{match.group(2)}"'
     
-    processed_sql = re.sub(function_pattern, replace_func_args, processed_sql)
+    processed_sql = pattern.sub(quote_match, sql_query)
     
-    print(f"Original SQL: {sql_query}")
-    print(f"Processed SQL: {processed_sql}")
+    if processed_sql != sql_query:
+        print(f"Processed SQL: {processed_sql}")
     
     return processed_sql
 
-def nl_to_sql_with_rag(query, vector_store, db_schema, use_ollama=False, db_path="excel_data.db"):
+def nl_to_sql_with_rag(query, vector_store, db_schema, use_ollama=False, db_path="excel_data.db", query_vector=None,
+                       retrieved=None, value_hints=None):
     """Convert natural language to SQL using RAG and Llama via Groq or Ollama"""
-    # Retrieve relevant context
-    relevant_docs = vector_store.similarity_search(query, k=5)
+    if value_hints is None:
+        value_hints = find_value_hints(query, db_path)
+    # Retrieve relevant context, reusing the question embedding or batch retrieval when the caller already has it
+    if retrieved is not None:
+        relevant_docs = retrieved['context']
+    elif query_vector is not None:
+        relevant_docs = vector_store.similarity_search_by_vector(query_vector, k=5)
+    else:
+        relevant_docs = vector_store.similarity_search(query, k=5)
     context = "\n".join([doc.page_content for doc in relevant_docs])
     
+    # Only the tables and columns relevant to the question go into the prompt
+    try:
+        prompt_schema, _ = select_relevant_schema(query, db_path, query_vector=query_vector,
+                                                  schema_hits=retrieved['schema'] if retrieved else None,
+                                                  value_hints=value_hints)
+    except Exception as e:
+        print(f"Error selecting relevant schema, using full schema: {e}")
+        prompt_schema = db_schema
+    
+    # Columns holding the values the question names, so filters go on the right column
+    value_hint_text = ""
+    if value_hints:
+        value_hint_text = f"\n    Values mentioned in the question:\n{format_value_hints(value_hints)}\n"
+    
     system_prompt = f"""
     You are an expert SQL analyst for Excel financial data. Convert the natural language query to a valid SQLite SQL query.
     
     Database schema:
-    {db_schema}
+    {prompt_schema}
     
     Relevant examples and context:
     {context}
-    
+    {value_hint_text}
     IMPORTANT: When writing SQL, always enclose column names that contain spaces in double quotes or square brackets.
     For example: 
     - SELECT "Business Date", "Outstanding Principal Amount" FROM table
@@ -401,39 +949,25 @@ def nl_to_sql_with_rag(query, vector_store, db_schema, use_ollama=False, db_path
     
     Return ONLY the SQL query without explanation, comments or markdown formatting.
     """
-    
-    # Use Ollama if specified, otherwise use Groq if available
-    if use_ollama:
-        try:
-            from langchain_community.llms import Ollama
-            ollama = Ollama(model="llama3")
-            response = ollama.invoke(
-                f"System: {system_prompt}\n\nUser: Generate SQL for: {query}"
-            )
-            sql_query = response.strip()
-        except Exception as e:
-            print(f"Error using Ollama: {e}")
-            print("Falling back to rule-based SQL generation...")
-            sql_query = rule_based_sql_generation(query, db_schema)
-    elif groq_client:
-        try:
-            response = groq_client.chat.completions.create(
-                model="llama3-8b-8192",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Generate SQL for: {query}"}
-                ],
-                temperature=0.1,
-                max_tokens=500
-            )
-            sql_query = response.choices[0].message.content.strip()
-        except Exception as e:
-            print(f"Error using Groq: {e}")
-            print("Falling back to rule-based SQL generation...")
-            sql_query = rule_based_sql_generation(query, db_schema)
+    prompt_tokens = (estimate_tokens(prompt_schema), estimate_tokens(context), estimate_tokens(system_prompt))
+    
+    # Preferred provider first; a configured fallback provider is raced against it after the hedge delay
+    from llm_clients import complete_first, provider_order
+    providers = provider_order(use_ollama)
+    result = None
+    if providers:
+        result = complete_first(system_prompt, f"Generate SQL for: {query}", providers, accept=is_acceptable_sql)
     else:
         print("No LLM service available. Using rule-based SQL generation.")
-        sql_query = rule_based_sql_generation(query, db_schema)
+    
+    if result:
+        record_prompt_tokens(*prompt_tokens, reported_tokens=result['prompt_tokens'])
+        print(f"SQL generated by {result['provider']} in {result['seconds']:.2f}s")
+        sql_query = result['text']
+    else:
+        if providers:
+            print("Falling back to rule-based SQL generation...")
+        sql_query = rule_based_sql_generation(query, db_schema, value_hints)
     
     # Process SQL to handle column names with spaces properly
     # Pass the database path to the escape_column_names function
@@ -441,6 +975,11 @@ def nl_to_sql_with_rag(query, vector_store, db_schema, use_ollama=False, db_path
     sql_query = clean_sql_query(sql_query)
     return sql_query
 
+def is_acceptable_sql(text):
+    """Check that an LLM answer is a single read query rather than an explanation or an error"""
+    sql_query = clean_sql_query(text or "")
+    return sql_query.split(None, 1)[0].upper() in ('SELECT', 'WITH') if sql_query else False
+
 def clean_sql_query(sql_query):
     """Remove markdown code formatting and other unwanted characters from SQL query."""
     import re
@@ -457,5 +996,8 @@ def clean_sql_query(sql_query):
     return sql_query.strip()
 
 
+# Time spent importing this module, excluding the models which now load lazily
+import_seconds = time.perf_counter() - _import_started
+
 if __name__ == "__main__":
     create_ui()
\ No newline at end of file
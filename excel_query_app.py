@@ -1,8 +1,20 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Response, render_template, request, jsonify, stream_with_context
 import pandas as pd
 import os
+import gzip
+import hashlib
+import threading
 from dotenv import load_dotenv
-from excel_nl_query import query_excel_data, load_or_create_vector_store
+from excel_nl_query import query_excel_data, query_excel_data_batch, translate_query, remember_translation, display_sql, DB_FILENAME, load_or_create_vector_store, warm_up, get_prompt_stats, get_translation_cache_stats, get_semantic_cache_stats, get_translation_stats
+from llm_clients import get_llm_stats
+from sql_guard import SQLGuardError, run_guarded_query, stream_guarded_query
+from result_pages import result_store, RESULT_PAGE_SIZE
+from response_formats import RESPONSE_FORMATS, FORMAT_MIME_TYPES, dumps, json_response, result_data, arrow_response, ndjson_response
+from db_pool import read_connection, database_version, get_pool_stats
+from catalog import read_schema_document
+from cell_search import search_cells, SEARCH_PAGE_SIZE
+from cell_ranges import read_ranges
+from query_jobs import job_queue, JobQueueFull
 import sqlite3
 # Load environment variables
 load_dotenv()
@@ -10,22 +22,47 @@ load_dotenv()
 # Get configuration from .env
 PORT = int(os.getenv("PORT", 5000))
 DEBUG = os.getenv("DEBUG", "True").lower() == "true"
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "50"))
+# Seconds between keep-alive comments on an idle job event stream
+JOB_EVENTS_KEEPALIVE = float(os.getenv("JOB_EVENTS_KEEPALIVE", "15"))
 
 app = Flask(__name__)
 
 # Global variable to store vector store
 vector_store = None
 
+def warm_up_app():
+    """Preload models and the vector store so the first request does not pay for them"""
+    global vector_store
+    vector_store = warm_up()
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def requested_format():
+    """Response format from ?format=, the request body or the Accept header; records by default"""
+    response_format = request.args.get('format') or (request.get_json(silent=True) or {}).get('format')
+    if not response_format:
+        response_format = next((fmt for mime, fmt in FORMAT_MIME_TYPES.items()
+                                if mime in request.headers.get('Accept', '')), 'records')
+    return response_format.lower()
+
+def format_response(result, sql_query, response_format):
+    """Return a query result in the requested format; errors are always JSON"""
+    if response_format == 'arrow' and isinstance(result, pd.DataFrame):
+        return arrow_response(result, sql_query)
+    return json_response(format_query_result(result, sql_query, response_format))
+
 @app.route('/query', methods=['POST'])
 def query():
     global vector_store
     
     # Get query from request
     nl_query = request.json.get('query', '')
+    response_format = requested_format()
+    if response_format not in RESPONSE_FORMATS:
+        return json_response({'success': False, 'error': f'Unknown format {response_format}'}, 400)
     
     # Initialize vector store if not already done
     if vector_store is None:
@@ -35,87 +72,326 @@ def query():
     groq_api_key = os.getenv("GROQ_API_KEY")
     use_ollama = not groq_api_key
     
+    # Large results can be streamed row by row instead of being built in memory
+    if response_format == 'ndjson':
+        return stream_nl_query(nl_query, use_ollama)
+    
+    # Or opened as a result handle and read page by page
+    if request.json.get('pageSize'):
+        return paginate_nl_query(nl_query, use_ollama, request.json.get('pageSize'), response_format)
+    
     # Process query
     result, sql_query = query_excel_data(nl_query, vector_store=vector_store, use_ollama=use_ollama)
     
-    # Convert result to JSON
+    # Convert result to the requested format
+    return format_response(result, sql_query, response_format)
+
+def stream_nl_query(nl_query, use_ollama):
+    """Translate a question and stream its rows as NDJSON, caching the SQL once every row was sent"""
+    try:
+        translation = translate_query(nl_query, DB_FILENAME, vector_store, use_ollama)
+        sql_query = display_sql(translation)
+        return ndjson_response(
+            read_connection(DB_FILENAME),
+            lambda conn: stream_guarded_query(conn, translation['sql'], translation['params'], DB_FILENAME),
+            sql_query,
+            on_complete=lambda: remember_translation(nl_query, translation)
+        )
+    except SQLGuardError as e:
+        return json_response(format_query_result(e, ""))
+    except Exception as e:
+        return json_response(format_query_result(f"Error: {str(e)}", ""))
+
+def paginate_nl_query(nl_query, use_ollama, page_size, response_format):
+    """Translate a question and return the first page of its result with a handle for the rest"""
+    try:
+        translation = translate_query(nl_query, DB_FILENAME, vector_store, use_ollama)
+        sql_query = display_sql(translation)
+        payload = first_page(translation['sql'], translation['params'], DB_FILENAME, page_size, sql_query,
+                             response_format)
+        remember_translation(nl_query, translation)
+        return json_response(payload)
+    except SQLGuardError as e:
+        return json_response(format_query_result(e, ""))
+    except Exception as e:
+        return json_response(format_query_result(f"Error: {str(e)}", ""))
+
+def first_page(sql, params, db_path, page_size, sql_query, response_format):
+    """Open a result handle for a query and shape its first page as the response payload"""
+    result_set = result_store.create(sql, params, db_path)
+    result, has_more, next_cursor = result_set.page(0, page_size)
+    return page_payload(result_set, result, has_more, next_cursor, 0, sql_query, response_format)
+
+def page_payload(result_set, result, has_more, next_cursor, offset, sql_query, response_format):
+    """Page of a result with what the client needs to fetch the next one"""
+    return dict(format_query_result(result, sql_query, response_format),
+                handle=result_set.handle, offset=offset, hasMore=has_more, nextCursor=next_cursor,
+                totalRows=result_set.total)
+
+@app.route('/results/<handle>', methods=['GET'])
+def result_page(handle):
+    """Fetch a page of an open result by offset, or after the cursor returned with the previous page"""
+    result_set = result_store.get(handle)
+    if result_set is None:
+        return json_response({'success': False, 'error': 'Result expired or the data changed, run the query again',
+                              'errorCode': 'result_expired'}, 404)
+    response_format = requested_format()
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', RESULT_PAGE_SIZE))
+        after = request.args.get('after')
+        result, has_more, next_cursor = result_set.page(offset, limit, int(after) if after else None)
+    except SQLGuardError as e:
+        return json_response(format_query_result(e, ""))
+    except ValueError:
+        return json_response({'success': False, 'error': 'offset, limit and after must be integers'}, 400)
+    return json_response(page_payload(result_set, result, has_more, next_cursor, offset, None, response_format))
+
+@app.route('/results/<handle>/count', methods=['GET'])
+def result_count(handle):
+    """Count the rows of an open result; computed once, on first request"""
+    result_set = result_store.get(handle)
+    if result_set is None:
+        return json_response({'success': False, 'error': 'Result expired or the data changed, run the query again',
+                              'errorCode': 'result_expired'}, 404)
+    try:
+        return json_response({'success': True, 'totalRows': result_set.count()})
+    except SQLGuardError as e:
+        return json_response(format_query_result(e, ""))
+
+@app.route('/results/<handle>', methods=['DELETE'])
+def close_result(handle):
+    """Release an open result before it expires"""
+    return json_response({'success': result_store.discard(handle)})
+
+def format_query_result(result, sql_query, response_format='records'):
+    """Shape a query result, or the error string in its place, as the JSON payload returned to the UI"""
     if isinstance(result, pd.DataFrame):
-        return jsonify({
+        return {
             'success': True,
-            'data': result.to_dict(orient='records'),
+            'format': 'columnar' if response_format == 'columnar' else 'records',
+            'data': result_data(result, response_format),
             'columns': result.columns.tolist(),
             'rowCount': len(result),
+            'truncated': bool(result.attrs.get('truncated')),
             'sql': sql_query
-        })
+        }
+    elif isinstance(result, SQLGuardError):
+        return {
+            'success': False,
+            'error': result.message,
+            'errorCode': result.code,
+            'errorDetails': result.details
+        }
     else:
-        return jsonify({
+        return {
             'success': False,
             'error': str(result)
-        })
+        }
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue a question and return its job id at once; progress is polled or streamed from the job URLs"""
+    global vector_store
+    
+    nl_query = ((request.json or {}).get('query') or '').strip()
+    if not nl_query:
+        return json_response({'success': False, 'error': 'query is required'}, 400)
+    response_format = requested_format()
+    if response_format not in ('records', 'columnar'):
+        return json_response({'success': False, 'error': 'Jobs support the records and columnar formats'}, 400)
+    page_size = request.json.get('pageSize')
+    
+    if vector_store is None:
+        vector_store = load_or_create_vector_store()
+    use_ollama = not os.getenv("GROQ_API_KEY")
+    
+    def serialize(result, sql_query, page):
+        if page is not None:
+            result_set, has_more, next_cursor = page
+            return page_payload(result_set, result, has_more, next_cursor, 0, sql_query, response_format)
+        return format_query_result(result, sql_query, response_format)
+    
+    try:
+        job = job_queue.submit(nl_query, DB_FILENAME, vector_store, use_ollama, serialize, page_size)
+    except JobQueueFull as e:
+        return json_response({'success': False, 'error': str(e), 'errorCode': 'too_many_jobs',
+                              'errorDetails': {'limit': e.limit}}, 429)
+    return json_response(dict(job.snapshot(), success=True, statusUrl=f"/jobs/{job.job_id}",
+                              eventsUrl=f"/jobs/{job.job_id}/events"), 202)
+
+def job_not_found():
+    return json_response({'success': False, 'error': 'Job not found or expired', 'errorCode': 'job_not_found'}, 404)
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Poll a job: its status and stage, and the query result once it finished"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return job_not_found()
+    return json_response(dict(job.snapshot(), success=True))
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancel a queued or running job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return job_not_found()
+    return json_response(dict(job.snapshot(with_result=False), success=job.cancel()))
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-sent events for each stage a job enters, ending with a 'finished' event holding the result"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return job_not_found()
+    
+    def events():
+        seen = 0
+        while True:
+            new_events = job.wait_for_events(seen, JOB_EVENTS_KEEPALIVE)
+            if not new_events and job.status not in ('done', 'failed', 'cancelled'):
+                # Comments keep proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+            for event in new_events:
+                if event['type'] == 'stage':
+                    yield f"event: stage\ndata: {dumps(event).decode('utf-8')}\n\n"
+            seen += len(new_events)
+            if job.status in ('done', 'failed', 'cancelled'):
+                yield f"event: finished\ndata: {dumps(job.snapshot()).decode('utf-8')}\n\n"
+                return
+    
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/query/batch', methods=['POST'])
+def query_batch():
+    """Answer a list of questions in one request, with a result per question"""
+    global vector_store
+    
+    queries = (request.json or {}).get('queries', [])
+    if not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+        return jsonify({'success': False, 'error': 'queries must be a list of non-empty strings'}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({'success': False, 'error': f'At most {BATCH_MAX_QUERIES} queries per batch'}), 400
+    
+    if vector_store is None:
+        vector_store = load_or_create_vector_store()
+    use_ollama = not os.getenv("GROQ_API_KEY")
+    
+    # Batches are answered as one JSON document; each item may use the columnar layout
+    response_format = requested_format()
+    if response_format not in ('records', 'columnar'):
+        return jsonify({'success': False, 'error': 'Batch results support the records and columnar formats'}), 400
+    
+    results = query_excel_data_batch(queries, vector_store=vector_store, use_ollama=use_ollama)
+    return json_response({
+        'success': True,
+        'results': [dict(format_query_result(result, sql_query, response_format), query=q)
+                    for q, (result, sql_query) in zip(queries, results)]
+    })
+
+
+
+# Serialized /api/schema responses per database path: (version, etag, body, gzipped body)
+_schema_responses = {}
+_schema_responses_lock = threading.Lock()
+
+def schema_response(db_path):
+    """Schema response for the current database version, serialized and compressed once per ingest"""
+    version = database_version(db_path)
+    key = os.path.abspath(db_path)
+    with _schema_responses_lock:
+        cached = _schema_responses.get(key)
+        if cached is None or cached[0] != version:
+            with read_connection(db_path) as conn:
+                document = read_schema_document(conn)
+            body = dumps({'success': True, 'schema': document})
+            etag = hashlib.sha256(body).hexdigest()[:32]
+            cached = _schema_responses[key] = (version, etag, body, gzip.compress(body, compresslevel=6))
+    return cached
 
 @app.route('/api/schema')
 def get_schema():
-    """Return database schema information for all tables"""
+    """Return tables, columns, column statistics and sample rows; unchanged schemas answer 304"""
     try:
-        import sqlite3
-        from sqlite3 import Error
-        
         db_path = os.getenv("DATABASE_PATH", "excel_data.db")
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Get list of tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        
-        schema = {}
-        
-        # Exclude sqlite system tables
-        for table in tables:
-            table_name = table[0]
-            if table_name.startswith('sqlite_'):
-                continue
-                
-            # Get column information for each table
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns = cursor.fetchall()
-            
-            # Format column info
-            column_info = []
-            for col in columns:
-                column_info.append({
-                    'name': col[1],
-                    'type': col[2],
-                    'pk': col[5] == 1
-                })
-            
-            # Add sample data (first 3 rows)
-            try:
-                cursor.execute(f"SELECT * FROM {table_name} LIMIT 3")
-                sample_rows = cursor.fetchall()
-                sample_data = []
-                
-                for row in sample_rows:
-                    sample_row = {}
-                    for i, col in enumerate(columns):
-                        sample_row[col[1]] = row[i]
-                    sample_data.append(sample_row)
-            except Exception as e:
-                sample_data = [{"error": str(e)}]
-            
-            schema[table_name] = {
-                'columns': column_info,
-                'sample_data': sample_data
-            }
-        
-        conn.close()
-        return jsonify({'success': True, 'schema': schema})
+        _, etag, body, gzipped = schema_response(db_path)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif 'gzip' in request.accept_encodings:
+            response = Response(gzipped, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(body, mimetype='application/json')
+        # Clients revalidate every time; the ETag makes that a 304 until the next ingest
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/search', methods=['GET'])
+def search():
+    """
+    Full-text search over every stored cell; returns workbook, sheet and coordinate hits with snippets.
+    Pass nextCursor back as after for the next page.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return json_response({'success': False, 'error': 'Missing search text (q)'}, 400)
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', SEARCH_PAGE_SIZE))
+        after = request.args.get('after')
+        after = int(after) if after else None
+    except ValueError:
+        return json_response({'success': False, 'error': 'offset, limit and after must be integers'}, 400)
+    db_path = os.getenv("DATABASE_PATH", "excel_data.db")
+    try:
+        with read_connection(db_path) as conn:
+            hits, has_more, next_cursor = search_cells(conn, text, offset, limit, request.args.get('workbook'),
+                                                       request.args.get('sheet'), after)
+    except SQLGuardError as e:
+        return json_response(format_query_result(e, ""))
+    except Exception as e:
+        return json_response({'success': False, 'error': str(e)})
+    return json_response({'success': True, 'query': text, 'hits': hits, 'offset': offset, 'hasMore': has_more,
+                          'nextCursor': next_cursor})
+
+@app.route('/api/range', methods=['GET', 'POST'])
+def cell_range():
+    """
+    Read blocks of stored sheets as dense 2-D arrays of typed values. GET reads one range from
+    workbook, sheet and range parameters; POST reads {"ranges": [...]} in one round trip, each a
+    {workbook, sheet, range} object or a "Workbook/Sheet!A1:B2" string. formulas adds the formulas.
+    """
+    if request.method == 'POST':
+        body = request.get_json(silent=True) or {}
+        ranges = body.get('ranges')
+        formulas = bool(body.get('formulas', False))
+        if not isinstance(ranges, list) or not ranges:
+            return json_response({'success': False, 'error': 'ranges must be a non-empty list'}, 400)
+    else:
+        ranges = [{'workbook': request.args.get('workbook', ''), 'sheet': request.args.get('sheet'),
+                   'range': request.args.get('range', '')}]
+        formulas = request.args.get('formulas', 'false').lower() in ('1', 'true', 'yes')
+    db_path = os.getenv("DATABASE_PATH", "excel_data.db")
+    try:
+        with read_connection(db_path) as conn:
+            blocks = read_ranges(conn, ranges, formulas)
+    except ValueError as e:
+        return json_response({'success': False, 'error': str(e)}, 400)
+    except SQLGuardError as e:
+        return json_response(format_query_result(e, ""))
+    except Exception as e:
+        return json_response({'success': False, 'error': str(e)})
+    if request.method == 'GET':
+        return json_response(blocks[0])
+    return json_response({'success': True, 'ranges': blocks})
+
 @app.route('/execute_sql', methods=['POST'])
 def execute_sql():
     """Execute raw SQL query"""
@@ -127,23 +403,32 @@ def execute_sql():
         
         # Clean any markdown formatting that might be in the query
         sql_query = clean_sql_query(sql_query)
-        
-        # Connect to database
+        response_format = requested_format()
+        if response_format not in RESPONSE_FORMATS:
+            return json_response({'success': False, 'error': f'Unknown format {response_format}'}, 400)
         db_path = os.getenv("DATABASE_PATH", "excel_data.db")
-        conn = sqlite3.connect(db_path)
         
-        # Execute query and convert to dataframe
-        result = pd.read_sql_query(sql_query, conn)
+        # Stream rows straight from the cursor; the connection is held until the stream ends
+        if response_format == 'ndjson':
+            return ndjson_response(read_connection(db_path),
+                                   lambda conn: stream_guarded_query(conn, sql_query, db_path=db_path),
+                                   sql_query)
         
-        # Convert to JSON response
-        return jsonify({
-            'success': True,
-            'data': result.to_dict(orient='records'),
-            'columns': result.columns.tolist(),
-            'rowCount': len(result),
-            'sql': sql_query
-        })
+        # Open a result handle and return only the first page
+        if request.json.get('pageSize'):
+            return json_response(first_page(sql_query, None, db_path, request.json.get('pageSize'), sql_query,
+                                            response_format))
+        
+        # Borrow a pooled read-only connection, returned to the pool when the block exits
+        with read_connection(db_path) as conn:
+            # Execute query within the time and row limits and convert to dataframe
+            result = run_guarded_query(conn, sql_query, db_path=db_path)
+        
+        # Convert to the requested format
+        return format_response(result, sql_query, response_format)
     
+    except SQLGuardError as e:
+        return json_response(format_query_result(e, sql_query))
     except Exception as e:
         return jsonify({
             'success': False,
@@ -719,9 +1004,17 @@ def create_templates():
 def system_status():
     groq_api_key = os.getenv("GROQ_API_KEY")
     return jsonify({
-        'usingGroq': bool(groq_api_key)
+        'usingGroq': bool(groq_api_key),
+        'promptStats': get_prompt_stats(),
+        'translationCache': get_translation_cache_stats(),
+        'semanticCache': get_semantic_cache_stats(),
+        'translations': get_translation_stats(),
+        'llm': get_llm_stats(),
+        'connections': get_pool_stats(),
+        'jobs': job_queue.stats()
     })
 
 if __name__ == '__main__':
     create_templates()
+    warm_up_app()
     app.run(debug=DEBUG, host='0.0.0.0', port=PORT)
\ No newline at end of file
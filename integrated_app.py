@@ -55,7 +55,19 @@ GROQ_API_KEY=
 DATABASE_PATH=excel_data.db
 
 # Vector store configuration
+VECTOR_STORE_BACKEND=numpy
 VECTOR_STORE_PATH=vectorstore
+VECTOR_INDEX_PATH=vectorindex
+
+# Embedding backend: torch, or onnx for the int8 ONNX export on CPU-only machines
+EMBEDDING_BACKEND=torch
+EMBEDDING_THREADS=4
+
+# LLM configuration (GROQ_BASE_URL/OLLAMA_BASE_URL can point at llm_stub_server.py)
+OLLAMA_BASE_URL=http://localhost:11434
+LLM_TIMEOUT_SECONDS=20
+LLM_HEDGE_SECONDS=4
+LLM_FALLBACK_PROVIDER=
 
 # Server configuration
 PORT=5000
@@ -82,19 +94,20 @@ def run_excel_processing():
     main.main()
 
 def run_vector_indexing():
-    """Create the vector store for RAG"""
-    from excel_nl_query import create_vector_store
-    create_vector_store()
+    """Create the vector store for RAG, re-indexing only changed chunks if it already exists"""
+    from excel_nl_query import load_or_create_vector_store
+    load_or_create_vector_store()
 
 def run_web_app():
     """Run the Flask web application"""
-    from excel_query_app import app
+    from excel_query_app import app, warm_up_app
     from dotenv import load_dotenv
     load_dotenv()
     
     port = int(os.getenv("PORT", 5000))
     debug = os.getenv("DEBUG", "True").lower() == "true"
     
+    warm_up_app()
     print(f"Starting web application on port {port}...")
     app.run(debug=debug, host='0.0.0.0', port=port)
 
@@ -103,6 +116,38 @@ def run_cli():
     from excel_nl_query import create_ui
     create_ui()
 
+def check_startup_time():
+    """Measure import time of the query modules in a fresh interpreter against the startup budget"""
+    import subprocess
+    import time
+    budget = float(os.getenv("STARTUP_BUDGET_SECONDS", "1.0"))
+    failed = False
+    for module in ['main', 'excel_nl_query', 'excel_query_app']:
+        started = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", f"import {module}"], capture_output=True, text=True)
+        elapsed = time.perf_counter() - started
+        if result.returncode != 0:
+            print(f"  {module}: import failed\n{result.stderr.strip()}")
+            failed = True
+            continue
+        status = "OK" if elapsed <= budget else "OVER BUDGET"
+        failed = failed or elapsed > budget
+        print(f"  {module}: {elapsed:.2f}s (budget {budget:.2f}s) {status}")
+    return not failed
+
+def check_embedding_backends():
+    """Compare the ONNX embedding backend with the PyTorch model on a fixed question set and print the report"""
+    import json
+    from excel_nl_query import model_name, build_vector_documents, DB_FILENAME
+    from onnx_embeddings import OnnxEmbeddings, compare_embedding_backends, EMBEDDING_CHECK_QUERIES
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+    
+    documents = build_vector_documents(DB_FILENAME) if os.path.exists(DB_FILENAME) else EMBEDDING_CHECK_QUERIES
+    report = compare_embedding_backends(lambda: HuggingFaceEmbeddings(model_name=model_name),
+                                        lambda: OnnxEmbeddings(model_name), documents)
+    print(json.dumps(report, indent=2))
+    return report['quality']['recall_at_k'] >= 0.8
+
 def main():
     parser = argparse.ArgumentParser(description='Excel Natural Language Query System')
     parser.add_argument('--process', action='store_true', help='Process Excel files and create database')
@@ -111,6 +156,8 @@ def main():
     parser.add_argument('--cli', action='store_true', help='Start command-line interface')
     parser.add_argument('--all', action='store_true', help='Run all steps (process, index, web)')
     parser.add_argument('--setup', action='store_true', help='Setup environment (.env file and dependencies)')
+    parser.add_argument('--startup-check', action='store_true', help='Measure module import time against STARTUP_BUDGET_SECONDS')
+    parser.add_argument('--embedding-check', action='store_true', help='Compare the ONNX embedding backend with the PyTorch model')
     
     args = parser.parse_args()
     
@@ -119,6 +166,18 @@ def main():
         install_requirements()
         setup_dotenv()
     
+    if args.startup_check:
+        print("Checking startup time...")
+        if not check_startup_time():
+            sys.exit(1)
+        return
+    
+    if args.embedding_check:
+        print("Comparing embedding backends...")
+        if not check_embedding_backends():
+            sys.exit(1)
+        return
+    
     # Check credentials
     check_credentials()
     
@@ -140,7 +199,7 @@ def main():
         run_cli()
     
     # If no arguments provided, show help
-    if not (args.process or args.index or args.web or args.cli or args.all or args.setup):
+    if not (args.process or args.index or args.web or args.cli or args.all or args.setup or args.startup_check or args.embedding_check):
         parser.print_help()
 
 if __name__ == "__main__":
@@ -0,0 +1,209 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Deadlines and pool sizes for LLM calls
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "3"))
+# A fallback provider is started if the first has not answered after this long
+LLM_HEDGE_SECONDS = float(os.getenv("LLM_HEDGE_SECONDS", "4"))
+LLM_MAX_WORKERS = int(os.getenv("LLM_MAX_WORKERS", "8"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+# Provider raced against the primary one: "groq", "ollama" or empty to disable
+LLM_FALLBACK_PROVIDER = os.getenv("LLM_FALLBACK_PROVIDER", "").lower()
+
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL") or None
+GROQ_MODEL = os.getenv("GROQ_MODEL", "llama3-8b-8192")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
+
+_http_client = None
+_groq_client = None
+_ollama_client = None
+_executor = None
+_client_lock = threading.Lock()
+
+def get_http_client():
+    """Return the shared HTTP client whose connection pool is reused by every provider"""
+    global _http_client
+    if _http_client is None:
+        with _client_lock:
+            if _http_client is None:
+                import httpx
+                _http_client = httpx.Client(
+                    timeout=httpx.Timeout(LLM_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+                    limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                        max_keepalive_connections=LLM_MAX_CONNECTIONS)
+                )
+    return _http_client
+
+def get_executor():
+    """Return the thread pool LLM calls are dispatched on"""
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_MAX_WORKERS, thread_name_prefix="llm")
+    return _executor
+
+def get_groq_client():
+    """Return the shared Groq client, or None without an API key"""
+    global _groq_client
+    if _groq_client is None and GROQ_API_KEY:
+        http_client = get_http_client()
+        with _client_lock:
+            if _groq_client is None:
+                from groq import Groq
+                # Retries are left to the fallback provider so a slow call cannot exceed its deadline
+                _groq_client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL,
+                                    http_client=http_client, max_retries=0)
+    return _groq_client
+
+class OllamaClient:
+    """Ollama generate API over the shared HTTP connection pool"""
+    def __init__(self, base_url=OLLAMA_BASE_URL, model=OLLAMA_MODEL, http_client=None):
+        self.base_url = base_url
+        self.model = model
+        self.http_client = http_client or get_http_client()
+
+    def invoke(self, prompt, timeout=None, temperature=0.1):
+        """Generate a completion for prompt, raising on HTTP errors or when the deadline passes"""
+        response = self.http_client.post(
+            f"{self.base_url}/api/generate",
+            json={"model": self.model, "prompt": prompt, "stream": False,
+                  "options": {"temperature": temperature}},
+            timeout=timeout if timeout is not None else LLM_TIMEOUT_SECONDS
+        )
+        response.raise_for_status()
+        return response.json().get("response", "")
+
+def get_ollama_client():
+    """Return the shared Ollama client"""
+    global _ollama_client
+    if _ollama_client is None:
+        http_client = get_http_client()
+        with _client_lock:
+            if _ollama_client is None:
+                _ollama_client = OllamaClient(http_client=http_client)
+    return _ollama_client
+
+def call_groq(system_prompt, user_prompt, timeout):
+    """Ask Groq for a completion within timeout seconds"""
+    response = get_groq_client().chat.completions.create(
+        model=GROQ_MODEL,
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        temperature=0.1,
+        max_tokens=500,
+        timeout=timeout
+    )
+    usage = getattr(response, 'usage', None)
+    return response.choices[0].message.content.strip(), getattr(usage, 'prompt_tokens', None)
+
+def call_ollama(system_prompt, user_prompt, timeout):
+    """Ask the local Ollama server for a completion within timeout seconds"""
+    response = get_ollama_client().invoke(f"System: {system_prompt}\n\nUser: {user_prompt}", timeout=timeout)
+    return response.strip(), None
+
+PROVIDERS = {'groq': call_groq, 'ollama': call_ollama}
+
+def provider_order(use_ollama=False):
+    """Providers to try for a request, the preferred one first and the configured fallback after it"""
+    order = ['ollama'] if use_ollama else (['groq'] if get_groq_client() else [])
+    fallback = LLM_FALLBACK_PROVIDER
+    if fallback in PROVIDERS and fallback not in order and (fallback != 'groq' or get_groq_client()):
+        order.append(fallback)
+    return order
+
+# Per-provider outcome counters, exposed through the system status endpoint
+llm_stats = {}
+_llm_stats_lock = threading.Lock()
+
+def record_llm_call(provider, outcome, seconds):
+    """Count a finished call per provider and outcome (won, rejected, failed, late)"""
+    with _llm_stats_lock:
+        stats = llm_stats.setdefault(provider, {'won': 0, 'rejected': 0, 'failed': 0, 'late': 0,
+                                                'calls': 0, 'total_seconds': 0.0})
+        stats[outcome] += 1
+        stats['calls'] += 1
+        stats['total_seconds'] += seconds
+
+def get_llm_stats():
+    """Return a copy of the per-provider counters with average call latency"""
+    with _llm_stats_lock:
+        stats = {name: dict(values) for name, values in llm_stats.items()}
+    for values in stats.values():
+        values['average_seconds'] = values['total_seconds'] / values['calls'] if values['calls'] else 0
+    return stats
+
+def _timed_call(provider, system_prompt, user_prompt, timeout):
+    started = time.perf_counter()
+    try:
+        text, prompt_tokens = PROVIDERS[provider](system_prompt, user_prompt, timeout)
+    except Exception:
+        record_llm_call(provider, 'failed', time.perf_counter() - started)
+        raise
+    return {'provider': provider, 'text': text, 'prompt_tokens': prompt_tokens,
+            'seconds': time.perf_counter() - started}
+
+def _record_late(future):
+    # Calls that finish after the race was decided still count towards the latency figures
+    if future.cancelled() or future.exception() is not None:
+        return
+    result = future.result()
+    record_llm_call(result['provider'], 'late', result['seconds'])
+
+def complete_first(system_prompt, user_prompt, providers, accept=None, deadline=LLM_TIMEOUT_SECONDS,
+                   hedge_seconds=LLM_HEDGE_SECONDS):
+    """
+    Dispatch the prompt to providers on the LLM thread pool and return the first acceptable answer.
+    The first provider starts immediately; the next one starts when hedge_seconds pass without an
+    acceptable answer or as soon as every running call has failed. Returns None when no provider
+    produced an acceptable answer before the deadline.
+    """
+    accept = accept or (lambda text: bool(text and text.strip()))
+    executor = get_executor()
+    waiting = list(providers)
+    pending = {}
+    ends_at = time.monotonic() + deadline
+    next_start = ends_at
+
+    def start_next():
+        provider = waiting.pop(0)
+        remaining = max(ends_at - time.monotonic(), 0.1)
+        pending[executor.submit(_timed_call, provider, system_prompt, user_prompt, remaining)] = provider
+        return time.monotonic() + hedge_seconds
+
+    try:
+        while waiting or pending:
+            if waiting and (not pending or time.monotonic() >= next_start):
+                next_start = start_next()
+            now = time.monotonic()
+            if now >= ends_at:
+                print(f"LLM deadline of {deadline:.1f}s passed waiting for {', '.join(pending.values())}")
+                return None
+            wait_until = min(ends_at, next_start) if waiting else ends_at
+            done, _ = wait(list(pending), timeout=max(wait_until - now, 0), return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error using {provider}: {e}")
+                    continue
+                if accept(result['text']):
+                    record_llm_call(provider, 'won', result['seconds'])
+                    return result
+                record_llm_call(provider, 'rejected', result['seconds'])
+                print(f"Rejected answer from {provider}")
+        return None
+    finally:
+        for future in pending:
+            future.add_done_callback(_record_late)
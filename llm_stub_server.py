@@ -0,0 +1,98 @@
+"""
+Local stand-in for the Groq and Ollama APIs, for exercising the LLM client layer without network access.
+
+Run it and point the app at it:
+    python llm_stub_server.py --port 8099 --delay 0.5
+    GROQ_BASE_URL=http://localhost:8099 OLLAMA_BASE_URL=http://localhost:8099 python integrated_app.py --web
+
+Serves the Groq (OpenAI-compatible) chat completions endpoint and the Ollama generate endpoint.
+Every response returns the same SQL after the configured delay, or the configured HTTP error status.
+"""
+import json
+import time
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answer chat completion and generate requests with canned SQL"""
+    sql = "SELECT 1"
+    delay = 0.0
+    status = 200
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/api/tags":
+            self.send_json({"models": [{"name": "llama3"}]})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.delay)
+        if self.status != 200:
+            self.send_json({"error": {"message": "stub error"}}, self.status)
+        elif self.path.endswith("/chat/completions"):
+            prompt = " ".join(m.get("content", "") for m in body.get("messages", []))
+            self.send_json({
+                "id": "stub", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": self.sql}}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(self.sql) // 4,
+                          "total_tokens": (len(prompt) + len(self.sql)) // 4}
+            })
+        elif self.path.rstrip("/") == "/api/generate":
+            self.send_json({"model": body.get("model", "stub"), "response": self.sql, "done": True})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        print(f"stub: {self.command} {self.path} -> {args[1] if len(args) > 1 else ''}")
+
+
+def create_stub_server(port=8099, sql=StubHandler.sql, delay=0.0, status=200):
+    """Create a stub server answering with sql after delay seconds, or with an error status; port 0 picks a free port"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"sql": sql, "delay": delay, "status": status})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_stub_server(port=0, sql=StubHandler.sql, delay=0.0, status=200):
+    """Serve the stub on a background thread, for tests; returns the server and its base URL"""
+    server = create_stub_server(port, sql, delay, status)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run_stub_server(port=8099, sql=StubHandler.sql, delay=0.0, status=200):
+    """Start the stub server and block until interrupted"""
+    server = create_stub_server(port, sql, delay, status)
+    print(f"LLM stub server listening on http://127.0.0.1:{server.server_address[1]} (delay {delay}s, status {status})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stub for the Groq and Ollama APIs")
+    parser.add_argument("--port", type=int, default=8099, help="Port to listen on")
+    parser.add_argument("--sql", default=StubHandler.sql, help="SQL returned by every completion")
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds to wait before answering")
+    parser.add_argument("--status", type=int, default=200, help="HTTP status to answer with")
+    args = parser.parse_args()
+    run_stub_server(args.port, args.sql, args.delay, args.status)
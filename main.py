@@ -6,6 +6,10 @@ import re
 from datetime import datetime, date
 from openpyxl import load_workbook, Workbook
 from copy import copy
+from catalog import build_catalog
+from value_index import build_value_index
+from rollups import refresh_rollups
+from cell_search import create_search_index
 
 
 excel_files = ["Deposits Data Lite.xlsx", "Form X Report  Main Lite.xlsx", "Loans Data Lite.xlsx"]
@@ -14,6 +18,9 @@ exclude_sheets = {"Pivot-Borrowings"}
 db_filename = "excel_data.db"
 output_dir = "output"
 new_base_path = ""
+# Reader backend used to build tabular tables; only non-report sheets become tables.
+# "calamine" is a values-only reader; other sheet types fall back to openpyxl.
+sheet_readers = {"non_report": "calamine"}
 
 
 class DateTimeEncoder(json.JSONEncoder):
@@ -138,6 +145,36 @@ def fix_external_references(formula, excel_file_map):
     return updated_formula
 
 
+def read_sheet_frame(file, sheet_name, sheet_type="non_report"):
+    """Read a sheet into a DataFrame using the reader backend configured for its type"""
+    engine = sheet_readers.get(sheet_type, "openpyxl")
+    if engine == "calamine":
+        try:
+            return pd.read_excel(file, sheet_name=sheet_name, engine="calamine")
+        except ImportError:
+            print("  python-calamine not installed, falling back to openpyxl reader")
+    return pd.read_excel(file, sheet_name=sheet_name, engine="openpyxl")
+
+
+def formula_cached_values(ws, values_ws):
+    """Values Excel last calculated for the formula cells of ws, keyed by (row, column), from a read-only sheet"""
+    cached = {}
+    # max_row and max_column scan every cell of the sheet, so they are read once
+    max_row, max_column = ws.max_row, ws.max_column
+    for row in values_ws.iter_rows():
+        for cell in row:
+            if cell.value is None:
+                continue
+            # Padding cells of read-only sheets have no position
+            row_num, col_num = getattr(cell, 'row', None), getattr(cell, 'column', None)
+            if row_num is None or row_num > max_row or col_num > max_column:
+                continue
+            formula = ws.cell(row=row_num, column=col_num).value
+            if isinstance(formula, str) and formula.startswith('='):
+                cached[(row_num, col_num)] = cell.value
+    return cached
+
+
 def setup_database(db_path):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
@@ -174,10 +211,17 @@ def setup_database(db_path):
         coordinate TEXT,
         value TEXT,
         is_formula BOOLEAN,
+        row_num INTEGER,
+        col_num INTEGER,
+        data_type TEXT,
+        cached_value,
         FOREIGN KEY (sheet_id) REFERENCES sheets (id),
         UNIQUE (sheet_id, coordinate)
     )
     """)
+    # Range reads scan one sheet's rows and columns in order
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cells_position ON cells (sheet_id, row_num, col_num)")
+    create_search_index(conn)
     
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS tabular_data (
@@ -214,10 +258,13 @@ def insert_sheet(cursor, workbook_id, sheet_name, sheet_type, max_row, max_colum
                    (workbook_id, sheet_name))
     return cursor.fetchone()[0]
 
-def insert_cell(cursor, sheet_id, coordinate, value, is_formula):
+def insert_cell(cursor, sheet_id, coordinate, value, is_formula, row_num=None, col_num=None, data_type=None,
+                cached_value=None):
     cursor.execute(
-        "INSERT OR REPLACE INTO cells (sheet_id, coordinate, value, is_formula) VALUES (?, ?, ?, ?)",
-        (sheet_id, coordinate, value, is_formula)
+        """INSERT OR REPLACE INTO cells
+           (sheet_id, coordinate, value, is_formula, row_num, col_num, data_type, cached_value)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+        (sheet_id, coordinate, value, is_formula, row_num, col_num, data_type, cached_value)
     )
 
 
@@ -317,6 +364,8 @@ def store_data(workbook_data=None):
     for file in excel_files:
         print(f"Processing file: {file}")
         wb = load_workbook(file, data_only=False)
+        # Values Excel last calculated for formula cells, streamed from a read-only pass for typed range reads
+        values_wb = load_workbook(file, read_only=True, data_only=True)
         properties = {
             "title": wb.properties.title,
             "creator": wb.properties.creator,
@@ -344,6 +393,7 @@ def store_data(workbook_data=None):
             conn.commit()
 
             print(f"  Processing cells in sheet: {sheet_name}")
+            cached_values = formula_cached_values(ws, values_wb[sheet_name])
             for row in range(1, ws.max_row + 1):
                 for col in range(1, ws.max_column + 1):
                     cell = ws.cell(row=row, column=col)
@@ -358,12 +408,16 @@ def store_data(workbook_data=None):
                         cell_value = str(cell.value)
                     if is_formula and new_base_path:
                         cell_value = fix_external_references(cell_value, excel_file_map)
-                    insert_cell(cursor, sheet_id, cell.coordinate, cell_value, is_formula)
+                    cached_value = cached_values.get((row, col)) if is_formula else None
+                    if cached_value is not None and not isinstance(cached_value, (int, float, str)):
+                        cached_value = str(cached_value)
+                    insert_cell(cursor, sheet_id, cell.coordinate, cell_value, is_formula, row, col,
+                                'f' if is_formula else cell.data_type, cached_value)
             if sheet_type == "non_report":
                 try:
                     base_name = os.path.splitext(os.path.basename(file))[0]
                     table_name = f"{base_name}_{sheet_name}".replace(" ", "_").replace("-", "_")
-                    df = pd.read_excel(file, sheet_name=sheet_name)
+                    df = read_sheet_frame(file, sheet_name, sheet_type)
                     df.to_sql(table_name, conn, if_exists='replace', index=False)
                     cursor.execute(
                         "INSERT OR REPLACE INTO tabular_data (workbook, sheet, table_name) VALUES (?, ?, ?)",
@@ -376,8 +430,12 @@ def store_data(workbook_data=None):
             
             conn.commit()
         
+        values_wb.close()
         print(f"Completed processing file: {file}")
     conn.commit()
+    build_catalog(conn)
+    build_value_index(conn)
+    refresh_rollups(conn)
     conn.close()
     print("\nData storage complete.")
 
@@ -0,0 +1,176 @@
+import os
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Exported model files published with the sentence-transformers checkpoints; the quint8 file is
+# the dynamically quantized int8 export, onnx/model.onnx the full-precision one
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+# Local directory holding the model file and tokenizer.json, used instead of the Hugging Face hub
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "4"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_MAX_LENGTH = 256
+
+# Fixed question set used to compare retrieval between embedding backends
+EMBEDDING_CHECK_QUERIES = [
+    "What is the total deposit amount?",
+    "How many loans are there?",
+    "Show the top 10 loans by outstanding principal amount",
+    "Average interest rate by loan type",
+    "Total deposits by branch",
+    "Which customers have the largest balances?",
+    "Monthly trend of loan disbursements",
+    "Count of fixed deposits maturing this year",
+    "List loans with overdue payments",
+    "What is the total outstanding principal for each product?",
+    "Show deposits opened in 2023",
+    "Minimum and maximum interest rate on deposits",
+]
+
+
+def resolve_model_files(model_name, model_file=EMBEDDING_ONNX_FILE, model_dir=EMBEDDING_ONNX_DIR):
+    """Return local paths to the ONNX model and its tokenizer, downloading them from the hub if needed"""
+    if model_dir:
+        return os.path.join(model_dir, os.path.basename(model_file)), os.path.join(model_dir, "tokenizer.json")
+    from huggingface_hub import hf_hub_download
+    repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    return hf_hub_download(repo_id, model_file), hf_hub_download(repo_id, "tokenizer.json")
+
+
+class OnnxEmbeddings:
+    """
+    Sentence-transformer embeddings computed with ONNX Runtime on the CPU, without loading PyTorch.
+    Mean pooling and normalization match the sentence-transformers pipeline of the same model.
+    """
+    def __init__(self, model_name, model_file=EMBEDDING_ONNX_FILE, threads=EMBEDDING_THREADS,
+                 batch_size=EMBEDDING_BATCH_SIZE, model_dir=EMBEDDING_ONNX_DIR):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        model_path, tokenizer_path = resolve_model_files(model_name, model_file, model_dir)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=EMBEDDING_MAX_LENGTH)
+        self.tokenizer.enable_padding()
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.signature = f"onnx:{model_name}:{model_file}"
+
+    def _embed(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + self.batch_size])
+            input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+            attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+            feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feeds["token_type_ids"] = np.zeros_like(input_ids)
+            token_embeddings = self.session.run(None, feeds)[0]
+
+            # Mean pooling over real tokens, then unit length as in the sentence-transformers model
+            mask = attention_mask[..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.append(pooled.astype(np.float32))
+        return np.vstack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+    def embed_documents(self, texts):
+        """Embed a list of texts in batches"""
+        return self._embed(list(texts)).tolist()
+
+    def embed_query(self, text):
+        """Embed a single question"""
+        return self._embed([text])[0].tolist()
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB (peak RSS where the current value is not available)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return None
+
+
+def measure_backend(load, documents, queries):
+    """Load an embedding backend and time it on the documents and questions; returns (embedder, report)"""
+    rss_before = current_rss_mb()
+    started = time.perf_counter()
+    embedder = load()
+    load_seconds = time.perf_counter() - started
+    rss_after = current_rss_mb()
+
+    embedder.embed_query(queries[0])
+    started = time.perf_counter()
+    query_vectors = np.asarray([embedder.embed_query(query) for query in queries], dtype=np.float32)
+    query_ms = (time.perf_counter() - started) * 1000 / len(queries)
+    started = time.perf_counter()
+    document_vectors = np.asarray(embedder.embed_documents(documents), dtype=np.float32)
+    batch_seconds = time.perf_counter() - started
+
+    report = {
+        'load_seconds': round(load_seconds, 3),
+        'rss_mb': round(rss_after - rss_before, 1) if rss_before is not None else None,
+        'query_ms': round(query_ms, 2),
+        'documents_per_second': round(len(documents) / batch_seconds, 1) if batch_seconds else None,
+    }
+    return (query_vectors, document_vectors), report
+
+
+def compare_embedding_backends(reference_loader, candidate_loader, documents, queries=None, k=5):
+    """
+    Compare a candidate embedding backend with the reference one on a fixed question set: load time,
+    memory, latency, and agreement of the top-k retrieved documents. The candidate is measured first
+    so its memory figure is not inflated by the reference model.
+    """
+    from vector_index import normalize_rows
+    queries = queries or EMBEDDING_CHECK_QUERIES
+    documents = list(dict.fromkeys(documents))
+    k = min(k, len(documents))
+
+    (candidate_queries, candidate_documents), candidate_report = measure_backend(candidate_loader, documents, queries)
+    (reference_queries, reference_documents), reference_report = measure_backend(reference_loader, documents, queries)
+
+    def top_k(query_vectors, document_vectors):
+        scores = normalize_rows(query_vectors) @ normalize_rows(document_vectors).T
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    reference_top = top_k(reference_queries, reference_documents)
+    candidate_top = top_k(candidate_queries, candidate_documents)
+    overlap = [len(set(r) & set(c)) / k for r, c in zip(reference_top, candidate_top)]
+    # Vectors of the two backends are only comparable directly when they come from the same model
+    same_dimension = reference_queries.shape == candidate_queries.shape
+    cosine = (normalize_rows(reference_queries) * normalize_rows(candidate_queries)).sum(axis=1) if same_dimension else None
+
+    return {
+        'reference': reference_report,
+        'candidate': candidate_report,
+        'quality': {
+            'queries': len(queries),
+            'documents': len(documents),
+            'k': k,
+            'recall_at_k': round(float(np.mean(overlap)), 3),
+            'top1_agreement': round(float(np.mean(reference_top[:, 0] == candidate_top[:, 0])), 3),
+            'mean_query_cosine': round(float(cosine.mean()), 4) if cosine is not None else None,
+            'min_query_cosine': round(float(cosine.min()), 4) if cosine is not None else None,
+        }
+    }
@@ -0,0 +1,428 @@
+import re
+import time
+import sqlite3
+import hashlib
+import json
+import threading
+from collections import deque
+
+
+# Quoted names in questions, matched as written since SQL compares them case-sensitively
+QUOTED_LITERAL_PATTERN = re.compile(r"('[^']+'|\"[^\"]+\")")
+
+
+def normalize_question(question):
+    """
+    Normalize a question for cache lookups: lowercase, drop punctuation, collapse whitespace.
+    Quoted literals keep their case and punctuation.
+    """
+    parts = QUOTED_LITERAL_PATTERN.split(question.strip())
+    for index in range(0, len(parts), 2):
+        text = parts[index].lower()
+        # Drop thousands separators so "2,000" and "2000" match
+        text = re.sub(r"(?<=\d),(?=\d{3}\b)", "", text)
+        # Keep characters that carry meaning: comparisons, decimals, percentages, dates
+        text = re.sub(r"[^\w\s.%/<>=!-]", " ", text)
+        parts[index] = re.sub(r"(?<!\d)[.\-/]|[.\-/](?!\d)", " ", text)
+    return " ".join(" ".join(parts).split())
+
+
+# Literals in questions: ISO dates, quoted names and numbers, in that order of precedence
+QUESTION_LITERAL_PATTERN = re.compile(
+    r"(?P<date>\b\d{4}-\d{2}-\d{2}\b)|'(?P<squote>[^']+)'|\"(?P<dquote>[^\"]+)\"|(?P<num>(?<![\w.])\d+(?:\.\d+)?(?![\w-]))"
+)
+# Tokens in SQL: string literals, quoted identifiers, bare identifiers and numbers
+SQL_TOKEN_PATTERN = re.compile(
+    r"'(?P<string>(?:[^']|'')*)'|\"[^\"]*\"|\[[^\]]*\]|[A-Za-z_][\w$]*|(?P<num>\d+(?:\.\d+)?)"
+)
+
+
+def extract_question_literals(question):
+    """
+    Extract literals from a question as (kind, value) pairs in order of appearance, where kind is
+    'num', 'date' or 'str'. Also returns the question with each literal replaced by a placeholder.
+    """
+    question = re.sub(r"(?<=\d),(?=\d{3}\b)", "", question)
+    literals = []
+
+    def replace(match):
+        if match.group('date'):
+            literals.append(('date', match.group('date')))
+            return ' <date> '
+        if match.group('num'):
+            text = match.group('num')
+            literals.append(('num', float(text) if '.' in text else int(text)))
+            return ' <num> '
+        literals.append(('str', match.group('squote') or match.group('dquote')))
+        return ' <str> '
+
+    shape = QUESTION_LITERAL_PATTERN.sub(replace, question)
+    return literals, normalize_question(shape)
+
+
+def extract_literals(question):
+    """Numbers, dates and quoted strings in a question, which must match for two questions to share SQL"""
+    literals, _ = extract_question_literals(question)
+    return sorted(str(value) for _, value in literals)
+
+
+def parameterize_sql(question, sql):
+    """
+    Turn SQL generated for a question into a template with ? placeholders where the question's
+    literals appear. Returns (template, param_map), param_map giving the question literal index for
+    each placeholder, or None when the literals cannot be located unambiguously.
+    """
+    literals, _ = extract_question_literals(question)
+    if not literals:
+        return None
+
+    def matches(literal, token):
+        kind, value = literal
+        if token.group('num') is not None:
+            return kind == 'num' and float(token.group('num')) == float(value)
+        if token.group('string') is not None:
+            text = token.group('string').replace("''", "'")
+            return kind in ('date', 'str') and text.lower() == str(value).lower()
+        return False
+
+    pieces = []
+    param_map = []
+    matched = set()
+    position = 0
+    for token in SQL_TOKEN_PATTERN.finditer(sql):
+        candidates = [i for i, literal in enumerate(literals) if matches(literal, token)]
+        if not candidates:
+            continue
+        if len(candidates) > 1:
+            # The same value appears twice in the question, so the binding would be ambiguous
+            return None
+        if candidates[0] in matched:
+            # One question literal in several places (LIMIT 5 and substr(..., 5, 2)) cannot be told apart
+            return None
+        pieces.append(sql[position:token.start()])
+        pieces.append('?')
+        param_map.append(candidates[0])
+        matched.add(candidates[0])
+        position = token.end()
+    pieces.append(sql[position:])
+
+    if len(matched) != len(literals):
+        return None
+    return ''.join(pieces), param_map
+
+
+def bind_parameters(question, param_map):
+    """Values from a question to bind to a template's placeholders"""
+    literals, _ = extract_question_literals(question)
+    if param_map and max(param_map) >= len(literals):
+        return None
+    return [literals[i][1] for i in param_map]
+
+
+def render_sql(template, params):
+    """Inline bound parameters into a template for display only; execution always binds them"""
+    values = iter(params)
+
+    def replace(match):
+        if match.group(0) != '?':
+            return match.group(0)
+        value = next(values)
+        if isinstance(value, (int, float)):
+            return str(value)
+        return "'" + str(value).replace("'", "''") + "'"
+
+    return re.sub(r"'(?:[^']|'')*'|\"[^\"]*\"|\?", replace, template)
+
+
+class TranslationCache:
+    """
+    Persistent NL-to-SQL translation cache stored in SQLite. Entries are keyed on the
+    normalized question plus the schema fingerprint, evicted least-recently-used once
+    max_entries is exceeded and expired after ttl_seconds.
+    """
+    def __init__(self, path, max_entries=1000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.fingerprint = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                key TEXT PRIMARY KEY,
+                question TEXT,
+                fingerprint TEXT,
+                sql TEXT,
+                created_at REAL,
+                last_used REAL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations (last_used)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sql_templates (
+                key TEXT PRIMARY KEY,
+                shape TEXT,
+                fingerprint TEXT,
+                template TEXT,
+                param_map TEXT,
+                created_at REAL,
+                last_used REAL,
+                hits INTEGER DEFAULT 0
+            )
+        """)
+        self._conn.commit()
+        self.template_hits = 0
+        self.template_misses = 0
+
+    @staticmethod
+    def make_key(question, fingerprint):
+        """Cache key for a question under a given schema fingerprint"""
+        return hashlib.sha256(f"{fingerprint}\n{normalize_question(question)}".encode('utf-8')).hexdigest()
+
+    def _check_fingerprint(self, fingerprint):
+        """Drop entries built against another schema the first time a new fingerprint is seen"""
+        if fingerprint != self.fingerprint:
+            removed = self._conn.execute("DELETE FROM translations WHERE fingerprint != ?", (fingerprint,)).rowcount
+            removed += self._conn.execute("DELETE FROM sql_templates WHERE fingerprint != ?", (fingerprint,)).rowcount
+            self._conn.commit()
+            if removed:
+                print(f"Translation cache: schema changed, invalidated {removed} entries")
+            self.fingerprint = fingerprint
+
+    def get(self, question, fingerprint):
+        """Return the cached SQL for the question, or None on a miss"""
+        key = self.make_key(question, fingerprint)
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            row = self._conn.execute("SELECT sql, created_at FROM translations WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] <= self.ttl_seconds:
+                self._conn.execute("UPDATE translations SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += 1
+                return row[0]
+            if row:
+                self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+                self._conn.commit()
+            self.misses += 1
+            return None
+
+    def put(self, question, fingerprint, sql):
+        """Store the final SQL for a question and evict least recently used entries over the limit"""
+        key = self.make_key(question, fingerprint)
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._conn.execute(
+                """INSERT OR REPLACE INTO translations (key, question, fingerprint, sql, created_at, last_used, hits)
+                   VALUES (?, ?, ?, ?, ?, ?, 0)""",
+                (key, normalize_question(question), fingerprint, sql, now, now)
+            )
+            self._conn.execute(
+                """DELETE FROM translations WHERE key IN (
+                       SELECT key FROM translations ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def get_template(self, question, fingerprint):
+        """Return (template, params) for a cached template of the same shape as the question, or None"""
+        literals, shape = extract_question_literals(question)
+        if not literals:
+            return None
+        key = self.make_key(shape, fingerprint)
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            row = self._conn.execute(
+                "SELECT template, param_map, created_at FROM sql_templates WHERE key = ?", (key,)
+            ).fetchone()
+            params = bind_parameters(question, json.loads(row[1])) if row and now - row[2] <= self.ttl_seconds else None
+            if params is None:
+                self.template_misses += 1
+                return None
+            self._conn.execute("UPDATE sql_templates SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.template_hits += 1
+            return row[0], params
+
+    def put_template(self, question, fingerprint, template, param_map):
+        """Store a parameterized template under the question's shape"""
+        _, shape = extract_question_literals(question)
+        key = self.make_key(shape, fingerprint)
+        now = time.time()
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._conn.execute(
+                """INSERT OR REPLACE INTO sql_templates (key, shape, fingerprint, template, param_map, created_at, last_used, hits)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, 0)""",
+                (key, shape, fingerprint, template, json.dumps(param_map), now, now)
+            )
+            self._conn.execute(
+                """DELETE FROM sql_templates WHERE key IN (
+                       SELECT key FROM sql_templates ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def clear(self):
+        """Remove all cached translations and templates"""
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+            self._conn.execute("DELETE FROM sql_templates")
+            self._conn.commit()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            templates = self._conn.execute("SELECT COUNT(*) FROM sql_templates").fetchone()[0]
+        lookups = self.hits + self.misses
+        template_lookups = self.template_hits + self.template_misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0,
+            'template_hits': self.template_hits,
+            'template_misses': self.template_misses,
+            'template_hit_rate': self.template_hits / template_lookups if template_lookups else 0,
+            'size': size,
+            'templates': templates,
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds
+        }
+
+
+class SemanticCache:
+    """
+    Reuses SQL for paraphrased questions: each answered question is stored with its embedding,
+    and a new question whose cosine similarity to a stored one reaches the threshold (and whose
+    literals match) gets that question's SQL. Entries live in SQLite next to the translation
+    cache and are held in memory as one normalized matrix for the current schema fingerprint.
+    """
+    HISTOGRAM_BUCKETS = 20
+
+    def __init__(self, path, threshold=0.92, max_entries=1000):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.lookups = 0
+        self.hits = 0
+        self.rejected_literals = 0
+        self.histogram = [0] * self.HISTOGRAM_BUCKETS
+        self.recent = deque(maxlen=200)
+        self.fingerprint = None
+        self._keys = []
+        self._questions = []
+        self._sqls = []
+        self._vectors = None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS semantic_questions (
+                key TEXT PRIMARY KEY,
+                question TEXT,
+                fingerprint TEXT,
+                sql TEXT,
+                embedding BLOB,
+                created_at REAL
+            )
+        """)
+        self._conn.commit()
+
+    def _load(self, fingerprint):
+        """Load entries for the fingerprint into memory, dropping entries built against another schema"""
+        import numpy as np
+        if fingerprint == self.fingerprint:
+            return
+        self._conn.execute("DELETE FROM semantic_questions WHERE fingerprint != ?", (fingerprint,))
+        self._conn.commit()
+        rows = self._conn.execute(
+            "SELECT key, question, sql, embedding FROM semantic_questions ORDER BY created_at"
+        ).fetchall()
+        self._keys = [row[0] for row in rows]
+        self._questions = [row[1] for row in rows]
+        self._sqls = [row[2] for row in rows]
+        self._vectors = np.vstack([np.frombuffer(row[3], dtype=np.float32) for row in rows]) if rows else None
+        self.fingerprint = fingerprint
+
+    def _record(self, question, similarity, matched_question, hit):
+        """Update hit counters and the best-similarity distribution"""
+        self.lookups += 1
+        if hit:
+            self.hits += 1
+        if similarity is not None:
+            bucket = min(int(max(similarity, 0.0) * self.HISTOGRAM_BUCKETS), self.HISTOGRAM_BUCKETS - 1)
+            self.histogram[bucket] += 1
+        self.recent.append({'question': question, 'matched_question': matched_question,
+                            'similarity': similarity, 'hit': hit})
+
+    def lookup(self, question, vector, fingerprint):
+        """Return SQL of the most similar stored question if it clears the threshold, else None"""
+        from vector_index import normalize_rows
+        with self._lock:
+            self._load(fingerprint)
+            if self._vectors is None:
+                self._record(question, None, None, False)
+                return None
+            scores = self._vectors @ normalize_rows(vector)[0]
+            best = int(scores.argmax())
+            similarity = float(scores[best])
+            hit = similarity >= self.threshold
+            if hit and extract_literals(question) != extract_literals(self._questions[best]):
+                # Paraphrase with different values, e.g. "> 2000" vs "> 5000"
+                self.rejected_literals += 1
+                hit = False
+            self._record(question, similarity, self._questions[best], hit)
+            return self._sqls[best] if hit else None
+
+    def add(self, question, vector, fingerprint, sql):
+        """Store an answered question with its embedding, evicting the oldest entries over the limit"""
+        import numpy as np
+        from vector_index import normalize_rows
+        vector = normalize_rows(vector)[0]
+        key = hashlib.sha256(f"{fingerprint}\n{normalize_question(question)}".encode('utf-8')).hexdigest()
+        with self._lock:
+            self._load(fingerprint)
+            self._conn.execute(
+                """INSERT OR REPLACE INTO semantic_questions (key, question, fingerprint, sql, embedding, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (key, question, fingerprint, sql, vector.tobytes(), time.time())
+            )
+            if key in self._keys:
+                index = self._keys.index(key)
+                self._sqls[index] = sql
+                self._vectors[index] = vector
+            else:
+                self._keys.append(key)
+                self._questions.append(question)
+                self._sqls.append(sql)
+                self._vectors = vector.reshape(1, -1) if self._vectors is None else np.vstack([self._vectors, vector])
+            excess = len(self._keys) - self.max_entries
+            if excess > 0:
+                self._conn.executemany("DELETE FROM semantic_questions WHERE key = ?",
+                                       [(k,) for k in self._keys[:excess]])
+                self._keys = self._keys[excess:]
+                self._questions = self._questions[excess:]
+                self._sqls = self._sqls[excess:]
+                self._vectors = self._vectors[excess:]
+            self._conn.commit()
+
+    def stats(self):
+        """Hit rate, threshold and the distribution of best similarities seen on lookups"""
+        with self._lock:
+            bucket_width = 1.0 / self.HISTOGRAM_BUCKETS
+            return {
+                'lookups': self.lookups,
+                'hits': self.hits,
+                'hit_rate': self.hits / self.lookups if self.lookups else 0,
+                'rejected_literal_mismatch': self.rejected_literals,
+                'threshold': self.threshold,
+                'size': len(self._keys),
+                'similarity_histogram': {f"{i * bucket_width:.2f}-{(i + 1) * bucket_width:.2f}": count
+                                         for i, count in enumerate(self.histogram) if count},
+                'recent': list(self.recent)[-20:]
+            }
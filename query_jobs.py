@@ -0,0 +1,276 @@
+import os
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from db_pool import read_connection
+from sql_guard import SQLGuardError, validate_query, estimate_scan_rows
+from result_pages import result_store
+from excel_nl_query import (translate_query, execute_translation, remember_translation, get_embeddings,
+                            retrieve_batch, ensure_vector_store_fresh)
+
+load_dotenv()
+
+# Workers answering from the caches and the planner, and workers for questions that need the LLM
+JOB_FAST_WORKERS = int(os.getenv("JOB_FAST_WORKERS", "2"))
+JOB_SLOW_WORKERS = int(os.getenv("JOB_SLOW_WORKERS", "4"))
+# Jobs waiting or running at once; submissions beyond this are refused
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", "100"))
+# Locally translated queries whose plan visits more rows than this run with the slow jobs
+JOB_FAST_MAX_SCAN_ROWS = int(os.getenv("JOB_FAST_MAX_SCAN_ROWS", "1000000"))
+# Finished jobs are kept this many seconds for polling
+JOB_TTL = int(os.getenv("JOB_TTL", "900"))
+
+# Stages in order: queued, retrieving (slow lane only), translating, executing, serializing
+FINISHED_STATUSES = ('done', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job was cancelled between two stages"""
+
+
+class JobQueueFull(Exception):
+    """Raised by submit() when JOB_MAX_PENDING jobs are already waiting or running"""
+    def __init__(self, limit):
+        super().__init__(f"{limit} jobs are already pending; try again later")
+        self.limit = limit
+
+
+class QueryJob:
+    """A question answered in the background, with its stage history and, once finished, its payload"""
+    def __init__(self, nl_query, db_path, vector_store, use_ollama, serialize, page_size=None):
+        self.job_id = uuid.uuid4().hex
+        self.nl_query = nl_query
+        self.db_path = db_path
+        self.vector_store = vector_store
+        self.use_ollama = use_ollama
+        self.serialize = serialize
+        self.page_size = page_size
+        self.lane = 'fast'
+        self.status = 'queued'
+        self.stage = 'queued'
+        self.translation = None
+        # Set once the caches and the planner had no answer, so the slow lane does not ask them again
+        self.local_missed = False
+        self.result = None
+        self.submitted = time.time()
+        self.finished = None
+        self.events = [{'type': 'stage', 'stage': 'queued', 'status': 'queued', 'lane': 'fast', 'at': self.submitted}]
+        self.cancelled = False
+        self.connection = None
+        self._changed = threading.Condition()
+
+    def _event(self, event_type, **values):
+        self.events.append(dict(values, type=event_type, stage=self.stage, status=self.status, lane=self.lane,
+                                at=time.time()))
+        self._changed.notify_all()
+
+    def advance(self, stage):
+        """Enter the next stage; a cancelled job stops here"""
+        with self._changed:
+            if self.cancelled:
+                raise JobCancelled()
+            self.status = 'running'
+            self.stage = stage
+            self._event('stage')
+
+    def requeue(self, lane, reason):
+        """Wait again, for a worker of another lane"""
+        with self._changed:
+            if self.cancelled:
+                raise JobCancelled()
+            self.lane = lane
+            self.status = 'queued'
+            self.stage = 'queued'
+            self._event('stage', reason=reason)
+
+    def attach(self, connection):
+        """Set (or clear, with None) the connection a running query uses, so cancel() can interrupt it"""
+        with self._changed:
+            self.connection = connection
+
+    def finish(self, status, result=None):
+        with self._changed:
+            if self.status in FINISHED_STATUSES:
+                return
+            self.status = status
+            self.result = result
+            self.finished = time.time()
+            self.connection = None
+            self._event('status')
+
+    def cancel(self):
+        """
+        Stop the job: queued jobs never start, a running query is interrupted and any other stage
+        ends at the next stage boundary. Returns False for jobs that already finished.
+        """
+        with self._changed:
+            if self.status in FINISHED_STATUSES:
+                return False
+            self.cancelled = True
+            if self.connection is not None:
+                self.connection.interrupt()
+            if self.status == 'queued':
+                self.finish('cancelled')
+            return True
+
+    def wait_for_events(self, seen, timeout):
+        """Events after the first seen, waiting up to timeout seconds for one to arrive"""
+        with self._changed:
+            if len(self.events) <= seen and self.status not in FINISHED_STATUSES:
+                self._changed.wait(timeout)
+            return self.events[seen:]
+
+    def snapshot(self, with_result=True):
+        """Job state for polling; the payload is included once the job finished"""
+        state = {
+            'jobId': self.job_id,
+            'query': self.nl_query,
+            'status': self.status,
+            'stage': self.stage,
+            'lane': self.lane,
+            'stages': [{'stage': event['stage'], 'at': event['at']} for event in self.events if event['type'] == 'stage'],
+            'elapsedSeconds': round((self.finished or time.time()) - self.submitted, 3),
+        }
+        if with_result and self.status in FINISHED_STATUSES:
+            state['result'] = self.result
+        return state
+
+
+class JobQueue:
+    """
+    Bounded worker pools for query jobs. Every job starts on the fast lane, which only uses the
+    caches and the local planner; questions that need retrieval and the LLM, or whose SQL would
+    scan many rows, move to the slow lane so they cannot hold up the quick ones.
+    """
+    def __init__(self, fast_workers=JOB_FAST_WORKERS, slow_workers=JOB_SLOW_WORKERS, max_pending=JOB_MAX_PENDING,
+                 ttl_seconds=JOB_TTL):
+        self.workers = {'fast': fast_workers, 'slow': slow_workers}
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._queues = {'fast': queue.Queue(), 'slow': queue.Queue()}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start_workers(self):
+        # Worker threads start with the first submitted job
+        if self._threads:
+            return
+        for lane, count in self.workers.items():
+            for number in range(count):
+                thread = threading.Thread(target=self._work, args=(lane,), name=f"query-job-{lane}-{number}",
+                                          daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, nl_query, db_path, vector_store, use_ollama, serialize, page_size=None):
+        """
+        Queue a question and return its job at once. serialize(result, sql_query, page) shapes the
+        payload, where page is (result_set, has_more, next_cursor) for paged jobs and None otherwise.
+        Raises JobQueueFull when too many jobs are pending.
+        """
+        job = QueryJob(nl_query, db_path, vector_store, use_ollama, serialize, page_size)
+        with self._lock:
+            self._expire()
+            if sum(1 for queued in self._jobs.values() if queued.status not in FINISHED_STATUSES) >= self.max_pending:
+                raise JobQueueFull(self.max_pending)
+            self._jobs[job.job_id] = job
+            self._start_workers()
+        self._queues['fast'].put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        """Jobs per status and lane, for monitoring"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        stats = {'workers': dict(self.workers), 'maxPending': self.max_pending}
+        for job in jobs:
+            key = f"{job.lane}_{job.status}" if job.status not in FINISHED_STATUSES else job.status
+            stats[key] = stats.get(key, 0) + 1
+        return stats
+
+    def _work(self, lane):
+        while True:
+            job = self._queues[lane].get()
+            if job.cancelled:
+                job.finish('cancelled')
+                continue
+            try:
+                if self._run(job, lane):
+                    continue
+            except JobCancelled:
+                job.finish('cancelled')
+            except Exception as e:
+                if job.cancelled:
+                    job.finish('cancelled')
+                else:
+                    error = e if isinstance(e, SQLGuardError) else f"Error: {str(e)}"
+                    job.finish('failed', job.serialize(error, "", None))
+
+    def _move_to_slow_lane(self, job, reason):
+        print(f"Job {job.job_id} moved to the slow lane: {reason}")
+        job.requeue('slow', reason)
+        self._queues['slow'].put(job)
+        return True
+
+    def _run(self, job, lane):
+        """Run the job's remaining stages; returns True when it was handed to the slow lane instead"""
+        if lane == 'fast':
+            job.advance('translating')
+            job.translation = translate_query(job.nl_query, job.db_path, job.vector_store, job.use_ollama,
+                                              local_only=True)
+            if job.translation is None:
+                job.local_missed = True
+                return self._move_to_slow_lane(job, 'needs the language model')
+            with read_connection(job.db_path) as conn:
+                plan = validate_query(conn, job.translation['sql'], job.translation['params'], job.db_path)
+                estimated = estimate_scan_rows(conn, job.translation['sql'], plan, job.db_path)
+            if estimated > JOB_FAST_MAX_SCAN_ROWS:
+                return self._move_to_slow_lane(job, f"scans about {estimated:,} rows")
+
+        if job.translation is None:
+            job.advance('retrieving')
+            ensure_vector_store_fresh(job.vector_store, job.db_path)
+            query_vector = get_embeddings().embed_query(job.nl_query)
+            retrieved = retrieve_batch([query_vector], job.db_path, job.vector_store)[0]
+            job.advance('translating')
+            job.translation = translate_query(job.nl_query, job.db_path, job.vector_store, job.use_ollama,
+                                              query_vector, retrieved, skip_local=job.local_missed)
+
+        job.advance('executing')
+        page = None
+        with read_connection(job.db_path) as conn:
+            job.attach(conn)
+            try:
+                if job.page_size:
+                    result_set = result_store.create(job.translation['sql'], job.translation['params'], job.db_path)
+                    result, has_more, next_cursor = result_set.page(0, job.page_size, conn=conn)
+                    sql_query = remember_translation(job.nl_query, job.translation)
+                    page = (result_set, has_more, next_cursor)
+                else:
+                    result, sql_query = execute_translation(conn, job.nl_query, job.translation, job.db_path)
+            finally:
+                job.attach(None)
+
+        job.advance('serializing')
+        payload = job.serialize(result, sql_query, page)
+        if job.cancelled:
+            raise JobCancelled()
+        job.finish('done', payload)
+        return False
+
+
+job_queue = JobQueue()
@@ -0,0 +1,130 @@
+import io
+import json
+import math
+import datetime
+from contextlib import ExitStack
+import numpy as np
+import pandas as pd
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    print("orjson not installed, falling back to the standard json encoder")
+
+# Result layouts a client can ask for with ?format= or the "format" field of the request body
+RESPONSE_FORMATS = ('records', 'columnar', 'ndjson', 'arrow')
+FORMAT_MIME_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/vnd.apache.arrow.stream': 'arrow',
+}
+ARROW_MIME_TYPE = 'application/vnd.apache.arrow.stream'
+
+
+def _default(value):
+    """Encode values the JSON encoder does not know natively"""
+    if value is pd.NaT:
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime, pd.Timestamp)):
+        return value.isoformat()
+    if isinstance(value, np.ndarray):
+        return [_clean(item) for item in value.tolist()]
+    if isinstance(value, np.generic):
+        return _clean(value.item())
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return str(value)
+
+
+def _clean(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _clean(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean(item) for item in value]
+    return value
+
+
+def dumps(payload):
+    """Serialize to JSON bytes; dates become ISO strings, NaN and infinity become null"""
+    if orjson is not None:
+        return orjson.dumps(payload, default=_default,
+                            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(_clean(payload), default=_default).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    """Flask response with the payload serialized by the fast encoder"""
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+def column_arrays(result):
+    """Column name to list of values, keeping numeric columns as numpy arrays for the encoder"""
+    columns = {}
+    for position, name in enumerate(result.columns):
+        series = result.iloc[:, position]
+        if series.dtype.kind in 'biuf':
+            columns[str(name)] = series.to_numpy()
+        elif series.dtype.kind == 'M':
+            columns[str(name)] = [value.isoformat() if not pd.isna(value) else None for value in series]
+        else:
+            columns[str(name)] = [None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+                                  for value in series.tolist()]
+    return columns
+
+
+def result_data(result, response_format):
+    """Rows of a result as a list of records, or as column arrays for the columnar format"""
+    if response_format == 'columnar':
+        return column_arrays(result)
+    return result.to_dict(orient='records')
+
+
+def arrow_response(result, sql_query):
+    """Result as an Arrow IPC stream, with the SQL and truncation flag in the schema metadata"""
+    import pyarrow as pa
+    table = pa.Table.from_pandas(result, preserve_index=False)
+    table = table.replace_schema_metadata(dict(table.schema.metadata or {}, sql=sql_query or '',
+                                               truncated=str(bool(result.attrs.get('truncated'))).lower()))
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(sink.getvalue(), mimetype=ARROW_MIME_TYPE)
+
+
+def ndjson_response(connection, stream, sql_query, on_complete=None):
+    """
+    Stream a query as newline-delimited JSON: a header line with the columns and SQL, one JSON array
+    per row, then a footer line with the row count. connection is a context manager that yields
+    the connection and stays open until the stream ends; stream(conn) starts the query and returns
+    (columns, chunks, status). Errors before the first row propagate to the caller, later ones are
+    reported in the footer. on_complete runs after every row was sent.
+    """
+    stack = ExitStack()
+    try:
+        conn = stack.enter_context(connection)
+        columns, chunks, status = stream(conn)
+        # The cursor is closed before the connection goes back to the pool, even if the client disconnects
+        stack.callback(chunks.close)
+    except BaseException:
+        stack.close()
+        raise
+
+    def generate():
+        with stack:
+            yield dumps({'columns': columns, 'sql': sql_query}) + b'\n'
+            try:
+                for rows in chunks:
+                    yield b''.join(dumps(row) + b'\n' for row in rows)
+            except Exception as e:
+                footer = {'success': False, 'error': getattr(e, 'message', str(e)),
+                          'errorCode': getattr(e, 'code', None), 'rowCount': status['rowCount']}
+                yield dumps(footer) + b'\n'
+                return
+            if on_complete:
+                on_complete()
+            yield dumps(dict(status, success=True)) + b'\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
@@ -0,0 +1,173 @@
+import os
+import re
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+from db_pool import read_connection, database_version
+from sql_guard import run_guarded_query, table_row_count, _unquote
+
+load_dotenv()
+
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "200"))
+RESULT_MAX_PAGE_SIZE = int(os.getenv("RESULT_MAX_PAGE_SIZE", "2000"))
+# Idle result handles expire after this many seconds; the oldest are dropped beyond the limit
+RESULT_HANDLE_TTL = int(os.getenv("RESULT_HANDLE_TTL", "900"))
+RESULT_MAX_HANDLES = int(os.getenv("RESULT_MAX_HANDLES", "256"))
+
+ROW_KEY_COLUMN = "__row_key"
+
+# Plain browse of one table, the only shape whose pages can continue from the last rowid
+TABLE_BROWSE_PATTERN = re.compile(
+    r'^\s*SELECT\s+\*\s+FROM\s+("(?:[^"]|"")+"|\[[^\]]+\]|\w+)(?:\s+WHERE\s+(.+?))?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL)
+UNSAFE_BROWSE_PATTERN = re.compile(r'\b(?:ORDER|GROUP|LIMIT|UNION|EXCEPT|INTERSECT|JOIN|HAVING|WINDOW)\b|,', re.IGNORECASE)
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'")
+
+
+def keyset_source(sql):
+    """Return (table, where clause) when the query browses a single table in rowid order, else None"""
+    match = TABLE_BROWSE_PATTERN.match(sql)
+    if not match:
+        return None
+    table, where = match.groups()
+    if where and UNSAFE_BROWSE_PATTERN.search(LITERAL_PATTERN.sub("''", where)):
+        return None
+    return table, where
+
+
+class ResultSet:
+    """A query result identified by a handle and read page by page, counted only when asked"""
+    def __init__(self, sql, params, db_path):
+        self.handle = uuid.uuid4().hex
+        self.sql = sql.strip().rstrip(';')
+        self.params = params
+        self.db_path = db_path
+        self.version = database_version(db_path)
+        self.keyset = keyset_source(self.sql)
+        self.total = None
+        # Absolute position after each page that returned a cursor, so the total is known when the last
+        # page is reached by cursor alone
+        self.cursor_positions = {}
+        self.last_used = time.time()
+
+    def _page_parameters(self, **values):
+        # Page values are bound after the query's own parameters, by name when the query uses names
+        if isinstance(self.params, dict):
+            return {name: f":{name}" for name in values}, dict(self.params, **values)
+        return {name: "?" for name in values}, list(self.params or []) + list(values.values())
+
+    def page(self, offset=0, limit=RESULT_PAGE_SIZE, after=None, conn=None):
+        """
+        Fetch up to limit rows, by offset or, for table browses, continuing after a row key
+        (the position then comes from the page that returned the cursor, not from offset). Returns (DataFrame, has_more, next_cursor);
+        next_cursor is passed back as after. conn is a read connection to use instead of a pooled one.
+        """
+        limit = max(1, min(int(limit), RESULT_MAX_PAGE_SIZE))
+        if self.keyset:
+            table, where = self.keyset
+            conditions = [f"({where})"] if where else []
+            if after is not None:
+                placeholders, params = self._page_parameters(__after=int(after), __limit=limit + 1)
+                conditions.append(f"rowid > {placeholders['__after']}")
+                paging = f"LIMIT {placeholders['__limit']}"
+            else:
+                placeholders, params = self._page_parameters(__limit=limit + 1, __offset=int(offset))
+                paging = f"LIMIT {placeholders['__limit']} OFFSET {placeholders['__offset']}"
+            sql = (f'SELECT rowid AS "{ROW_KEY_COLUMN}", * FROM {table}' +
+                   (f" WHERE {' AND '.join(conditions)}" if conditions else "") + f" ORDER BY rowid {paging}")
+        else:
+            placeholders, params = self._page_parameters(__limit=limit + 1, __offset=int(offset))
+            sql = f"SELECT * FROM ({self.sql}) LIMIT {placeholders['__limit']} OFFSET {placeholders['__offset']}"
+
+        # The extra row fetched past the limit only signals that another page exists
+        if conn is not None:
+            result = run_guarded_query(conn, sql, params, self.db_path, max_rows=limit, report_truncation=False)
+        else:
+            with read_connection(self.db_path) as conn:
+                result = run_guarded_query(conn, sql, params, self.db_path, max_rows=limit, report_truncation=False)
+        self.last_used = time.time()
+        has_more = bool(result.attrs.get('truncated'))
+
+        next_cursor = None
+        if ROW_KEY_COLUMN in result.columns:
+            if len(result):
+                next_cursor = int(result[ROW_KEY_COLUMN].iloc[-1])
+            result = result.drop(columns=[ROW_KEY_COLUMN])
+        # The last page tells the total without a count, but only when its absolute position is known
+        if self.keyset and after is not None:
+            start = self.cursor_positions.get(int(after))
+        else:
+            start = int(offset)
+        if start is not None:
+            if next_cursor is not None:
+                self.cursor_positions[next_cursor] = start + len(result)
+            if not has_more:
+                self.total = start + len(result)
+        result.attrs['truncated'] = False
+        return result, has_more, next_cursor
+
+    def count(self):
+        """Total row count, computed on first request and kept for the life of the handle"""
+        if self.total is None:
+            with read_connection(self.db_path) as conn:
+                if self.keyset and not self.keyset[1]:
+                    # An unfiltered table browse has the row count recorded in the catalogue
+                    self.total = table_row_count(conn, _unquote(self.keyset[0]), self.db_path)
+                else:
+                    result = run_guarded_query(conn, f"SELECT COUNT(*) FROM ({self.sql})", self.params, self.db_path)
+                    self.total = int(result.iloc[0, 0])
+        self.last_used = time.time()
+        return self.total
+
+    def is_stale(self):
+        """True once the database was re-ingested after the handle was created"""
+        try:
+            return database_version(self.db_path) != self.version
+        except OSError:
+            return True
+
+
+class ResultStore:
+    """Open result handles, dropped when idle for RESULT_HANDLE_TTL or when the store is full"""
+    def __init__(self, max_handles=RESULT_MAX_HANDLES, ttl_seconds=RESULT_HANDLE_TTL):
+        self.max_handles = max_handles
+        self.ttl_seconds = ttl_seconds
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl_seconds
+        for handle in [h for h, result in self._results.items() if result.last_used < cutoff]:
+            del self._results[handle]
+        while len(self._results) > self.max_handles:
+            self._results.popitem(last=False)
+
+    def create(self, sql, params, db_path):
+        """Register a query and return its result set"""
+        result_set = ResultSet(sql, params, db_path)
+        with self._lock:
+            self._results[result_set.handle] = result_set
+            self._expire()
+        return result_set
+
+    def get(self, handle):
+        """Return the live result set for a handle, or None if it expired or the data changed"""
+        with self._lock:
+            self._expire()
+            result_set = self._results.get(handle)
+            if result_set is not None and result_set.is_stale():
+                del self._results[handle]
+                return None
+            if result_set is not None:
+                self._results.move_to_end(handle)
+            return result_set
+
+    def discard(self, handle):
+        """Forget a handle; returns whether it existed"""
+        with self._lock:
+            return self._results.pop(handle, None) is not None
+
+
+result_store = ResultStore()
@@ -0,0 +1,301 @@
+import os
+import re
+import json
+import hashlib
+import sqlite3
+import threading
+from dotenv import load_dotenv
+from catalog import read_schema_document, is_categorical
+from db_pool import read_connection, database_version
+from rule_planner import tokenize, date_bucket_expression, quote_identifier, NON_MEASURE_TOKENS
+
+load_dotenv()
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS", "True").lower() == "true"
+# Category columns per table that get a month x category rollup
+ROLLUP_MAX_CATEGORIES = int(os.getenv("ROLLUP_MAX_CATEGORIES", "6"))
+# Date columns per table that get rollups, those spanning the most months first
+ROLLUP_MAX_DATE_COLUMNS = int(os.getenv("ROLLUP_MAX_DATE_COLUMNS", "1"))
+ROLLUP_PREFIX = "rollup_"
+
+# Aggregates over one source table, the shape the rule planner produces and the LLM often does
+AGGREGATE_QUERY_PATTERN = re.compile(
+    r'^SELECT\s+(?:(?P<group>.+?)(?:\s+AS\s+(?P<group_alias>\w+))?\s*,\s*)?'
+    r'(?P<func>SUM|AVG|COUNT|MIN|MAX)\s*\(\s*(?P<arg>\*|"(?:[^"]|"")+")\s*\)\s+AS\s+(?P<alias>\w+)\s+'
+    r'FROM\s+(?P<table>\w+)(?:\s+WHERE\s+(?P<where>.+?))?(?:\s+GROUP\s+BY\s+(?P<group_by>.+?))?'
+    r'(?:\s+ORDER\s+BY\s+(?P<order>.+?))?(?:\s+LIMIT\s+(?P<limit>\d+|\?))?\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL)
+# Equality filters a rollup can answer: "column" = 'literal' or a bound parameter
+EQUALITY_PATTERN = re.compile(r'"((?:[^"]|"")+)"\s*=\s*(\'(?:[^\']|\'\')*\'|\?)')
+ORDER_TERM_PATTERN = re.compile(r'^(?P<term>.+?)(?:\s+(?:ASC|DESC))?$', re.IGNORECASE | re.DOTALL)
+
+
+def _normalize(expression):
+    return " ".join(expression.split())
+
+
+def is_measure(column):
+    """Numeric, non-date columns whose names do not mark them as identifiers or codes"""
+    stats = column['stats']
+    return (stats.get('histogram') is not None and not stats.get('is_date')
+            and not set(tokenize(column['name'])) & NON_MEASURE_TOKENS)
+
+
+def month_count(stats):
+    """Distinct months of a date column, from its catalogue histogram"""
+    return len((stats.get('histogram') or {}).get('buckets') or [])
+
+
+def rollup_specs(document):
+    """
+    Rollups to build per source table: for its primary date columns, month totals and month x category
+    totals for each categorical column, over all measure columns. Date columns within a single month
+    get none, since their monthly totals are the table totals.
+    """
+    specs = []
+    for table_name, table in document.items():
+        columns = table['columns']
+        measures = [col['name'] for col in columns if is_measure(col)]
+        dates = [col for col in columns if col['stats'].get('is_date') and month_count(col['stats']) > 1]
+        # sorted() keeps column order among dates spanning as many months
+        dates = sorted(dates, key=lambda col: -month_count(col['stats']))[:ROLLUP_MAX_DATE_COLUMNS]
+        categories = [col['name'] for col in columns if is_categorical(col['stats'])][:ROLLUP_MAX_CATEGORIES]
+        if not measures or not dates:
+            continue
+        for date in dates:
+            bucket = {'name': date['name'], 'samples': [],
+                      'range': [date['stats']['min_value'], date['stats']['max_value']]}
+            for category in [None] + categories:
+                specs.append({'source_table': table_name, 'date_column': date['name'],
+                              'month_expression': date_bucket_expression(bucket, 'month'),
+                              'category_column': category, 'measures': measures})
+    return specs
+
+
+def table_signature(table):
+    """Fingerprint of a source table's catalogue entry; unchanged data keeps its rollups"""
+    return hashlib.sha256(json.dumps(table, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def create_rollup(cursor, rollup_name, spec):
+    """Materialize one rollup: row count and per-measure sum, count, min and max per month (and category)"""
+    group = ["month"] + ([quote_identifier(spec['category_column'])] if spec['category_column'] else [])
+    aggregates = ["COUNT(*) AS row_count"]
+    for measure in spec['measures']:
+        column = quote_identifier(measure)
+        aggregates += [f"SUM({column}) AS {quote_identifier(measure + '__sum')}",
+                       f"COUNT({column}) AS {quote_identifier(measure + '__count')}",
+                       f"MIN({column}) AS {quote_identifier(measure + '__min')}",
+                       f"MAX({column}) AS {quote_identifier(measure + '__max')}"]
+    cursor.execute(f'DROP TABLE IF EXISTS "{rollup_name}"')
+    cursor.execute(f"""
+        CREATE TABLE "{rollup_name}" AS
+        SELECT {spec['month_expression']} AS month{''.join(', ' + column for column in group[1:])},
+               {', '.join(aggregates)}
+        FROM "{spec['source_table']}"
+        GROUP BY {', '.join(group)}
+    """)
+
+
+def refresh_rollups(conn):
+    """
+    Build or refresh the rollup tables after ingestion. Rollups of a source table are rebuilt only
+    when its catalogue entry changed since they were built. Run after build_catalog().
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS rollups (
+        rollup_name TEXT PRIMARY KEY,
+        source_table TEXT,
+        date_column TEXT,
+        month_expression TEXT,
+        category_column TEXT,
+        measures TEXT,
+        source_signature TEXT
+    )
+    """)
+    document = read_schema_document(conn)
+    specs = rollup_specs(document)
+    built = {row[0]: row[1:] for row in cursor.execute("SELECT rollup_name, source_table, source_signature FROM rollups")}
+
+    wanted = {}
+    for spec in specs:
+        key = json.dumps([spec['source_table'], spec['date_column'], spec['category_column'], spec['measures']])
+        rollup_name = ROLLUP_PREFIX + hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+        wanted[rollup_name] = spec
+
+    # Rollups of tables or columns that no longer exist go first
+    for rollup_name in set(built) - set(wanted):
+        cursor.execute(f'DROP TABLE IF EXISTS "{rollup_name}"')
+        cursor.execute("DELETE FROM rollups WHERE rollup_name = ?", (rollup_name,))
+
+    rebuilt = []
+    for rollup_name, spec in wanted.items():
+        signature = table_signature(document[spec['source_table']])
+        if built.get(rollup_name) == (spec['source_table'], signature):
+            continue
+        create_rollup(cursor, rollup_name, spec)
+        cursor.execute("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (rollup_name, spec['source_table'], spec['date_column'], spec['month_expression'],
+                        spec['category_column'], json.dumps(spec['measures']), signature))
+        rebuilt.append(rollup_name)
+    conn.commit()
+    # build_catalog() ran ANALYZE before these tables existed; give rebuilt rollups planner statistics too
+    for rollup_name in rebuilt:
+        cursor.execute(f'ANALYZE "{rollup_name}"')
+    conn.commit()
+    print(f"Rollups: {len(rebuilt)} built, {len(wanted) - len(rebuilt)} unchanged")
+    return len(rebuilt)
+
+
+def load_rollups(conn):
+    """Rollup definitions by source table; empty for databases without rollups"""
+    try:
+        rows = conn.execute("""SELECT rollup_name, source_table, date_column, month_expression, category_column, measures
+                               FROM rollups ORDER BY rollup_name""").fetchall()
+    except sqlite3.OperationalError:
+        return {}
+    rollups = {}
+    for rollup_name, source_table, date_column, month_expression, category_column, measures in rows:
+        rollups.setdefault(source_table, []).append({
+            'name': rollup_name, 'date_column': date_column, 'month_expression': _normalize(month_expression),
+            'category_column': category_column, 'measures': set(json.loads(measures))})
+    return rollups
+
+
+_rollup_registry = {}
+_rollup_registry_lock = threading.Lock()
+
+def get_rollups(db_path):
+    """Rollup definitions of a database, reloaded after each ingest"""
+    version = database_version(db_path)
+    key = os.path.abspath(db_path)
+    with _rollup_registry_lock:
+        cached = _rollup_registry.get(key)
+        if cached is None or cached[0] != version:
+            with read_connection(db_path) as conn:
+                cached = _rollup_registry[key] = (version, load_rollups(conn))
+    return cached[1]
+
+
+def _unquote(identifier):
+    identifier = identifier.strip()
+    if identifier.startswith('"') and identifier.endswith('"'):
+        return identifier[1:-1].replace('""', '"')
+    return None
+
+
+def _equality_filters(where):
+    """Columns of a WHERE clause made only of ANDed equality filters, in order, or None"""
+    columns = []
+    position = 0
+    while True:
+        match = EQUALITY_PATTERN.match(where, position)
+        if not match:
+            return None
+        columns.append(match.group(1).replace('""', '"'))
+        position = match.end()
+        rest = re.match(r'\s+AND\s+', where[position:], re.IGNORECASE)
+        if rest:
+            position += rest.end()
+        elif where[position:].strip():
+            return None
+        else:
+            return columns
+
+
+def rollup_aggregate(func, column, grouped):
+    """The aggregate over rollup columns equal to func(column) over the source rows"""
+    if column is None:
+        # COUNT(*) of no rows is 0, while the SUM of no rollup rows is NULL
+        return "SUM(row_count)" if grouped else "COALESCE(SUM(row_count), 0)"
+    def part(suffix):
+        return quote_identifier(column + suffix)
+    if func == 'SUM':
+        return f"SUM({part('__sum')})"
+    if func == 'COUNT':
+        return f"SUM({part('__count')})" if grouped else f"COALESCE(SUM({part('__count')}), 0)"
+    if func == 'AVG':
+        return f"SUM({part('__sum')}) * 1.0 / SUM({part('__count')})"
+    return f"{func}({part('__' + func.lower())})"
+
+
+def route_to_rollup(sql, db_path):
+    """
+    Rewrite a monthly, per-category or whole-table aggregate over a source table to read the
+    matching rollup instead. Returns the SQL unchanged when no rollup answers it exactly.
+    """
+    if not ROLLUPS_ENABLED:
+        return sql
+    match = AGGREGATE_QUERY_PATTERN.match(sql.strip())
+    if not match:
+        return sql
+    rollups = get_rollups(db_path).get(match.group('table'))
+    if not rollups:
+        return sql
+    func = match.group('func').upper()
+    column = _unquote(match.group('arg')) if match.group('arg') != '*' else None
+    if func != 'COUNT' and column is None:
+        return sql
+    filters = _equality_filters(match.group('where')) if match.group('where') else []
+    if filters is None or len(set(filters)) > 1:
+        return sql
+
+    group, group_alias, group_by = match.group('group'), match.group('group_alias'), match.group('group_by')
+    if bool(group) != bool(group_by):
+        return sql
+    month_group = None
+    category_group = None
+    if group:
+        if _normalize(group_by) not in (_normalize(group), group_alias):
+            return sql
+        category_group = _unquote(group) if group_alias is None else None
+        month_group = _normalize(group) if category_group is None else None
+        if month_group is not None and group_alias is None:
+            return sql
+
+    # ORDER BY may only name the aggregate or the group, which the rollup query keeps
+    if match.group('order'):
+        allowed = {match.group('alias'), group_alias, group and _normalize(group)}
+        for term in match.group('order').split(','):
+            if _normalize(ORDER_TERM_PATTERN.match(term.strip()).group('term')) not in allowed:
+                return sql
+
+    category = category_group or (filters[0] if filters else None)
+    if category_group and filters and filters[0] != category_group:
+        return sql
+    for rollup in rollups:
+        if rollup['category_column'] != category:
+            continue
+        if month_group is not None and rollup['month_expression'] != month_group:
+            continue
+        if column is not None and column not in rollup['measures']:
+            continue
+        break
+    else:
+        return sql
+
+    aggregate = rollup_aggregate(func, column, bool(group))
+    select = f"{aggregate} AS {match.group('alias')}"
+    routed = "SELECT "
+    if month_group is not None:
+        routed += f"month AS {group_alias}, "
+    elif category_group is not None:
+        routed += f"{quote_identifier(category_group)}, "
+    routed += f'{select} FROM "{rollup["name"]}"'
+    if match.group('where'):
+        routed += f" WHERE {match.group('where')}"
+    if month_group is not None:
+        routed += " GROUP BY month"
+    elif category_group is not None:
+        routed += f" GROUP BY {quote_identifier(category_group)}"
+    if match.group('order'):
+        order = match.group('order')
+        if category_group is not None:
+            order = order.replace(group, quote_identifier(category_group))
+        elif month_group is not None and group_alias != 'month':
+            order = order.replace(group, group_alias)
+        routed += f" ORDER BY {order}"
+    if match.group('limit'):
+        routed += f" LIMIT {match.group('limit')}"
+    return routed + ";"
@@ -0,0 +1,467 @@
+import re
+import json
+from collections import defaultdict
+from functools import lru_cache
+
+
+AGGREGATE_KEYWORDS = [
+    ("AVG", ["average", "avg", "mean"]),
+    ("SUM", ["sum", "total"]),
+    ("MAX", ["maximum", "max", "highest", "largest", "biggest"]),
+    ("MIN", ["minimum", "min", "lowest", "smallest"]),
+    ("COUNT", ["count", "how many", "number of"]),
+]
+AGGREGATE_ALIASES = {"AVG": "average", "SUM": "total", "MAX": "maximum", "MIN": "minimum", "COUNT": "count"}
+
+# Words that say nothing about which table or column is meant
+GENERIC_TOKENS = {"data", "lite", "main", "report", "form", "x", "sheet", "sheet1", "xlsx", "the", "of", "in"}
+# Column name parts that mark identifiers or dates rather than measures
+NON_MEASURE_TOKENS = {"date", "number", "code", "id", "sequence", "segment", "ind", "indicator"}
+MEASURE_TOKENS = {"amount", "balance", "value", "total"}
+STOPWORDS = {"a", "an", "and", "all", "are", "by", "for", "from", "in", "is", "me", "of", "on", "or", "per",
+             "show", "list", "the", "to", "what", "which", "with", "each", "every", "get", "give", "find"}
+
+TOP_PATTERN = re.compile(r"\b(top|largest|biggest|highest|first|bottom|smallest|lowest|last)\s+(\d+)\b(?:\s+([a-z_][a-z0-9_ ]*?))?(?=\s+(?:by|with|in|from|where|for)\b|$)")
+GROUP_PATTERN = re.compile(r"\b(?:group(?:ed)? by|by|per|for each|for every|across)\s+([a-z0-9 _-]+?)(?=\s+(?:where|with|for|in|from|and|order|ordered|sorted|top|limit|having|above|below|greater|less|over|under|between)\b|[?.,;]|$)")
+ORDER_PATTERN = re.compile(r"\b(?:sorted|ordered|order|sort)\s+by\s+([a-z0-9 _-]+?)(?:\s+(asc|ascending|desc|descending))?(?=\s+(?:where|with|for|in|from|limit)\b|[?.,;]|$)")
+COMPARISON_PATTERN = re.compile(
+    r"(greater than or equal to|less than or equal to|greater than|more than|higher than|above|over|exceeding|"
+    r"at least|less than|lower than|below|under|at most|equal to|equals|>=|<=|>|<|=)\s*\$?\s*(-?\d+(?:\.\d+)?)(\s*%)?"
+)
+BETWEEN_PATTERN = re.compile(r"\bbetween\s+\$?(-?\d+(?:\.\d+)?)(\s*%)?\s+and\s+\$?(-?\d+(?:\.\d+)?)(\s*%)?")
+COMPARISON_OPERATORS = {
+    "greater than or equal to": ">=", "at least": ">=", ">=": ">=",
+    "less than or equal to": "<=", "at most": "<=", "<=": "<=",
+    "greater than": ">", "more than": ">", "higher than": ">", "above": ">", "over": ">", "exceeding": ">", ">": ">",
+    "less than": "<", "lower than": "<", "below": "<", "under": "<", "<": "<",
+    "equal to": "=", "equals": "=", "=": "=",
+}
+DATE_BUCKETS = [
+    ("month", ["by month", "per month", "monthly", "each month", "every month"]),
+    ("year", ["by year", "per year", "yearly", "annual", "annually", "each year"]),
+    ("day", ["by day", "per day", "daily", "each day"]),
+]
+DATE_FORMATS = {"month": "%Y-%m", "year": "%Y", "day": "%Y-%m-%d"}
+
+
+def tokenize(text):
+    """Lowercase word tokens with a naive plural strip"""
+    return [singular(word) for word in re.findall(r"[a-z0-9]+", text.lower())]
+
+
+def singular(word):
+    """Strip a plural 's' so that 'loans' matches 'loan'"""
+    if len(word) > 3 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def quote_identifier(name):
+    """Double-quote a column name for SQLite"""
+    return '"' + name.replace('"', '""') + '"'
+
+
+def quote_value(value):
+    """Render a literal for SQL"""
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def parse_number(text):
+    """Parse a numeric literal from a question, keeping integers as int"""
+    return float(text) if "." in text else int(text)
+
+
+@lru_cache(maxsize=16)
+def parse_schema_catalogue(db_schema):
+    """
+    Build the planner catalogue from the schema text produced by get_db_schema(): a list of tables,
+    each with its columns, types, sample values and the value ranges and common values of the
+    ingest statistics.
+    """
+    tables = []
+    current = None
+    for line in db_schema.splitlines():
+        line = line.strip()
+        table_match = re.match(r"Table: (\w+)(?: \(from (.*), sheet (.*)\))?", line)
+        if table_match:
+            current = {"name": table_match.group(1), "workbook": table_match.group(2) or "",
+                       "sheet": table_match.group(3) or "", "columns": []}
+            tables.append(current)
+        elif line.startswith("Columns:") and current is not None:
+            for column in re.findall(r"([^,]+?) \((\w*)\)(?:, |$)", line[len("Columns:"):].strip()):
+                current["columns"].append({"name": column[0].strip(), "type": column[1].upper(), "samples": [],
+                                           "range": None, "common": []})
+        elif line.startswith("Sample data:") and current is not None:
+            try:
+                rows = json.loads(line[len("Sample data:"):].strip())
+            except ValueError:
+                continue
+            for column in current["columns"]:
+                column["samples"] = [row.get(column["name"]) for row in rows if row.get(column["name"]) is not None]
+        elif line.startswith(("Value ranges:", "Common values:")) and current is not None:
+            # Catalogue statistics: min/max of numeric and date columns, frequent values of categories
+            label, _, payload = line.partition(":")
+            try:
+                values = json.loads(payload.strip())
+            except ValueError:
+                continue
+            key = "range" if label == "Value ranges" else "common"
+            for column in current["columns"]:
+                if column["name"] in values:
+                    column[key] = values[column["name"]]
+    return tuple(freeze_table(table) for table in tables)
+
+
+def freeze_table(table):
+    """Attach token sets used for matching to a catalogue table"""
+    table["tokens"] = {token for token in tokenize(f"{table['name']} {table['sheet']}") if token not in GENERIC_TOKENS}
+    for column in table["columns"]:
+        # Frequent values from the catalogue cover categories the few sample rows miss
+        column["samples"] = list(dict.fromkeys(column["samples"] + column["common"]))
+        column["tokens"] = tokenize(column["name"])
+        column["phrase"] = " ".join(re.findall(r"[a-z0-9]+", column["name"].lower()))
+        column["numeric"] = column["type"] in ("REAL", "INTEGER", "NUMERIC", "FLOAT")
+        column["measure"] = column["numeric"] and not (set(column["tokens"]) & NON_MEASURE_TOKENS)
+        column["is_date"] = "date" in column["tokens"] or column["type"] in ("TIMESTAMP", "DATE", "DATETIME")
+    return table
+
+
+def column_match_score(column, text):
+    """How strongly a piece of question text refers to a column: 1 plus for a full-name match, else token overlap"""
+    words = tokenize(text)
+    if not words:
+        return 0.0
+    phrase = " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+    if re.search(r"\b" + re.escape(column["phrase"]) + r"s?\b", phrase):
+        return 1.0 + len(column["tokens"]) * 0.01
+    informative = [token for token in column["tokens"] if token not in GENERIC_TOKENS]
+    if not informative:
+        return 0.0
+    hits = sum(1 for token in informative if token in words)
+    return hits / len(informative)
+
+
+def best_column(columns, text, predicate=None, minimum=0.5):
+    """Column best matching text among those passing predicate, with its score"""
+    best, best_score = None, 0.0
+    for column in columns:
+        if predicate and not predicate(column):
+            continue
+        score = column_match_score(column, text)
+        if score > best_score:
+            best, best_score = column, score
+    return (best, best_score) if best_score >= minimum else (None, best_score)
+
+
+def choose_table(tables, question, value_hints=()):
+    """
+    Pick the table the question is about; returns (table, explicit) where explicit means the question named it.
+    value_hints are values found in the question by the value index; one held by a single table points at it.
+    """
+    words = set(tokenize(question))
+    hint_tables = defaultdict(set)
+    for hint in value_hints:
+        hint_tables[hint["text"].lower()].add(hint["table"])
+    scored = []
+    for position, table in enumerate(tables):
+        name_hits = len(table["tokens"] & words)
+        column_hits = sum(1 for column in table["columns"] if column_match_score(column, question) >= 1.0)
+        value_hits = sum(1 for column in table["columns"] if not column["numeric"]
+                         for sample in column["samples"] if isinstance(sample, str) and sample.lower() in words)
+        linked = sum(2 if len(names) == 1 else 1 for names in hint_tables.values() if table["name"] in names)
+        value_hits = max(value_hits, linked)
+        scored.append((name_hits * 3 + column_hits + value_hits * 0.5, name_hits, -position, table))
+    scored.sort(key=lambda item: item[:3], reverse=True)
+    score, name_hits, _, table = scored[0]
+    return table, name_hits > 0 or score >= 2
+
+
+def date_bucket_expression(column, granularity):
+    """Expression grouping a date column by month/year/day, handling yyyymmdd integers and Excel serials"""
+    fmt = DATE_FORMATS[granularity]
+    name = quote_identifier(column["name"])
+    numbers = [value for value in (column["range"] or column["samples"]) if isinstance(value, (int, float))]
+    if numbers and all(19000101 <= value <= 29991231 for value in numbers):
+        text = f"CAST({name} AS TEXT)"
+        return f"strftime('{fmt}', substr({text}, 1, 4) || '-' || substr({text}, 5, 2) || '-' || substr({text}, 7, 2))"
+    if numbers and all(1 <= value <= 100000 for value in numbers):
+        # Excel serial day numbers
+        return f"strftime('{fmt}', {name} + 2415018.5)"
+    return f"strftime('{fmt}', {name})"
+
+
+def scale_percent(column, value):
+    """Convert '5%' to 0.05 when the column stores rates as fractions"""
+    numbers = [abs(bound) for bound in (column["range"] or column["samples"]) if isinstance(bound, (int, float))]
+    if numbers and max(numbers) < 1:
+        return value / 100
+    return value
+
+
+def plan_query(question, db_schema, value_hints=()):
+    """
+    Plan a SQL query for simple questions without an LLM: aggregates, grouping (including by
+    month/year), top-N, ordering and filters on a named column. Returns a dict with the SQL,
+    a confidence between 0 and 1, the chosen table and the reasons behind the score.
+    value_hints are values named in the question with the columns holding them (see value_index).
+    """
+    tables = parse_schema_catalogue(db_schema)
+    if not tables:
+        return {"sql": "SELECT * FROM table_unknown LIMIT 10;", "confidence": 0.0, "table": None,
+                "reasons": ["no tables in schema"]}
+
+    text = re.sub(r"(?<=\d),(?=\d{3}\b)", "", question.lower()).strip()
+    reasons = []
+    confidence = 0.0
+
+    table, explicit = choose_table(tables, text, value_hints)
+    columns = table["columns"]
+    if explicit:
+        confidence += 0.35
+        reasons.append(f"table {table['name']} named in question")
+    else:
+        confidence += 0.1
+        reasons.append(f"table {table['name']} chosen by default")
+
+    # Clauses that introduce filters are matched separately from the measure/grouping text
+    filters = []
+    consumed = []
+
+    for match in BETWEEN_PATTERN.finditer(text):
+        before = text[:match.start()]
+        column, _ = best_column(columns, before[-60:], lambda c: c["numeric"])
+        column = column or best_column(columns, text, lambda c: c["measure"])[0]
+        if column is None:
+            confidence -= 0.3
+            reasons.append("range filter column not found")
+            continue
+        low, high = parse_number(match.group(1)), parse_number(match.group(3))
+        if match.group(2):
+            low, high = scale_percent(column, low), scale_percent(column, high)
+        filters.append(f"{quote_identifier(column['name'])} BETWEEN {quote_value(low)} AND {quote_value(high)}")
+        consumed.append(match.span())
+        reasons.append(f"range filter on {column['name']}")
+
+    for match in COMPARISON_PATTERN.finditer(text):
+        if any(start <= match.start() < end for start, end in consumed):
+            continue
+        before = text[:match.start()]
+        column, _ = best_column(columns, before[-60:], lambda c: c["numeric"])
+        column = column or best_column(columns, text, lambda c: c["measure"])[0]
+        if column is None:
+            confidence -= 0.3
+            reasons.append("comparison column not found")
+            continue
+        value = parse_number(match.group(2))
+        if match.group(3):
+            value = scale_percent(column, value)
+        filters.append(f"{quote_identifier(column['name'])} {COMPARISON_OPERATORS[match.group(1)]} {quote_value(value)}")
+        consumed.append(match.span())
+        reasons.append(f"comparison filter on {column['name']}")
+
+    # Quoted names and known categorical values become equality filters
+    words = set(re.findall(r"[a-z0-9_-]+", text))
+    quoted = re.findall(r"'([^']+)'|\"([^\"]+)\"", question)
+    for value in [a or b for a, b in quoted]:
+        column = next((c for c in columns if not c["numeric"]
+                       and any(str(sample).lower() == value.lower() for sample in c["samples"])), None)
+        if column is None:
+            before = text[:text.find(value.lower())] if value.lower() in text else text
+            column, _ = best_column(columns, before[-60:], lambda c: not c["numeric"])
+        if column is None:
+            confidence -= 0.3
+            reasons.append(f"no column found for value '{value}'")
+            continue
+        filters.append(f"{quote_identifier(column['name'])} = {quote_value(value)}")
+        reasons.append(f"value filter {column['name']} = '{value}'")
+    quoted_values = {(a or b).lower() for a, b in quoted}
+    linked_values = set(quoted_values)
+    for column in columns:
+        if column["numeric"]:
+            continue
+        for sample in dict.fromkeys(column["samples"]):
+            if (isinstance(sample, str) and len(sample) >= 2 and sample.lower() in words
+                    and sample.lower() not in STOPWORDS and sample.lower() not in quoted_values
+                    and singular(sample.lower()) not in table["tokens"]):
+                filters.append(f"{quote_identifier(column['name'])} = {quote_value(sample)}")
+                reasons.append(f"value filter {column['name']} = '{sample}'")
+                linked_values.add(sample.lower())
+    # Values the value index found in the question, on the column holding them most often
+    column_names = {column["name"] for column in columns}
+    hints = sorted((hint for hint in value_hints if hint["table"] == table["name"] and hint["column"] in column_names),
+                   key=lambda hint: hint["frequency"], reverse=True)
+    for hint in hints:
+        value = hint["value"]
+        if (value.lower() in linked_values or value.lower() in STOPWORDS
+                or singular(value.lower()) in table["tokens"]
+                or any(value.lower() == column["phrase"] for column in columns)):
+            continue
+        filters.append(f"{quote_identifier(hint['column'])} = {quote_value(value)}")
+        reasons.append(f"value filter {hint['column']} = '{value}' from value index")
+        linked_values.add(value.lower())
+
+    # Aggregate operation
+    operation = None
+    for op, keywords in AGGREGATE_KEYWORDS:
+        if any(re.search(r"\b" + re.escape(keyword) + r"\b", text) for keyword in keywords):
+            operation = op
+            break
+    distinct = re.search(r"\b(?:distinct|unique)\s+([a-z0-9 _-]+?)(?=\s+(?:in|from|of|for|where|by|with)\b|[?.,;]|$)", text)
+
+    # Top-N
+    top = TOP_PATTERN.search(text)
+    limit = None
+    descending = True
+    top_entity = None
+    if top:
+        limit = int(top.group(2))
+        descending = top.group(1) not in ("bottom", "smallest", "lowest")
+        top_entity = top.group(3)
+        if operation in ("MAX", "MIN"):
+            # "top 5 largest deposits" lists rows rather than taking a single maximum
+            operation = None
+        confidence += 0.15
+        reasons.append(f"top {limit}")
+
+    # Grouping: date buckets first, then "by <column>"
+    group_expression = None
+    group_alias = None
+    order_column = None
+    for granularity, phrases in DATE_BUCKETS:
+        if any(phrase in text for phrase in phrases):
+            date_column, _ = best_column(columns, text, lambda c: c["is_date"], minimum=1.0)
+            date_column = date_column or next((c for c in columns if c["is_date"]), None)
+            if date_column is None:
+                confidence -= 0.3
+                reasons.append("date grouping requested but no date column")
+            else:
+                group_expression = date_bucket_expression(date_column, granularity)
+                group_alias = granularity
+                confidence += 0.15
+                reasons.append(f"grouped by {granularity} of {date_column['name']}")
+            break
+    if group_expression is None:
+        for match in GROUP_PATTERN.finditer(text):
+            phrase = match.group(1).strip()
+            if phrase in ("month", "year", "day"):
+                continue
+            column, _ = best_column(columns, phrase)
+            if column is None:
+                continue
+            if column["measure"]:
+                # "top 5 customers by balance": a measure after "by" is the ordering, not the grouping
+                order_column = column
+                continue
+            group_expression = quote_identifier(column["name"])
+            group_alias = None
+            confidence += 0.15
+            reasons.append(f"grouped by {column['name']}")
+            break
+    if group_expression is None and top_entity:
+        column, _ = best_column(columns, top_entity, lambda c: not c["measure"])
+        if column is not None and not column["is_date"]:
+            group_expression = quote_identifier(column["name"])
+            reasons.append(f"top {limit} {column['name']}")
+            operation = operation or "SUM"
+    if group_expression is None and re.search(r"\b(by|per|for each|group)\b", text) and not order_column:
+        by_phrase = GROUP_PATTERN.search(text)
+        if by_phrase and by_phrase.group(1).strip() not in ("month", "year", "day"):
+            confidence -= 0.3
+            reasons.append(f"grouping '{by_phrase.group(1).strip()}' not resolved")
+
+    # Measure column: mentioned numeric column, else the first amount-like column
+    measure_text = text
+    for start, end in sorted(consumed, reverse=True):
+        measure_text = measure_text[:start] + " " + measure_text[end:]
+    measure, measure_score = best_column(columns, measure_text, lambda c: c["measure"])
+    if order_column is not None:
+        measure, measure_score = order_column, 1.0
+    if measure is None:
+        measure = next((c for c in columns if c["measure"] and set(c["tokens"]) & MEASURE_TOKENS
+                        and "lcy" not in c["tokens"]), None) or next((c for c in columns if c["measure"]), None)
+        needs_measure = operation in ("AVG", "SUM", "MAX", "MIN") or (limit and not group_expression)
+        if needs_measure:
+            confidence += 0.05 if measure is not None else -0.3
+            reasons.append(f"measure {measure['name']} inferred" if measure is not None else "no measure column")
+    else:
+        confidence += 0.25
+        reasons.append(f"measure {measure['name']} named in question")
+
+    if operation:
+        confidence += 0.2
+        reasons.append(f"operation {operation}")
+    if operation == "COUNT" and not distinct:
+        # Row counts need no measure column
+        confidence += 0.1
+
+    # Explicit ordering
+    order = ORDER_PATTERN.search(text)
+    order_by = None
+    if order:
+        column, _ = best_column(columns, order.group(1))
+        if column is not None:
+            direction = "ASC" if order.group(2) in ("asc", "ascending") else "DESC"
+            order_by = f"{quote_identifier(column['name'])} {direction}"
+            reasons.append(f"ordered by {column['name']}")
+        else:
+            confidence -= 0.2
+            reasons.append(f"ordering '{order.group(1)}' not resolved")
+
+    # Assemble SQL
+    where = f" WHERE {' AND '.join(filters)}" if filters else ""
+    if filters:
+        confidence += 0.05
+    if operation == "COUNT":
+        counted = "*"
+        if distinct:
+            target, _ = best_column(columns, distinct.group(1), lambda c: not c["measure"])
+            counted = f"DISTINCT {quote_identifier(target['name'])}" if target else "*"
+        aggregate = f"COUNT({counted})"
+    elif operation and measure is not None:
+        aggregate = f"{operation}({quote_identifier(measure['name'])})"
+    else:
+        aggregate = None
+
+    alias = AGGREGATE_ALIASES.get(operation, "total") if aggregate else None
+    if group_expression:
+        group_select = f"{group_expression} AS {group_alias}" if group_alias else group_expression
+        group_ref = group_alias or group_expression
+        if aggregate is None:
+            aggregate = f"SUM({quote_identifier(measure['name'])})" if measure is not None else "COUNT(*)"
+            alias = "total" if measure is not None else "count"
+        sql = f"SELECT {group_select}, {aggregate} AS {alias} FROM {table['name']}{where} GROUP BY {group_ref}"
+        if limit:
+            sql += f" ORDER BY {alias} {'DESC' if descending else 'ASC'} LIMIT {limit}"
+        elif order_by:
+            sql += f" ORDER BY {order_by}"
+        else:
+            sql += f" ORDER BY {group_ref}" if group_alias else f" ORDER BY {alias} DESC"
+    elif aggregate:
+        sql = f"SELECT {aggregate} AS {alias} FROM {table['name']}{where}"
+    else:
+        sql = f"SELECT * FROM {table['name']}{where}"
+        if limit and measure is not None:
+            sql += f" ORDER BY {quote_identifier(measure['name'])} {'DESC' if descending else 'ASC'} LIMIT {limit}"
+        elif order_by:
+            sql += f" ORDER BY {order_by}"
+            if not filters:
+                sql += " LIMIT 10"
+        elif not filters:
+            sql += " LIMIT 10"
+            reasons.append("no operation recognised, listing rows")
+        else:
+            confidence += 0.1
+            reasons.append("filtered listing")
+    sql += ";"
+
+    return {
+        "sql": sql,
+        "confidence": round(max(0.0, min(1.0, confidence)), 2),
+        "table": table["name"],
+        "operation": operation,
+        "reasons": reasons,
+    }
@@ -0,0 +1,244 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+import pandas as pd
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Wall-clock budget for executing one query
+SQL_TIME_BUDGET_SECONDS = float(os.getenv("SQL_TIME_BUDGET_SECONDS", "10"))
+# Rows returned to the caller; longer results are cut off and flagged as truncated
+SQL_MAX_ROWS = int(os.getenv("SQL_MAX_ROWS", "10000"))
+# Largest number of row combinations the query plan may visit, e.g. a join of two scanned tables
+SQL_MAX_SCAN_ROWS = int(os.getenv("SQL_MAX_SCAN_ROWS", "10000000"))
+# SQLite VM instructions between two checks of the time budget
+PROGRESS_CHECK_INSTRUCTIONS = 10000
+# Streamed results hold no rows in memory, so they may be longer than buffered ones
+SQL_MAX_STREAM_ROWS = int(os.getenv("SQL_MAX_STREAM_ROWS", "1000000"))
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "1000"))
+
+# Authorizer actions a read-only query needs; everything else (writes, DDL, ATTACH, PRAGMA) is denied
+READ_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+                getattr(sqlite3, 'SQLITE_RECURSIVE', 33)}
+
+# Table references in FROM/JOIN clauses with their optional alias
+TABLE_REFERENCE_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN)\s+("(?:[^"]|"")+"|\[[^\]]+\]|`[^`]+`|\w+)(?:\s+(?:AS\s+)?(?!(?:ON|USING|WHERE|JOIN|INNER|LEFT|'
+    r'RIGHT|CROSS|NATURAL|FULL|OUTER|GROUP|ORDER|LIMIT|HAVING|UNION|EXCEPT|INTERSECT|WINDOW)\b)(\w+))?',
+    re.IGNORECASE)
+
+
+class SQLGuardError(Exception):
+    """A query rejected before or stopped during execution, with a machine-readable code"""
+    def __init__(self, code, message, details=None):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.details = details or {}
+
+    def to_dict(self):
+        return {'code': self.code, 'message': self.message, 'details': self.details}
+
+
+def _authorize_read_only(action, arg1, arg2, db_name, trigger):
+    return sqlite3.SQLITE_OK if action in READ_ACTIONS else sqlite3.SQLITE_DENY
+
+
+def _unquote(name):
+    if name[0] in '"[`':
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+# Row counts per table, keyed by database path and version
+_row_count_cache = {}
+_row_count_lock = threading.Lock()
+
+def table_row_count(conn, table, db_path=None):
+    """Row count of a table from the ingest catalogue or, for other tables, counted once per database version"""
+    version = None
+    if db_path:
+        from db_pool import database_version
+        from catalog import table_row_counts
+        version = database_version(db_path)
+        with _row_count_lock:
+            cached = _row_count_cache.get(db_path)
+            if cached and cached[0] == version and table in cached[1]:
+                return cached[1][table]
+        if not cached or cached[0] != version:
+            counts = table_row_counts(conn)
+            with _row_count_lock:
+                cached = _row_count_cache[db_path] = (version, counts)
+            if table in counts:
+                return counts[table]
+    count = conn.execute(f'SELECT COUNT(*) FROM "{table.replace(chr(34), chr(34) * 2)}"').fetchone()[0]
+    if db_path:
+        with _row_count_lock:
+            cached = _row_count_cache.get(db_path)
+            if not cached or cached[0] != version:
+                cached = _row_count_cache[db_path] = (version, {})
+            cached[1][table] = count
+    return count
+
+
+def estimate_scan_rows(conn, sql, plan, db_path=None):
+    """
+    Estimate the row combinations a query plan visits: full scans nested in the same loop multiply,
+    correlated subqueries run once per outer row and indexed searches count as a single row.
+    Scans of CTEs and subqueries are sized like the largest table the query reads.
+    """
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    aliases = {}
+    for name, alias in TABLE_REFERENCE_PATTERN.findall(sql):
+        name = _unquote(name)
+        if name in tables:
+            aliases[name] = name
+            if alias:
+                aliases[alias] = name
+    counts = {table: table_row_count(conn, table, db_path) for table in set(aliases.values())}
+    largest = max(counts.values(), default=1)
+
+    loop_rows = defaultdict(lambda: 1)
+    multiplier = {0: 1}
+    worst = 0
+    for node_id, parent, _, detail in plan:
+        outer = multiplier.get(parent, 1)
+        if detail.startswith('CORRELATED'):
+            multiplier[node_id] = outer * loop_rows[parent]
+        else:
+            multiplier[node_id] = outer
+        if detail.startswith('SCAN ') and not detail.startswith('SCAN CONSTANT ROW'):
+            name = detail.split()[1]
+            loop_rows[parent] *= max(counts.get(aliases.get(name), largest), 1)
+            worst = max(worst, outer * loop_rows[parent])
+    return worst
+
+
+def validate_query(conn, sql, params=None, db_path=None, max_scan_rows=None):
+    """
+    Check a query before it runs: it must be a single read-only statement and its plan must not
+    visit more than max_scan_rows row combinations. Raises SQLGuardError otherwise.
+    """
+    max_scan_rows = max_scan_rows or SQL_MAX_SCAN_ROWS
+    conn.set_authorizer(_authorize_read_only)
+    try:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+    except sqlite3.DatabaseError as e:
+        if 'not authorized' in str(e):
+            raise SQLGuardError('not_read_only', "Only read-only SELECT queries can be executed")
+        raise SQLGuardError('invalid_sql', f"Invalid SQL: {e}")
+    except sqlite3.Warning as e:
+        raise SQLGuardError('invalid_sql', f"Invalid SQL: {e}")
+    finally:
+        conn.set_authorizer(None)
+
+    estimated = estimate_scan_rows(conn, sql, plan, db_path)
+    if estimated > max_scan_rows:
+        raise SQLGuardError('too_expensive',
+                            f"Query would scan about {estimated:,} row combinations (limit {max_scan_rows:,}); "
+                            "add a join condition or a filter",
+                            {'estimatedRows': estimated, 'limit': max_scan_rows,
+                             'plan': [row[3] for row in plan]})
+    return plan
+
+
+@contextmanager
+def execution_limits(conn, budget, authorize=False):
+    """
+    Run SQLite work on conn against the time left in budget (a dict with 'total' and 'remaining'
+    seconds), charging the time spent to it. Raises SQLGuardError once the budget is used up.
+    """
+    started = time.perf_counter()
+    deadline = started + budget['remaining']
+    conn.set_progress_handler(lambda: 1 if time.perf_counter() > deadline else 0, PROGRESS_CHECK_INSTRUCTIONS)
+    if authorize:
+        conn.set_authorizer(_authorize_read_only)
+    try:
+        yield
+    except sqlite3.OperationalError as e:
+        if 'interrupted' in str(e):
+            raise SQLGuardError('timeout', f"Query exceeded the time budget of {budget['total']:g}s",
+                                {'timeBudgetSeconds': budget['total']})
+        raise
+    finally:
+        budget['remaining'] -= time.perf_counter() - started
+        conn.set_progress_handler(None, 0)
+        if authorize:
+            conn.set_authorizer(None)
+
+
+def run_guarded_query(conn, sql, params=None, db_path=None, time_budget=None, max_rows=None, report_truncation=True):
+    """
+    Validate and execute a query within a wall-clock budget, returning at most max_rows rows as a
+    DataFrame (df.attrs['truncated'] tells whether rows were cut off). Raises SQLGuardError when
+    the query is rejected or runs out of time.
+    """
+    time_budget = time_budget or SQL_TIME_BUDGET_SECONDS
+    max_rows = max_rows or SQL_MAX_ROWS
+    validate_query(conn, sql, params, db_path)
+
+    cursor = conn.cursor()
+    try:
+        with execution_limits(conn, {'total': time_budget, 'remaining': time_budget}, authorize=True):
+            cursor.execute(sql, params or ())
+            columns = [column[0] for column in cursor.description or []]
+            rows = cursor.fetchmany(max_rows + 1)
+    finally:
+        cursor.close()
+
+    truncated = len(rows) > max_rows
+    result = pd.DataFrame.from_records(rows[:max_rows], columns=columns, coerce_float=True)
+    result.attrs['truncated'] = truncated
+    if truncated and report_truncation:
+        print(f"Result truncated to {max_rows} rows")
+    return result
+
+
+def stream_guarded_query(conn, sql, params=None, db_path=None, time_budget=None, max_rows=None,
+                         chunk_rows=STREAM_CHUNK_ROWS):
+    """
+    Validate and start a query, returning (columns, chunks, status): chunks yields lists of up to
+    chunk_rows rows straight from the cursor and status records the rows sent and whether the
+    result was cut off at max_rows. The time budget counts only time spent inside SQLite, not time
+    waiting for the client. Rejections raise SQLGuardError here; a timeout while fetching is
+    raised by the iterator.
+    """
+    time_budget = time_budget or SQL_TIME_BUDGET_SECONDS
+    max_rows = max_rows or SQL_MAX_STREAM_ROWS
+    validate_query(conn, sql, params, db_path)
+
+    budget = {'total': time_budget, 'remaining': time_budget}
+    cursor = conn.cursor()
+    try:
+        with execution_limits(conn, budget, authorize=True):
+            cursor.execute(sql, params or ())
+    except Exception:
+        cursor.close()
+        raise
+    columns = [column[0] for column in cursor.description or []]
+    status = {'rowCount': 0, 'truncated': False}
+
+    def chunks():
+        try:
+            while True:
+                with execution_limits(conn, budget):
+                    rows = cursor.fetchmany(min(chunk_rows, max_rows - status['rowCount'] + 1))
+                if not rows:
+                    return
+                if status['rowCount'] + len(rows) > max_rows:
+                    rows = rows[:max_rows - status['rowCount']]
+                    status['truncated'] = True
+                status['rowCount'] += len(rows)
+                if rows:
+                    yield rows
+                if status['truncated']:
+                    return
+        finally:
+            cursor.close()
+
+    return columns, chunks(), status
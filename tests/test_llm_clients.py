@@ -0,0 +1,104 @@
+import time
+import httpx
+import groq
+import pytest
+import llm_clients
+from llm_clients import OllamaClient, complete_first
+from llm_stub_server import start_stub_server
+
+
+@pytest.fixture
+def stub():
+    """Start stub servers on free ports and route named providers to them"""
+    servers = []
+
+    def start(provider, sql="SELECT 1", delay=0.0, status=200):
+        server, url = start_stub_server(sql=sql, delay=delay, status=status)
+        servers.append(server)
+        client = OllamaClient(base_url=url, model="stub", http_client=httpx.Client())
+        llm_clients.PROVIDERS[provider] = lambda system, user, timeout: (client.invoke(user, timeout=timeout), None)
+        return url
+
+    saved = dict(llm_clients.PROVIDERS)
+    yield start
+    llm_clients.PROVIDERS.clear()
+    llm_clients.PROVIDERS.update(saved)
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def groq_stub(monkeypatch):
+    """Start a stub server and point the real Groq provider at it through GROQ_BASE_URL"""
+    servers = []
+
+    def start(sql="SELECT 1", delay=0.0, status=200):
+        server, url = start_stub_server(sql=sql, delay=delay, status=status)
+        servers.append(server)
+        monkeypatch.setattr(llm_clients, 'GROQ_API_KEY', "test")
+        monkeypatch.setattr(llm_clients, 'GROQ_BASE_URL', url)
+        monkeypatch.setattr(llm_clients, '_groq_client', None)
+        return url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_slow_primary_loses_to_hedge(stub):
+    stub('primary', sql="SELECT 'primary'", delay=2.0)
+    stub('fallback', sql="SELECT 'fallback'")
+    started = time.monotonic()
+    result = complete_first("system", "question", ['primary', 'fallback'], deadline=5, hedge_seconds=0.2)
+    assert result['provider'] == 'fallback'
+    assert result['text'] == "SELECT 'fallback'"
+    assert time.monotonic() - started < 1.5
+
+
+def test_timeout_raises_and_deadline_returns_none(stub):
+    url = stub('slow', delay=1.0)
+    with pytest.raises(httpx.TimeoutException):
+        OllamaClient(base_url=url, model="stub", http_client=httpx.Client()).invoke("question", timeout=0.2)
+    assert complete_first("system", "question", ['slow'], deadline=0.3, hedge_seconds=0.1) is None
+
+
+def test_server_error_falls_through_to_next_client(stub):
+    stub('primary', status=503)
+    stub('fallback', sql="SELECT 'fallback'")
+    started = time.monotonic()
+    # The fallback starts as soon as the primary fails, well before the hedge delay
+    result = complete_first("system", "question", ['primary', 'fallback'], deadline=5, hedge_seconds=3)
+    assert result['provider'] == 'fallback'
+    assert time.monotonic() - started < 2
+    assert llm_clients.get_llm_stats()['primary']['failed'] >= 1
+
+
+def test_groq_answers_through_base_url(groq_stub):
+    groq_stub(sql="SELECT 'groq'")
+    result = complete_first("system", "question", ['groq'], deadline=5)
+    assert result['provider'] == 'groq'
+    assert result['text'] == "SELECT 'groq'"
+
+
+def test_groq_timeout_is_not_retried(groq_stub):
+    groq_stub(delay=1.0)
+    started = time.monotonic()
+    with pytest.raises(groq.APITimeoutError):
+        llm_clients.call_groq("system", "question", timeout=0.2)
+    # A retried call would wait for the timeout again after a backoff
+    assert time.monotonic() - started < 0.6
+    assert complete_first("system", "question", ['groq'], deadline=0.3, hedge_seconds=0.1) is None
+
+
+def test_groq_server_error_falls_through_to_next_client(stub, groq_stub):
+    groq_stub(status=500)
+    stub('fallback', sql="SELECT 'fallback'")
+    failed = llm_clients.get_llm_stats().get('groq', {}).get('failed', 0)
+    started = time.monotonic()
+    result = complete_first("system", "question", ['groq', 'fallback'], deadline=5, hedge_seconds=3)
+    assert result['provider'] == 'fallback'
+    # Without retries the 500 reaches the fallback at once, not after the SDK's backoff
+    assert time.monotonic() - started < 0.5
+    assert llm_clients.get_llm_stats()['groq']['failed'] == failed + 1
@@ -0,0 +1,36 @@
+from rule_planner import plan_query
+from query_cache import TranslationCache, parameterize_sql, bind_parameters, render_sql
+
+SCHEMA = """Table: Deposits (from Deposits.xlsx, sheet Deposits)
+Columns: Business Date (INTEGER), Branch Code (TEXT), Current Balance (REAL)
+Sample data: [{"Business Date": 20221231, "Branch Code": "DEL", "Current Balance": 100.5}]
+Value ranges: {"Business Date": [20220101, 20221231], "Current Balance": [0, 1000]}"""
+
+
+def answer_from_template(question, other_question):
+    """SQL for other_question from the template cached for question, or None when no template was made"""
+    template = parameterize_sql(question, plan_query(question, SCHEMA)['sql'])
+    if template is None:
+        return None
+    sql, param_map = template
+    return render_sql(sql, bind_parameters(other_question, param_map))
+
+
+def test_template_matches_planner_for_other_limit():
+    sql = answer_from_template("top 5 by current balance", "top 12 by current balance")
+    assert sql == plan_query("top 12 by current balance", SCHEMA)['sql']
+
+
+def test_literal_used_twice_in_sql_is_not_parameterized():
+    # LIMIT 5 and the month bucket's substr(..., 5, 2) must not share one placeholder
+    question = "total current balance per month, top 5"
+    assert "substr" in plan_query(question, SCHEMA)['sql']
+    assert parameterize_sql(question, plan_query(question, SCHEMA)['sql']) is None
+    assert answer_from_template(question, "total current balance per month, top 12") is None
+
+
+def test_exact_cache_keeps_the_case_of_quoted_literals(tmp_path):
+    cache = TranslationCache(str(tmp_path / "translations.db"))
+    cache.put("Total balance for branch 'ACME'", "schema", "SELECT 'ACME'")
+    assert cache.get("total balance for branch 'ACME'?", "schema") == "SELECT 'ACME'"
+    assert cache.get("total balance for branch 'acme'", "schema") is None
@@ -0,0 +1,44 @@
+import sqlite3
+import pytest
+from result_pages import ResultSet
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "pages.db")
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE "Loans" ("Loan ID" INTEGER, "Branch Code" TEXT)')
+    conn.executemany('INSERT INTO "Loans" VALUES (?, ?)',
+                     [(number, 'DEL' if number % 2 else 'BOM') for number in range(1000)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def page_through_by_cursor(result_set, limit):
+    """Read every page passing only the cursor back, the way an API client continues; returns the rows read"""
+    result, has_more, cursor = result_set.page(limit=limit)
+    rows = len(result)
+    while has_more:
+        result, has_more, cursor = result_set.page(limit=limit, after=cursor)
+        rows += len(result)
+    return rows
+
+
+@pytest.mark.parametrize("sql, expected", [
+    ('SELECT * FROM "Loans"', 1000),
+    ("SELECT * FROM \"Loans\" WHERE \"Branch Code\" = 'DEL'", 500),
+])
+def test_count_after_paging_by_cursor_only(db_path, sql, expected):
+    result_set = ResultSet(sql, [], db_path)
+    assert page_through_by_cursor(result_set, 200) == expected
+    assert result_set.count() == expected
+
+
+def test_cursor_from_unknown_position_leaves_count_to_query(db_path):
+    result_set = ResultSet('SELECT * FROM "Loans"', [], db_path)
+    # A cursor this handle never returned: the last page's position is unknown
+    result, has_more, _ = result_set.page(limit=200, after=900)
+    assert len(result) == 100 and not has_more
+    assert result_set.total is None
+    assert result_set.count() == 1000
@@ -0,0 +1,124 @@
+import os
+import re
+import sqlite3
+import threading
+from collections import defaultdict
+from dotenv import load_dotenv
+from db_pool import read_connection, database_version
+
+load_dotenv()
+
+# Text columns with more distinct values than this (free text, descriptions) are not indexed
+VALUE_INDEX_MAX_DISTINCT = int(os.getenv("VALUE_INDEX_MAX_DISTINCT", "20000"))
+# Longest value, in characters and in words, that can be named in a question
+VALUE_INDEX_MAX_LENGTH = 64
+VALUE_INDEX_MAX_WORDS = 4
+
+# Words never taken as a value on their own, even if a column holds them
+COMMON_WORDS = {"a", "an", "and", "all", "are", "by", "for", "from", "in", "is", "me", "of", "on", "or", "per",
+                "show", "list", "the", "to", "what", "which", "with", "each", "every", "get", "give", "find",
+                "total", "count", "average", "sum", "top", "yes", "no", "none", "other", "others"}
+QUESTION_WORD_PATTERN = re.compile(r"[\w][\w&./'-]*")
+
+
+def value_key(value):
+    """Lookup key of a value: lowercased with whitespace collapsed"""
+    return " ".join(str(value).lower().split())
+
+
+def build_value_index(conn):
+    """
+    Record every distinct value of the text columns catalogued at ingest with the table and column
+    holding it and how often it occurs. Run after build_catalog().
+    """
+    cursor = conn.cursor()
+    cursor.execute("DROP TABLE IF EXISTS value_dictionary")
+    cursor.execute("""
+    CREATE TABLE value_dictionary (
+        value_key TEXT,
+        value TEXT,
+        table_name TEXT,
+        column_name TEXT,
+        frequency INTEGER
+    )
+    """)
+    columns = cursor.execute("""
+        SELECT table_name, column_name FROM column_stats
+        WHERE histogram = 'null' AND distinct_count BETWEEN 1 AND ?
+    """, (VALUE_INDEX_MAX_DISTINCT,)).fetchall()
+    entries = 0
+    for table_name, column_name in columns:
+        column = '"' + column_name.replace('"', '""') + '"'
+        rows = cursor.execute(
+            f'SELECT {column}, COUNT(*) FROM "{table_name}" WHERE typeof({column}) = \'text\' '
+            f'AND length({column}) <= ? GROUP BY {column}', (VALUE_INDEX_MAX_LENGTH,)).fetchall()
+        rows = [(value_key(value), value, table_name, column_name, count) for value, count in rows
+                if value_key(value) and len(value_key(value).split()) <= VALUE_INDEX_MAX_WORDS]
+        cursor.executemany("INSERT INTO value_dictionary VALUES (?, ?, ?, ?, ?)", rows)
+        entries += len(rows)
+    cursor.execute("CREATE INDEX idx_value_dictionary_key ON value_dictionary (value_key)")
+    conn.commit()
+    print(f"Indexed {entries} distinct values from {len(columns)} text columns")
+    return entries
+
+
+class ValueIndex:
+    """In-memory map from values to the (table, column) pairs holding them, for linking question words to columns"""
+    def __init__(self, rows):
+        self.entries = defaultdict(list)
+        for key, value, table_name, column_name, frequency in rows:
+            self.entries[key].append({'value': value, 'table': table_name, 'column': column_name,
+                                      'frequency': frequency})
+
+    @classmethod
+    def load(cls, conn):
+        """Read the value dictionary written at ingest; empty for databases ingested before it existed"""
+        try:
+            return cls(conn.execute("SELECT value_key, value, table_name, column_name, frequency FROM value_dictionary"))
+        except sqlite3.OperationalError:
+            return cls([])
+
+    def find(self, question):
+        """
+        Values named in a question, longest phrase first: a list of {'value', 'table', 'column',
+        'frequency', 'text'} where text is the phrase as written. Words inside a longer match are
+        not matched again.
+        """
+        words = [(match.group(0).rstrip(".'-"), match.start()) for match in QUESTION_WORD_PATTERN.finditer(question)]
+        keys = [word.lower() for word, _ in words]
+        used = set()
+        matches = []
+        for size in range(min(VALUE_INDEX_MAX_WORDS, len(words)), 0, -1):
+            for start in range(len(words) - size + 1):
+                span = range(start, start + size)
+                if used.intersection(span):
+                    continue
+                key = " ".join(keys[start:start + size])
+                if key not in self.entries or (size == 1 and (key in COMMON_WORDS or len(key) < 2)):
+                    continue
+                if key.isdigit():
+                    continue
+                text = question[words[start][1]:words[start + size - 1][1] + len(words[start + size - 1][0])]
+                matches.extend(dict(entry, text=text) for entry in self.entries[key])
+                used.update(span)
+        return matches
+
+
+_value_indexes = {}
+_value_index_lock = threading.Lock()
+
+def get_value_index(db_path):
+    """Return the value index of a database, reloaded after each ingest"""
+    version = database_version(db_path)
+    key = os.path.abspath(db_path)
+    with _value_index_lock:
+        cached = _value_indexes.get(key)
+        if cached is None or cached[0] != version:
+            with read_connection(db_path) as conn:
+                cached = _value_indexes[key] = (version, ValueIndex.load(conn))
+    return cached[1]
+
+
+def find_value_mentions(question, db_path):
+    """Values named in a question with the columns that hold them"""
+    return get_value_index(db_path).find(question)
@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+
+INDEX_VECTORS_FILE = "index.npy"
+INDEX_METADATA_FILE = "index.json"
+
+
+class IndexedDocument:
+    """Minimal document returned by similarity search, compatible with LangChain's page_content access"""
+    def __init__(self, page_content, metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+    def __repr__(self):
+        return f"IndexedDocument({self.page_content[:50]!r})"
+
+
+def content_hash(text):
+    """Stable hash identifying a chunk by its content"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def embedding_signature(embedding):
+    """Identify the model that produced an index's vectors, so switching models re-embeds it"""
+    return getattr(embedding, 'signature', None) or getattr(embedding, 'model_name', None) or type(embedding).__name__
+
+
+def normalize_rows(vectors):
+    """Scale each row to unit length so a dot product equals cosine similarity"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore:
+    """
+    In-process vector index: normalized embeddings in a memory-mapped .npy file,
+    chunk texts and metadata in a JSON file next to it. Each chunk carries a content
+    hash and the index is stamped with the schema fingerprint it was built from.
+    """
+    def __init__(self, vectors, texts, embedding, persist_directory=None, metadatas=None, fingerprint=None):
+        self.vectors = vectors
+        self.texts = list(texts)
+        self.metadatas = list(metadatas) if metadatas is not None else [{} for _ in self.texts]
+        self.embedding = embedding
+        self.persist_directory = persist_directory
+        self.fingerprint = fingerprint
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_texts(cls, texts, embedding, persist_directory=None, fingerprint=None):
+        """Embed texts and build a new index, writing it to persist_directory if given"""
+        store = cls(np.zeros((0, 0), dtype=np.float32), [], embedding, persist_directory)
+        store.sync_texts(texts, fingerprint)
+        if persist_directory:
+            store.persist()
+        return store
+
+    @classmethod
+    def load(cls, persist_directory, embedding):
+        """Open a persisted index, memory-mapping the embedding matrix"""
+        with open(os.path.join(persist_directory, INDEX_METADATA_FILE), 'r') as f:
+            metadata = json.load(f)
+        if metadata.get("embedding") != embedding_signature(embedding):
+            # Vectors from another model are not comparable; an empty unstamped index is rebuilt on the next sync
+            print("Vector index was built with a different embedding model, it will be re-embedded")
+            return cls(np.zeros((0, 0), dtype=np.float32), [], embedding, persist_directory)
+        vectors = np.load(os.path.join(persist_directory, INDEX_VECTORS_FILE), mmap_mode='r')
+        return cls(vectors, metadata["texts"], embedding, persist_directory,
+                   metadata.get("metadatas"), metadata.get("fingerprint"))
+
+    @staticmethod
+    def exists(persist_directory):
+        """Check whether a persisted index is present in the directory"""
+        return (os.path.exists(os.path.join(persist_directory, INDEX_VECTORS_FILE)) and
+                os.path.exists(os.path.join(persist_directory, INDEX_METADATA_FILE)))
+
+    def persist(self):
+        """Write the embedding matrix and metadata to disk, replacing the previous files atomically"""
+        if not self.persist_directory:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        vectors_path = os.path.join(self.persist_directory, INDEX_VECTORS_FILE)
+        metadata_path = os.path.join(self.persist_directory, INDEX_METADATA_FILE)
+        with open(vectors_path + ".tmp", 'wb') as f:
+            np.save(f, np.asarray(self.vectors))
+        with open(metadata_path + ".tmp", 'w') as f:
+            json.dump({"fingerprint": self.fingerprint, "embedding": embedding_signature(self.embedding),
+                       "texts": self.texts, "metadatas": self.metadatas}, f)
+        os.replace(vectors_path + ".tmp", vectors_path)
+        os.replace(metadata_path + ".tmp", metadata_path)
+
+    def sync_texts(self, texts, fingerprint=None, metadatas=None):
+        """
+        Bring the index in line with texts: chunks whose content hash is already indexed
+        keep their embedding, new chunks are embedded and chunks no longer present are dropped.
+        Returns (added, removed) counts.
+        """
+        texts = list(texts)
+        metadatas = metadatas if metadatas is not None else [{} for _ in texts]
+        wanted = {}
+        wanted_metadata = {}
+        for text, metadata in zip(texts, metadatas):
+            text_hash = content_hash(text)
+            if text_hash not in wanted:
+                wanted[text_hash] = text
+                wanted_metadata[text_hash] = dict(metadata, hash=text_hash)
+
+        with self._lock:
+            existing = {meta.get("hash"): i for i, meta in enumerate(self.metadatas)}
+            new_hashes = [h for h in wanted if h not in existing]
+            removed = sum(1 for h in existing if h not in wanted)
+
+            if not new_hashes and not removed:
+                self.fingerprint = fingerprint or self.fingerprint
+                return 0, 0
+
+            new_vectors = {}
+            if new_hashes:
+                embedded = normalize_rows(self.embedding.embed_documents([wanted[h] for h in new_hashes]))
+                new_vectors = dict(zip(new_hashes, embedded))
+
+            rows = [new_vectors[h] if h in new_vectors else np.asarray(self.vectors[existing[h]])
+                    for h in wanted]
+            self.vectors = np.vstack(rows).astype(np.float32) if rows else np.zeros((0, 0), dtype=np.float32)
+            self.texts = list(wanted.values())
+            self.metadatas = [wanted_metadata[h] for h in wanted]
+            self.fingerprint = fingerprint or self.fingerprint
+            return len(new_hashes), removed
+
+    def similarity_search_by_vector_with_score(self, query_vector, k=4):
+        """Return the top-k (document, cosine similarity) pairs for an embedded query"""
+        with self._lock:
+            vectors, texts, metadatas = self.vectors, self.texts, self.metadatas
+        if len(texts) == 0:
+            return []
+        scores = vectors @ normalize_rows(query_vector)[0]
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(IndexedDocument(texts[i], metadatas[i]), float(scores[i])) for i in top]
+
+    def similarity_search_by_vectors_with_score(self, query_vectors, k=4):
+        """Return the top-k (document, cosine similarity) pairs for each of several embedded queries in one matrix product"""
+        with self._lock:
+            vectors, texts, metadatas = self.vectors, self.texts, self.metadatas
+        if len(texts) == 0:
+            return [[] for _ in query_vectors]
+        scores = normalize_rows(query_vectors) @ np.asarray(vectors).T
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in zip(scores, top):
+            ordered = candidates[np.argsort(-row[candidates])]
+            results.append([(IndexedDocument(texts[i], metadatas[i]), float(row[i])) for i in ordered])
+        return results
+
+    def similarity_search_by_vector(self, embedding, k=4):
+        """Return the top-k most similar documents for an embedded query"""
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query, k=4):
+        """Embed the query and return the top-k (document, cosine similarity) pairs"""
+        return self.similarity_search_by_vector_with_score(self.embedding.embed_query(query), k)
+
+    def similarity_search(self, query, k=4):
+        """Embed the query and return the top-k most similar documents"""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]